@@ -0,0 +1,226 @@
+"""
+Block gzip (BGZF) output and tabix (.tbi) indexing of VCFs, as bgzip and tabix make,
+and reading of BGZF blocks, which inflate independently of each other.
+See the SAM/BAM and tabix specifications: https://samtools.github.io/hts-specs/
+"""
+
+import struct
+import zlib
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterable, Iterator, List
+
+from cortex.file_manip import PathLike, _vcf_is_sorted
+
+# Uncompressed bytes per block, leaving room for incompressible data in 64KiB
+_MAX_BLOCK_DATA = 0xFF00
+_MAX_BLOCK_SIZE = 0x10000
+_BLOCK_HEADER = struct.Struct("<4BI2BH2BHH")
+_EOF_BLOCK = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+_TBI_VCF_FORMAT = 2
+_LINEAR_INDEX_SHIFT = 14
+
+
+class BgzfWriter:
+    """Writes BGZF blocks to a binary file, tracking virtual offsets"""
+
+    def __init__(self, handle: BinaryIO, compresslevel: int = 6):
+        self.handle = handle
+        self.compresslevel = compresslevel
+        self.block_offset = 0  # Compressed offset of the current block
+        self.buffer = bytearray()
+
+    def tell(self) -> int:
+        """Virtual offset of the next byte written"""
+        return (self.block_offset << 16) | len(self.buffer)
+
+    def write(self, data: bytes):
+        while data:
+            space = _MAX_BLOCK_DATA - len(self.buffer)
+            self.buffer += data[:space]
+            data = data[space:]
+            if len(self.buffer) == _MAX_BLOCK_DATA:
+                self._flush_block()
+
+    def _compress_block(self, data: bytes) -> bytes:
+        compressor = zlib.compressobj(self.compresslevel, zlib.DEFLATED, -15)
+        compressed = compressor.compress(data) + compressor.flush()
+        block_size = _BLOCK_HEADER.size + len(compressed) + 8
+        # Deflate stores incompressible data with 5 bytes of overhead per 64KiB, so
+        # _MAX_BLOCK_DATA bytes always fit
+        assert block_size <= _MAX_BLOCK_SIZE
+        header = _BLOCK_HEADER.pack(
+            31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, block_size - 1
+        )
+        trailer = struct.pack("<II", zlib.crc32(data), len(data))
+        return header + compressed + trailer
+
+    def _flush_block(self):
+        if not self.buffer:
+            return
+        data = bytes(self.buffer)
+        block = self._compress_block(data)
+        self.handle.write(block)
+        self.block_offset += len(block)
+        self.buffer = bytearray()
+
+    def close(self):
+        self._flush_block()
+        self.handle.write(_EOF_BLOCK)
+
+
+def _block_size(header: bytes) -> int:
+    """Size of the block starting with `header`, or 0 if it is not a BGZF block"""
+    if len(header) < _BLOCK_HEADER.size:
+        return 0
+    id1, id2, cm, flg, _, _, _, xlen, si1, si2, slen, bsize = _BLOCK_HEADER.unpack(
+        header[: _BLOCK_HEADER.size]
+    )
+    if (id1, id2, cm, flg & 4, xlen, si1, si2, slen) != (31, 139, 8, 4, 6, 66, 67, 2):
+        return 0
+    return bsize + 1
+
+
+def is_bgzf(handle: BinaryIO) -> bool:
+    """Whether the file starts with a BGZF block, leaving its position unchanged"""
+    position = handle.tell()
+    header = handle.read(_BLOCK_HEADER.size)
+    handle.seek(position)
+    return _block_size(header) > 0
+
+
+def iter_blocks(handle: BinaryIO) -> Iterator[bytes]:
+    """Yields each (compressed) block of a BGZF file; raises ValueError past one"""
+    while True:
+        header = handle.read(_BLOCK_HEADER.size)
+        if not header:
+            return
+        block_size = _block_size(header)
+        if not block_size:
+            raise ValueError("Not a BGZF block")
+        block = header + handle.read(block_size - len(header))
+        if len(block) < block_size:
+            raise ValueError("Truncated BGZF block")
+        yield block
+
+
+def inflate_block(block: bytes) -> bytes:
+    """The data of a BGZF block, checked against its CRC and size"""
+    data = zlib.decompress(block[_BLOCK_HEADER.size : -8], -15)
+    crc, size = struct.unpack("<II", block[-8:])
+    if zlib.crc32(data) != crc or len(data) != size:
+        raise ValueError("Corrupt BGZF block")
+    return data
+
+
+def _reg2bin(beg: int, end: int) -> int:
+    """UCSC binning scheme bin of 0-based, half-open [beg, end)"""
+    end -= 1
+    for shift, offset in ((14, 4681), (17, 585), (20, 73), (23, 9), (26, 1)):
+        if beg >> shift == end >> shift:
+            return offset + (beg >> shift)
+    return 0
+
+
+class _ReferenceIndex:
+    def __init__(self):
+        self.bins: Dict[int, List[List[int]]] = dict()
+        self.linear: Dict[int, int] = dict()
+
+    def add(self, beg: int, end: int, start_offset: int, end_offset: int):
+        chunks = self.bins.setdefault(_reg2bin(beg, end), list())
+        if chunks and chunks[-1][1] == start_offset:
+            chunks[-1][1] = end_offset
+        else:
+            chunks.append([start_offset, end_offset])
+
+        for window in range(
+            beg >> _LINEAR_INDEX_SHIFT, ((end - 1) >> _LINEAR_INDEX_SHIFT) + 1
+        ):
+            if window not in self.linear or self.linear[window] > start_offset:
+                self.linear[window] = start_offset
+
+    def pack(self) -> bytes:
+        packed = [struct.pack("<i", len(self.bins))]
+        for bin_number, chunks in sorted(self.bins.items()):
+            packed.append(struct.pack("<Ii", bin_number, len(chunks)))
+            for chunk in chunks:
+                packed.append(struct.pack("<QQ", *chunk))
+
+        num_windows = max(self.linear) + 1 if self.linear else 0
+        offsets = list()
+        previous = 0
+        for window in range(num_windows):
+            previous = self.linear.get(window, previous)
+            offsets.append(previous)
+        packed.append(struct.pack(f"<i{num_windows}Q", num_windows, *offsets))
+        return b"".join(packed)
+
+
+def _sorted_vcf_lines(vcf_path: Path) -> Iterable[bytes]:
+    """Lines of the VCF, streamed if already sorted, else sorted in memory"""
+    if _vcf_is_sorted(vcf_path):
+        with vcf_path.open("rb") as f:
+            yield from f
+        return
+
+    header, records = list(), list()
+    with vcf_path.open("rb") as f:
+        for line in f:
+            (header if line.startswith(b"#") else records).append(line)
+    chrom_order: Dict[bytes, int] = dict()
+    for line in records:
+        chrom_order.setdefault(line.split(b"\t", 1)[0], len(chrom_order))
+
+    def sort_key(line: bytes):
+        chrom, pos = line.split(b"\t", 2)[:2]
+        return chrom_order[chrom], int(pos)
+
+    yield from header
+    yield from sorted(records, key=sort_key)
+
+
+def write_indexed_vcf(vcf_path: PathLike, output_path: PathLike):
+    """
+    Writes the VCF as BGZF to `output_path`, and its tabix index to
+    `output_path`.tbi. Records get sorted first if they are not already.
+    """
+    vcf_path, output_path = Path(vcf_path), Path(output_path)
+    indexes: Dict[bytes, _ReferenceIndex] = dict()
+
+    with output_path.open("wb") as handle:
+        writer = BgzfWriter(handle)
+        for line in _sorted_vcf_lines(vcf_path):
+            if not line.endswith(b"\n"):
+                line += b"\n"
+            start_offset = writer.tell()
+            writer.write(line)
+            if line.startswith(b"#"):
+                continue
+            chrom, pos, _, ref = line.split(b"\t", 4)[:4]
+            beg = int(pos) - 1
+            index = indexes.setdefault(chrom, _ReferenceIndex())
+            index.add(beg, beg + max(len(ref), 1), start_offset, writer.tell())
+        writer.close()
+
+    names = b"".join(chrom + b"\0" for chrom in indexes)
+    tbi = [
+        b"TBI\1",
+        struct.pack(
+            "<8i",
+            len(indexes),
+            _TBI_VCF_FORMAT,
+            1,  # Column of sequence names
+            2,  # Column of start positions
+            0,  # Column of end positions: none
+            ord("#"),  # Comment lines prefix
+            0,  # Lines to skip
+            len(names),
+        ),
+        names,
+    ]
+    tbi.extend(index.pack() for index in indexes.values())
+    with Path(f"{output_path}.tbi").open("wb") as handle:
+        writer = BgzfWriter(handle)
+        writer.write(b"".join(tbi))
+        writer.close()
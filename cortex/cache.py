@@ -0,0 +1,144 @@
+import os
+import shutil
+import uuid
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+from cortex.file_manip import PathLike, _copy_file
+from cortex import fingerprint, settings
+from cortex.utils import disk_usage
+
+
+class _LRUDirectoryCache:
+    """
+    Each entry is a directory under `root`, named by its key.
+
+    Entries are built in a private staging directory and published with an atomic
+    rename, so concurrent writers never expose a partially built entry.
+    An entry's mtime records its last use; once the cache holds more than `max_bytes`,
+    least recently used entries get evicted.
+    """
+
+    def __init__(self, root: PathLike, max_bytes: Optional[int] = None):
+        self.root = Path(root).resolve()
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+
+    def get(self, key: str) -> Optional[Path]:
+        entry = self.root / key
+        try:
+            os.utime(entry)
+        except FileNotFoundError:
+            return None
+        return entry
+
+    def staging(self, key: str) -> Path:
+        staging = self.root / f".{key}.{os.getpid()}.{uuid.uuid4().hex}.tmp"
+        staging.mkdir()
+        return staging
+
+    def discard(self, staging: Path):
+        shutil.rmtree(staging, ignore_errors=True)
+
+    def publish(self, key: str, staging: Path) -> Path:
+        entry = self.root / key
+        try:
+            os.rename(staging, entry)
+        except OSError:
+            # Another writer published this entry first: theirs is as good as ours
+            if not entry.is_dir():
+                raise
+            self.discard(staging)
+        os.utime(entry)
+        self.evict(keep=key)
+        return entry
+
+    def _entries(self) -> Iterator[Path]:
+        for entry in self.root.iterdir():
+            if not entry.name.startswith(".") and entry.is_dir():
+                yield entry
+
+    def evict(self, keep: Optional[str] = None):
+        if self.max_bytes is None:
+            return
+        entries = []
+        for entry in self._entries():
+            try:
+                entries.append((entry.stat().st_mtime, disk_usage(entry), entry))
+            except FileNotFoundError:  # Concurrently evicted
+                continue
+        total_bytes = sum(size for _, size, _ in entries)
+
+        for _, size, entry in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            if entry.name == keep:
+                continue
+            # Rename first so readers see either the whole entry or no entry
+            doomed = self.root / f".{entry.name}.{uuid.uuid4().hex}.evicted"
+            try:
+                os.rename(entry, doomed)
+            except FileNotFoundError:
+                continue
+            shutil.rmtree(doomed, ignore_errors=True)
+            total_bytes -= size
+
+
+class IndexCache(_LRUDirectoryCache):
+    """
+    Reference graph indexes (cortex binaries), keyed by the reference's contents
+    and the parameters used to build them.
+    """
+
+    def key(
+        self, reference_fasta: PathLike, kmer_size: int, mem_height: int, mem_width: int
+    ) -> str:
+        return fingerprint.params_digest(
+            reference=fingerprint.file_digest(reference_fasta),
+            kmer_size=kmer_size,
+            mem_height=mem_height,
+            mem_width=mem_width,
+        )
+
+
+class ResultCache(_LRUDirectoryCache):
+    """
+    VCFs of whole runs, keyed by the reference, the reads files, the calling parameters
+    and the tools' versions. Files are fingerprinted by size, mtime and sampled blocks
+    of their contents; with `full_hash`, by a hash of all their contents.
+    """
+
+    _VCF = "calls.vcf"
+
+    def __init__(
+        self, root: PathLike, max_bytes: Optional[int] = None, full_hash: bool = False
+    ):
+        super().__init__(root, max_bytes)
+        self.full_hash = full_hash
+
+    def key(
+        self, reference_fasta: PathLike, reads_files: List[PathLike], **params
+    ) -> str:
+        if self.full_hash:
+            file_fingerprint = fingerprint.file_digest
+        else:
+            file_fingerprint = fingerprint.sampled_file_fingerprint
+        return fingerprint.params_digest(
+            reference=file_fingerprint(reference_fasta),
+            reads_files=[file_fingerprint(reads_file) for reads_file in reads_files],
+            tools=settings.tool_versions(),
+            **params,
+        )
+
+    def get_vcf(self, key: str) -> Optional[Path]:
+        entry = self.get(key)
+        return None if entry is None else entry / self._VCF
+
+    def put_vcf(self, key: str, vcf_path: Path):
+        staging = self.staging(key)
+        try:
+            _copy_file(vcf_path, staging / self._VCF)
+        except BaseException:
+            self.discard(staging)
+            raise
+        self.publish(key, staging)
@@ -1,54 +1,354 @@
+import asyncio
+import contextlib
+import functools
+import itertools
+import json
 import os
+import pickle
+import re
 import shutil
 import tempfile
 import sys
+import threading
+from collections import deque
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    FIRST_EXCEPTION,
+    Executor,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
-from typing import List
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple, Union
 
+from cortex.cache import IndexCache, ResultCache
+from cortex.checkpoint import Checkpoints
+from cortex.governor import NodeGovernor
+from cortex.preprocess import ReadsPreprocessing
+from cortex.report import RunReport
+from cortex.scratch import ScratchPolicy, make_scratch_directory, remove_in_background
 from cortex.file_manip import (
     StrPath,
     PathLike,
+    _deliver_file,
     _find_final_vcf_file_path,
     _make_empty_vcf,
+    _split_vcf_by_sample,
 )
+from . import bgzf
+from . import fifo
+from . import fingerprint
+from . import memory
+from . import multik
+from . import preprocess
+from . import reads
 from . import settings
+from . import sharding
 from . import utils
 
+_KMER_SIZE = 31
+_MEM_WIDTH = 100
+# Cortex ignores bases of quality at most this
+_QTHRESH = 5
+# How cortex reports its hash table filling up, in its log or run_calls.pl's output
+_HASH_TABLE_FULL = re.compile(
+    rb"hash[ _]?table[^\n]{0,60}\bfull\b|\bfull\b[^\n]{0,60}hash[ _]?table",
+    re.IGNORECASE,
+)
+_LOG_TAIL_BYTES = 1 << 20
+# Samples of the largest cohort install_dependencies.sh builds a cortex_var for
+_MAX_JOINT_SAMPLES = 8
+
+
+class HashTableFull(RuntimeError):
+    """Cortex ran out of hash table: it needs a larger mem_height"""
+
+
+def _log_shows_full_table(log: Path) -> bool:
+    """Whether the end of the log reports cortex's hash table filling up"""
+    try:
+        with log.open("rb") as f:
+            f.seek(max(0, log.stat().st_size - _LOG_TAIL_BYTES))
+            return _HASH_TABLE_FULL.search(f.read()) is not None
+    except OSError:
+        return False
+
+
+class _Stages:
+    """
+    Checkpoints of a run's stages when resuming, so that a re-run skips stages that
+    completed with the same inputs. Without `resume`, no stage is ever done.
+    """
+
+    def __init__(
+        self,
+        resume: bool,
+        tmp_directory: Path,
+        reference_fasta: Path,
+        reads_files: List[Path],
+        output_vcf_file_path: StrPath,
+        sample_name: str,
+        ploidy: int,
+        mem_height: int,
+        preprocessing: Optional[ReadsPreprocessing] = None,
+        decompress_reads: bool = False,
+    ):
+        self.checkpoints: Optional[Checkpoints] = None
+        if not resume:
+            return
+        self.checkpoints = Checkpoints(tmp_directory)
+
+        self.fingerprints = dict()
+        self.fingerprints["index"] = fingerprint.params_digest(
+            reference=fingerprint.fast_file_fingerprint(reference_fasta),
+            kmer_size=_KMER_SIZE,
+            mem_height=mem_height,
+            mem_width=_MEM_WIDTH,
+        )
+        reads_fingerprints = list(map(fingerprint.fast_file_fingerprint, reads_files))
+        previous = self.fingerprints["index"]
+        if preprocessing is not None:
+            self.fingerprints["reads preprocessing"] = fingerprint.params_digest(
+                previous=previous,
+                reads_files=reads_fingerprints,
+                preprocessing=preprocessing._asdict(),
+                kmer_size=_KMER_SIZE,
+                qthresh=_QTHRESH,
+            )
+            previous = self.fingerprints["reads preprocessing"]
+        self.fingerprints["input files"] = fingerprint.params_digest(
+            previous=previous,
+            reads_files=reads_fingerprints,
+            sample_name=sample_name,
+            decompress_reads=decompress_reads,
+        )
+        self.fingerprints["calls"] = fingerprint.params_digest(
+            previous=self.fingerprints["input files"], ploidy=ploidy
+        )
+        self.fingerprints["vcf delivery"] = fingerprint.params_digest(
+            previous=self.fingerprints["calls"],
+            output=str(Path(output_vcf_file_path).resolve()),
+        )
+
+    def done(self, stage: str) -> bool:
+        if self.checkpoints is None:
+            return False
+        if self.checkpoints.done(stage, self.fingerprints[stage]):
+            print(f"Resuming: skipping completed stage '{stage}'")
+            return True
+        return False
+
+    def mark(self, stage: str, outputs: List[Path]):
+        if self.checkpoints is not None:
+            self.checkpoints.mark(stage, self.fingerprints[stage], outputs)
+
+
+def _preprocess_reads(
+    report: RunReport,
+    stages: _Stages,
+    tmp_directory: Path,
+    reference_fasta: Path,
+    reads_files: List[Path],
+    preprocessing: ReadsPreprocessing,
+) -> List[Path]:
+    """Returns the preprocessed reads files"""
+    output_files = preprocess.output_paths(reads_files, tmp_directory / "reads")
+    if not stages.done("reads preprocessing"):
+        stats = preprocess.preprocess_reads(
+            reads_files,
+            output_files,
+            preprocessing,
+            _KMER_SIZE,
+            _QTHRESH,
+            utils.get_sequence_length(reference_fasta),
+        )
+        report.reads_preprocessing = stats
+        stages.mark("reads preprocessing", output_files)
+    return output_files
+
+
+def _profile_reads(
+    report: RunReport, reads_files: List[Path], kmer_size: int = _KMER_SIZE
+) -> Optional[int]:
+    """
+    Returns the longest read's length, or None if no read is long enough to hold a
+    kmer, in which case cortex cannot call anything.
+    """
+    profile = reads.profile_reads_files(reads_files)
+    report.reads_profile = profile
+    if profile.max_read_len < kmer_size:
+        print(
+            f"No read holds a {kmer_size}-mer (longest: {profile.max_read_len} "
+            "bases): skipping cortex, the VCF will be empty"
+        )
+        return None
+    return profile.max_read_len
+
+
+def _calls_outputs(tmp_directory: Path) -> List[Path]:
+    final_vcf_path = _find_final_vcf_file_path(tmp_directory)
+    return [] if final_vcf_path is None else [Path(final_vcf_path)]
+
+
+def _start_report(
+    report: RunReport,
+    reference_fasta: Path,
+    reads_files: List[Path],
+    tmp_directory: Optional[Path],
+    **parameters,
+):
+    report.add_inputs(reference_fasta, *reads_files)
+    report.parameters.update(
+        parameters,
+        reference_fasta=reference_fasta,
+        reads_files=reads_files,
+        tmp_directory=tmp_directory,
+        kmer_size=_KMER_SIZE,
+        mem_width=_MEM_WIDTH,
+    )
+    if tmp_directory is not None:
+        report.watch_tmp_directory(tmp_directory)
+
+
+async def _in_executor(function, *args, **kwargs):
+    """Runs blocking `function` in the event loop's default executor"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        None, functools.partial(function, *args, **kwargs)
+    )
+
+
+def _cortex_var_binary(kmer_size: int, num_colours: int = 1) -> str:
+    """The cortex_var build for `kmer_size`: the one of the smallest fitting max k"""
+    max_kmer_size = 32 * ((kmer_size + 32) // 32) - 1
+    return os.path.join(
+        settings.CORTEX_ROOT, "bin", f"cortex_var_{max_kmer_size}_c{num_colours}"
+    )
+
 
 class _CortexIndex:
-    def __init__(self, directory: Path):
+    def __init__(self, directory: Path, kmer_size: int = _KMER_SIZE):
         self.base = directory.resolve()
         self.base.mkdir(exist_ok=True)
+        self.kmer_size = kmer_size
 
         self.ref_names_file = self.base / "fofn"
-        self.dump_binary_ctx = self.base / "k31.ctx"
+        self.dump_binary_ctx = self.base / f"k{kmer_size}.ctx"
+        self.build_log = self.base / "build.log"
 
-    def make(self, reference_fasta: Path, mem_height: int):
+    def _make_command(self, reference_fasta: Path, mem_height: int) -> list:
         with self.ref_names_file.open("w") as f:
             print(str(reference_fasta), file=f)
+        self.build_log.unlink(missing_ok=True)  # Of an earlier, failed build
 
-        cortex_var = os.path.join(settings.CORTEX_ROOT, "bin", "cortex_var_31_c1")
-        utils.syscall(
-            [
-                cortex_var,
-                "--kmer_size",
-                31,
-                "--mem_height",
-                mem_height,
-                "--mem_width",
-                100,
-                "--se_list",
-                self.ref_names_file,
-                "--max_read_len",
-                10000,
-                "--dump_binary",
-                self.dump_binary_ctx,
-                "--sample_id",
-                "REF",
-            ]
-        )
+        return [
+            _cortex_var_binary(self.kmer_size),
+            "--kmer_size",
+            self.kmer_size,
+            "--mem_height",
+            mem_height,
+            "--mem_width",
+            _MEM_WIDTH,
+            "--se_list",
+            self.ref_names_file,
+            "--max_read_len",
+            10000,
+            "--dump_binary",
+            self.dump_binary_ctx,
+            "--sample_id",
+            "REF",
+        ]
+
+    def _build_failure(self, error: RuntimeError, mem_height: int) -> RuntimeError:
+        if _log_shows_full_table(self.build_log):
+            return HashTableFull(
+                f"Cortex's hash table filled up indexing the reference at mem_height "
+                f"{mem_height}: {error}"
+            )
+        return error
 
+    def _built(self):
         self.ref_names_file.unlink()
+        self.build_log.unlink(missing_ok=True)
+
+    def make(self, reference_fasta: Path, mem_height: int):
+        command = self._make_command(reference_fasta, mem_height)
+        try:
+            utils.syscall_streaming(command, self.build_log)
+        except RuntimeError as e:
+            raise self._build_failure(e, mem_height) from None
+        self._built()
+
+    async def make_async(self, reference_fasta: Path, mem_height: int):
+        command = self._make_command(reference_fasta, mem_height)
+        try:
+            await utils.syscall_async(command, self.build_log)
+        except RuntimeError as e:
+            raise (await _in_executor(self._build_failure, e, mem_height)) from None
+        self._built()
+
+    def link_from(self, cached_index: Path):
+        """
+        Hard links (or failing that, copies) the cached binary in, so that the cache
+        can evict it while we still use it.
+        """
+        cached_binary = cached_index / self.dump_binary_ctx.name
+        try:
+            os.link(cached_binary, self.dump_binary_ctx)
+        except OSError:
+            shutil.copyfile(cached_binary, self.dump_binary_ctx)
+
+
+def _make_cached_index(
+    directory: Path,
+    reference_fasta: Path,
+    mem_height: int,
+    index_cache: IndexCache,
+    kmer_size: int = _KMER_SIZE,
+) -> _CortexIndex:
+    key = index_cache.key(reference_fasta, kmer_size, mem_height, _MEM_WIDTH)
+    cached_index = index_cache.get(key)
+    if cached_index is None:
+        staging = index_cache.staging(key)
+        try:
+            _CortexIndex(staging, kmer_size).make(reference_fasta, mem_height)
+        except BaseException:
+            index_cache.discard(staging)
+            raise
+        cached_index = index_cache.publish(key, staging)
+
+    index = _CortexIndex(directory, kmer_size)
+    index.link_from(cached_index)
+    return index
+
+
+async def _make_cached_index_async(
+    directory: Path,
+    reference_fasta: Path,
+    mem_height: int,
+    index_cache: IndexCache,
+    kmer_size: int = _KMER_SIZE,
+) -> _CortexIndex:
+    key = await _in_executor(
+        index_cache.key, reference_fasta, kmer_size, mem_height, _MEM_WIDTH
+    )
+    cached_index = index_cache.get(key)
+    if cached_index is None:
+        staging = index_cache.staging(key)
+        try:
+            await _CortexIndex(staging, kmer_size).make_async(
+                reference_fasta, mem_height
+            )
+        except BaseException:
+            index_cache.discard(staging)
+            raise
+        cached_index = await _in_executor(index_cache.publish, key, staging)
+
+    index = _CortexIndex(directory, kmer_size)
+    await _in_executor(index.link_from, cached_index)
+    return index
 
 
 class _CortexCall:
@@ -57,42 +357,149 @@ class _CortexCall:
     """
 
     def __init__(
-        self, directory: Path, reference_fasta: Path, ploidy: int, mem_height: int
+        self,
+        directory: Path,
+        ploidy: int,
+        mem_height: int,
+        max_read_len: Optional[int] = None,
+        kmer_size: int = _KMER_SIZE,
+        num_samples: int = 1,
     ):
         self.base: Path = directory.resolve()
         self.base.mkdir(parents=True, exist_ok=True)
 
         self.ploidy = ploidy
         self.mem_height = mem_height
+        self.kmer_size = kmer_size
+        # None leaves run_calls.pl's default
+        self.max_read_len = max_read_len
 
         self.cortex_log = self.base / "cortex.log"
+        self.calls_output = self.base / "run_calls.out"
         self.output_directory = self.base / "cortex_output"
-        self.reads_fofn = self.base / "cortex_reads_in.fofn"
+        # One per sample: several get called jointly
+        if num_samples == 1:
+            self.reads_fofns = [self.base / "cortex_reads_in.fofn"]
+        else:
+            self.reads_fofns = [
+                self.base / f"cortex_reads_in.{index}.fofn"
+                for index in range(num_samples)
+            ]
         self.reads_index = self.base / "cortex_reads_in.index"
+        # Gzipped reads files fed through FIFOs, by FIFO
+        self.reads_fifos = self.base / "cortex_reads_fifos.json"
         self.reference_fofn = self.base / "cortex_in_index_ref.fofn"
+        self.index = _CortexIndex(self.base / "indexes", kmer_size)
 
-        self.index = _CortexIndex(self.base / "indexes")
-        self.index.make(reference_fasta, self.mem_height)
+    def make_index(
+        self, reference_fasta: Path, index_cache: Optional[IndexCache] = None
+    ):
+        if index_cache is None:
+            self.index.make(reference_fasta, self.mem_height)
+        else:
+            self.index = _make_cached_index(
+                self.base / "indexes",
+                reference_fasta,
+                self.mem_height,
+                index_cache,
+                self.kmer_size,
+            )
+
+    async def make_index_async(
+        self, reference_fasta: Path, index_cache: Optional[IndexCache] = None
+    ):
+        if index_cache is None:
+            await self.index.make_async(reference_fasta, self.mem_height)
+        else:
+            self.index = await _make_cached_index_async(
+                self.base / "indexes",
+                reference_fasta,
+                self.mem_height,
+                index_cache,
+                self.kmer_size,
+            )
 
     def make_input_files(
-        self, reference_fasta: Path, reads_files: List[Path], sample_name: str
+        self,
+        reference_fasta: Path,
+        reads_files: List[Path],
+        sample_name: str,
+        decompress_reads: bool = False,
     ):
+        self.make_joint_input_files(
+            reference_fasta, {sample_name: reads_files}, decompress_reads
+        )
+
+    def make_joint_input_files(
+        self,
+        reference_fasta: Path,
+        samples: Dict[str, List[Path]],
+        decompress_reads: bool = False,
+    ):
+        """
+        With `decompress_reads`, cortex reads gzipped reads files from FIFOs, fed while
+        calls execute (see `cortex.fifo`).
+        """
         self.base.mkdir(parents=True, exist_ok=True)
+        fifos: Dict[Path, Path] = dict()
+        if decompress_reads:
+            fifo_directory = self.base / "reads_fifos"
+            fifo_directory.mkdir(exist_ok=True)
 
-        # List sample's read files
-        with self.reads_fofn.open("w") as f:
-            for reads_file in reads_files:
-                print(reads_file, file=f)
+        with self.reads_index.open("w") as f_index:
+            for sample_number, (reads_fofn, (sample_name, reads_files)) in enumerate(
+                zip(self.reads_fofns, samples.items())
+            ):
+                reads_files = [Path(reads_file) for reads_file in reads_files]
+                listed_files = reads_files
+                if decompress_reads:
+                    sample_fifo_directory = fifo_directory / str(sample_number)
+                    sample_fifo_directory.mkdir(exist_ok=True)
+                    listed_files = fifo.fifo_paths(reads_files, sample_fifo_directory)
+                    for index, reads_file in enumerate(reads_files):
+                        if reads.is_gzipped(reads_file):
+                            fifos[listed_files[index]] = reads_file
+                        else:
+                            listed_files[index] = reads_file
 
-        # Sample name + file listing read files
-        with self.reads_index.open("w") as f:
-            print(sample_name, self.reads_fofn, ".", ".", sep="\t", file=f)
+                # List sample's read files
+                with reads_fofn.open("w") as f:
+                    for reads_file in listed_files:
+                        print(reads_file, file=f)
+
+                # Sample name + file listing read files
+                print(sample_name, reads_fofn, ".", ".", sep="\t", file=f_index)
 
         with self.reference_fofn.open("w") as f:
             print(reference_fasta, file=f)
 
-    def execute_calls(self, reference_fasta: Path):
-        number_of_bases_in_reference = utils.get_sequence_length(reference_fasta)
+        if fifos:
+            with self.reads_fifos.open("w") as f:
+                json.dump({str(path): str(file) for path, file in fifos.items()}, f)
+        else:
+            self.reads_fifos.unlink(missing_ok=True)
+
+    @property
+    def input_files(self) -> List[Path]:
+        input_files = [*self.reads_fofns, self.reads_index, self.reference_fofn]
+        if self.reads_fifos.exists():
+            input_files.append(self.reads_fifos)
+        return input_files
+
+    def _feeding_reads(self):
+        """Feeds the FIFOs listed in place of gzipped reads files, if any"""
+        try:
+            with self.reads_fifos.open() as f:
+                fifos = json.load(f)
+        except FileNotFoundError:
+            return contextlib.nullcontext()
+        return fifo.feeding({Path(path): Path(file) for path, file in fifos.items()})
+
+    @property
+    def workflow(self) -> str:
+        return "independent" if len(self.reads_fofns) == 1 else "joint"
+
+    def _calls_command(self, number_of_bases_in_reference: int) -> list:
         cortex_calls_script = os.path.join(
             settings.CORTEX_ROOT, "scripts", "calling", "run_calls.pl"
         )
@@ -102,7 +509,7 @@ class _CortexCall:
         command = [
             cortex_calls_script,
             "--first_kmer",
-            31,
+            self.kmer_size,
             "--fastaq_index",
             self.reads_index,
             "--auto_cleaning",
@@ -126,11 +533,11 @@ class _CortexCall:
             "--genome_size",
             number_of_bases_in_reference,
             "--qthresh",
-            5,
+            _QTHRESH,
             "--mem_height",
             self.mem_height,
             "--mem_width",
-            100,
+            _MEM_WIDTH,
             "--vcftools_dir",
             settings.VCFTOOLS_DIRECTORY,
             "--do_union",
@@ -138,63 +545,1236 @@ class _CortexCall:
             "--ref",
             "CoordinatesAndInCalling",
             "--workflow",
-            "independent",
+            self.workflow,
             "--logfile",
             self.cortex_log,
         ]
+        if self.max_read_len is not None:
+            command += ["--max_read_len", self.max_read_len]
+        return command
+
+    def _report_calls_failure(self):
+        # In cortex, stderr and stdout gets written log files so that raised errors
+        # in this API do not necessarily get what Actually caused the error.
+        print(
+            "----------------------------\n"
+            "Please refer to cortex log file at {} (and output of run_calls.pl "
+            "at {}) for more information.".format(self.cortex_log, self.calls_output),
+            file=sys.stderr,
+        )
+
+    def _hash_table_filled(self) -> bool:
+        logs = [self.cortex_log, self.calls_output]
+        if self.output_directory.is_dir():
+            logs.extend(self.output_directory.rglob("*.log"))
+        return any(_log_shows_full_table(log) for log in logs)
+
+    def _calls_failure(self, error: RuntimeError) -> RuntimeError:
+        self._report_calls_failure()
+        if self._hash_table_filled():
+            return HashTableFull(
+                f"Cortex's hash table filled up at mem_height {self.mem_height}: "
+                f"{error}"
+            )
+        return error
 
+    def execute_calls(
+        self,
+        number_of_bases_in_reference: int,
+        on_progress: Optional[utils.ProgressCallback] = None,
+        timeout: Optional[float] = None,
+        cancel: Optional[threading.Event] = None,
+    ):
+        command = self._calls_command(number_of_bases_in_reference)
         try:
-            utils.syscall(command)
+            with self._feeding_reads():
+                utils.syscall_streaming(
+                    command,
+                    self.calls_output,
+                    on_progress=on_progress,
+                    timeout=timeout,
+                    cancel=cancel,
+                )
         except RuntimeError as e:
-            # In cortex, stderr and stdout gets written log files so that raised errors
-            # in this API do not necessarily get what Actually caused the error.
-            print(
-                "----------------------------\n"
-                "Please refer to cortex log file at {} for more information.".format(
-                    self.cortex_log
-                ),
-                file=sys.stderr,
-            )
-            raise e from None
+            raise self._calls_failure(e) from None
+
+    async def execute_calls_async(
+        self,
+        number_of_bases_in_reference: int,
+        on_progress: Optional[utils.ProgressCallback] = None,
+    ):
+        command = self._calls_command(number_of_bases_in_reference)
+        try:
+            with self._feeding_reads():
+                await utils.syscall_async(command, self.calls_output, on_progress)
+        except RuntimeError as e:
+            raise (await _in_executor(self._calls_failure, e)) from None
 
 
-def run(
+def _resolve_inputs(
     reference_fasta: StrPath,
     reads_files: List[StrPath],
-    output_vcf_file_path: StrPath,
-    sample_name: str = "sample",
-    ploidy: int = 1,
-    tmp_directory: PathLike = None,
-    mem_height: int = 22,
-    cleanup: bool = True,
-) -> None:
+    ploidy: int,
+    mem_height: Union[int, str],
+) -> Tuple[Path, List[Path], Union[int, str]]:
+    """Validated inputs; mem_height gets resolved by `_resolve_mem_height`"""
     reference_fasta = Path(reference_fasta).resolve()
     if type(reads_files) is not list:
         raise ValueError("read files must be passed as list, even if single file")
 
     reads_files = [Path(reads_file).resolve() for reads_file in reads_files]
 
-    if tmp_directory is None:
-        tmp_directory = tempfile.mkdtemp()
-    tmp_directory = Path(tmp_directory).resolve()
-
     if ploidy not in {1, 2}:
         raise ValueError("ploidy must be in {1, 2}")
 
-    caller = _CortexCall(tmp_directory, reference_fasta, ploidy, mem_height)
-    caller.make_input_files(reference_fasta, reads_files, sample_name)
-    caller.execute_calls(reference_fasta)
+    if mem_height != "auto" and type(mem_height) is not int:
+        raise ValueError('mem_height must be an int or "auto"')
+
+    return reference_fasta, reads_files, mem_height
+
+
+def _resolve_mem_height(
+    reference_fasta: Path, reads_files: List[Path], mem_height: Union[int, str]
+) -> int:
+    if mem_height == "auto":
+        return memory.auto_mem_height(
+            [reference_fasta] + reads_files, _KMER_SIZE, _MEM_WIDTH
+        )
+    return mem_height
 
+
+def _hinted_mem_height(
+    mem_height_history: Optional[memory.MemHeightHistory],
+    reference_fasta: Path,
+    reads_files: List[Path],
+    mem_height: int,
+) -> int:
+    if mem_height_history is None:
+        return mem_height
+    hint = mem_height_history.get(reference_fasta, reads_files)
+    if hint is None or hint <= mem_height:
+        return mem_height
+    print(f"Starting at mem_height {hint}, which worked for alike inputs before")
+    return hint
+
+
+def _escalate_mem_height(
+    caller: "_CortexCall", max_mem_height: Optional[int], error: HashTableFull
+):
+    """Raises `error` if mem_height is at its ceiling, else raises mem_height"""
+    if max_mem_height is None or caller.mem_height >= max_mem_height:
+        raise error
+    caller.mem_height += 1
+    print(f"Retrying cortex with mem_height {caller.mem_height}")
+    shutil.rmtree(caller.output_directory, ignore_errors=True)
+
+
+def _record_mem_height(
+    report: RunReport,
+    mem_height_history: Optional[memory.MemHeightHistory],
+    reference_fasta: Path,
+    reads_files: List[Path],
+    mem_height: int,
+):
+    report.parameters["mem_height"] = mem_height
+    if mem_height_history is not None:
+        mem_height_history.record(reference_fasta, reads_files, mem_height)
+
+
+def _make_tmp_directory(
+    tmp_directory: Optional[PathLike],
+    scratch: Optional[ScratchPolicy] = None,
+    mem_height: int = 22,
+) -> Path:
+    if tmp_directory is None:
+        if scratch is not None:
+            tmp_directory = make_scratch_directory(
+                scratch, memory.hash_table_bytes(mem_height, _MEM_WIDTH)
+            )
+        else:
+            tmp_directory = tempfile.mkdtemp()
+    return Path(tmp_directory).resolve()
+
+
+def _deliver_vcf(
+    tmp_directory: Path,
+    output_vcf_file_path: StrPath,
+    sample_name: Union[str, List[str]],
+    cleanup: bool = False,
+    result_cache: Optional[ResultCache] = None,
+    result_key: Optional[str] = None,
+) -> Path:
+    """
+    An output path ending in .gz gets a bgzipped VCF and its tabix index.
+    With `result_cache`, the VCF also gets cached under `result_key`.
+    Returns the delivered VCF in `tmp_directory`.
+    """
     final_vcf_path = _find_final_vcf_file_path(tmp_directory)
-    if final_vcf_path is not None:
-        shutil.copyfile(final_vcf_path, output_vcf_file_path)
+    if final_vcf_path is None:
+        final_vcf_path = tmp_directory / "empty.vcf"
+        _make_empty_vcf(final_vcf_path, sample_name)
+    if result_cache is not None:
+        result_cache.put_vcf(result_key, Path(final_vcf_path))
+    _write_output_vcf(Path(final_vcf_path), output_vcf_file_path, cleanup)
+    return Path(final_vcf_path)
+
+
+def _look_up_result(
+    result_cache: Optional[ResultCache],
+    reference_fasta: Path,
+    reads_files: List[Path],
+    **params,
+) -> Tuple[Optional[str], Optional[Path]]:
+    """The run's result cache key, and its cached VCF if any"""
+    if result_cache is None:
+        return None, None
+    key = result_cache.key(
+        reference_fasta,
+        reads_files,
+        kmer_size=_KMER_SIZE,
+        mem_width=_MEM_WIDTH,
+        qthresh=_QTHRESH,
+        **params,
+    )
+    return key, result_cache.get_vcf(key)
+
+
+def _deliver_cached_vcf(cached_vcf: Path, output_vcf_file_path: StrPath):
+    print(f"Delivering the cached calls of an identical run, from {cached_vcf}")
+    _write_output_vcf(cached_vcf, output_vcf_file_path, False)
+
+
+def _write_output_vcf(vcf_path: Path, output_vcf_file_path: StrPath, cleanup: bool):
+    if str(output_vcf_file_path).endswith(".gz"):
+        bgzf.write_indexed_vcf(vcf_path, output_vcf_file_path)
     else:
-        _make_empty_vcf(output_vcf_file_path, sample_name)
+        _deliver_file(vcf_path, Path(output_vcf_file_path), cleanup)
+
 
+def _finish(
+    tmp_directory: Path, cleanup: bool, scratch: Optional[ScratchPolicy] = None
+) -> None:
     if cleanup:
-        shutil.rmtree(tmp_directory)
+        if scratch is not None and scratch.background_cleanup:
+            remove_in_background(tmp_directory)
+        else:
+            shutil.rmtree(tmp_directory)
     else:
         print(
             f"Not cleaning tmp directory. "
             f"Cortex output and log files in {tmp_directory}"
         )
+
+
+class _BlockingSteps:
+    """
+    How `_run_stages` runs its steps in `run`: in the calling thread. None of them
+    suspends, so the stages run to completion on their coroutine's first step.
+    """
+
+    def __init__(
+        self,
+        timeout: Optional[float] = None,
+        cancel: Optional[threading.Event] = None,
+    ):
+        self.timeout = timeout
+        self.cancel = cancel
+
+    async def call(self, function, *args, **kwargs):
+        return function(*args, **kwargs)
+
+    async def make_index(self, caller: _CortexCall, *args):
+        caller.make_index(*args)
+
+    async def execute_calls(self, caller: _CortexCall, genome_size: int, on_progress):
+        caller.execute_calls(genome_size, on_progress, self.timeout, self.cancel)
+
+    async def reserve(
+        self,
+        reservation: contextlib.AsyncExitStack,
+        governor: NodeGovernor,
+        memory_bytes: int,
+    ):
+        reservation.enter_context(governor.reserve(memory_bytes))
+
+
+class _AsyncSteps:
+    """How `_run_stages` runs its steps in `run_async`: without blocking the loop"""
+
+    async def call(self, function, *args, **kwargs):
+        return await _in_executor(function, *args, **kwargs)
+
+    async def make_index(self, caller: _CortexCall, *args):
+        await caller.make_index_async(*args)
+
+    async def execute_calls(self, caller: _CortexCall, genome_size: int, on_progress):
+        await caller.execute_calls_async(genome_size, on_progress)
+
+    async def reserve(
+        self,
+        reservation: contextlib.AsyncExitStack,
+        governor: NodeGovernor,
+        memory_bytes: int,
+    ):
+        await reservation.enter_async_context(governor.reserve_async(memory_bytes))
+
+
+def _run_blocking(coroutine):
+    """The result of a coroutine that never suspends (see `_BlockingSteps`)"""
+    try:
+        coroutine.send(None)
+    except StopIteration as stop:
+        return stop.value
+    coroutine.close()
+    raise RuntimeError("A blocking run step suspended")
+
+
+async def _run_stages(
+    steps: Union[_BlockingSteps, _AsyncSteps],
+    reference_fasta: StrPath,
+    reads_files: List[StrPath],
+    output_vcf_file_path: StrPath,
+    sample_name: str,
+    ploidy: int,
+    tmp_directory: PathLike,
+    mem_height: Union[int, str],
+    cleanup: bool,
+    index_cache: Optional[IndexCache],
+    on_progress: Optional[utils.ProgressCallback],
+    resume: bool,
+    preprocess_reads: Optional[ReadsPreprocessing],
+    scratch: Optional[ScratchPolicy],
+    max_mem_height: Optional[int],
+    mem_height_history: Optional[memory.MemHeightHistory],
+    result_cache: Optional[ResultCache],
+    governor: Optional[NodeGovernor],
+    decompress_reads: bool,
+) -> RunReport:
+    """The stages of `run` and `run_async`, each step run by `steps`"""
+    call = steps.call
+    if resume and tmp_directory is None:
+        raise ValueError("resume needs the tmp_directory of the run to resume")
+    report = RunReport()
+    with report.stage("inputs"):
+        reference_fasta, reads_files, mem_height = await call(
+            _resolve_inputs, reference_fasta, reads_files, ploidy, mem_height
+        )
+        # Looked up before resolving mem_height "auto", which reads all reads
+        result_key, cached_vcf = await call(
+            _look_up_result,
+            result_cache,
+            reference_fasta,
+            reads_files,
+            sample_name=sample_name,
+            ploidy=ploidy,
+            mem_height=mem_height,
+            preprocess_reads=preprocess_reads,
+        )
+        if cached_vcf is None:
+            mem_height = await call(
+                _resolve_mem_height, reference_fasta, reads_files, mem_height
+            )
+            mem_height = await call(
+                _hinted_mem_height,
+                mem_height_history,
+                reference_fasta,
+                reads_files,
+                mem_height,
+            )
+            tmp_directory = await call(
+                _make_tmp_directory, tmp_directory, scratch, mem_height
+            )
+    # With a cached VCF, mem_height is the requested one (maybe "auto"), unresolved,
+    # and no tmp directory gets made
+    await call(
+        _start_report,
+        report,
+        reference_fasta,
+        reads_files,
+        tmp_directory if cached_vcf is None else None,
+        output_vcf_file_path=output_vcf_file_path,
+        sample_name=sample_name,
+        ploidy=ploidy,
+        mem_height=mem_height,
+        cleanup=cleanup,
+        preprocess_reads=preprocess_reads,
+        result_cache_hit=cached_vcf is not None,
+    )
+    if cached_vcf is not None:
+        with report.stage("vcf delivery"):
+            await call(_deliver_cached_vcf, cached_vcf, output_vcf_file_path)
+        report.stop()
+        return report
+
+    # Holds the governor's reservation, if any, until calls end
+    reservation = contextlib.AsyncExitStack()
+    try:
+        with report.stage("reads profile"):
+            max_read_len = await call(_profile_reads, report, reads_files)
+        if max_read_len is None:
+            with report.stage("vcf delivery"):
+                await call(
+                    _deliver_vcf,
+                    tmp_directory,
+                    output_vcf_file_path,
+                    sample_name,
+                    cleanup,
+                    result_cache,
+                    result_key,
+                )
+            report.stop()
+            with report.stage("cleanup"):
+                await call(_finish, tmp_directory, cleanup, scratch)
+            return report
+
+        stages = await call(
+            _Stages,
+            resume,
+            tmp_directory,
+            reference_fasta,
+            reads_files,
+            output_vcf_file_path,
+            sample_name,
+            ploidy,
+            mem_height,
+            preprocess_reads,
+            decompress_reads,
+        )
+        caller = await call(
+            _CortexCall, tmp_directory, ploidy, mem_height, max_read_len
+        )
+        input_reads_files = reads_files
+        if governor is not None:
+            with report.stage("admission"):
+                await steps.reserve(
+                    reservation,
+                    governor,
+                    _reserved_memory(mem_height, max_mem_height),
+                )
+        with report.stage("index"):
+            if not stages.done("index"):
+                while True:
+                    try:
+                        await steps.make_index(caller, reference_fasta, index_cache)
+                        break
+                    except HashTableFull as error:
+                        await call(_escalate_mem_height, caller, max_mem_height, error)
+                stages.mark("index", [caller.index.dump_binary_ctx])
+        if preprocess_reads is not None:
+            with report.stage("reads preprocessing"):
+                reads_files = await call(
+                    _preprocess_reads,
+                    report,
+                    stages,
+                    tmp_directory,
+                    reference_fasta,
+                    reads_files,
+                    preprocess_reads,
+                )
+        with report.stage("input files"):
+            if not stages.done("input files"):
+                await call(
+                    caller.make_input_files,
+                    reference_fasta,
+                    reads_files,
+                    sample_name,
+                    decompress_reads,
+                )
+                stages.mark("input files", caller.input_files)
+        with report.stage("genome size"):
+            genome_size = await call(utils.get_sequence_length, reference_fasta)
+        with report.stage("calls"):
+            if not stages.done("calls"):
+                if resume:  # Partial output of an interrupted run
+                    await call(
+                        shutil.rmtree, caller.output_directory, ignore_errors=True
+                    )
+                while True:
+                    try:
+                        await steps.execute_calls(caller, genome_size, on_progress)
+                        break
+                    except HashTableFull as error:
+                        await call(_escalate_mem_height, caller, max_mem_height, error)
+                stages.mark("calls", await call(_calls_outputs, tmp_directory))
+                await call(
+                    _record_mem_height,
+                    report,
+                    mem_height_history,
+                    reference_fasta,
+                    input_reads_files,
+                    caller.mem_height,
+                )
+        await reservation.aclose()
+        with report.stage("vcf delivery"):
+            if not stages.done("vcf delivery"):
+                await call(
+                    _deliver_vcf,
+                    tmp_directory,
+                    output_vcf_file_path,
+                    sample_name,
+                    cleanup,
+                    result_cache,
+                    result_key,
+                )
+                stages.mark("vcf delivery", [Path(output_vcf_file_path)])
+    except asyncio.CancelledError:
+        if cleanup and not resume:
+            await call(shutil.rmtree, tmp_directory, True)
+        raise
+    finally:
+        await reservation.aclose()
+        report.stop()
+
+    with report.stage("cleanup"):
+        await call(_finish, tmp_directory, cleanup, scratch)
+    return report
+
+
+def run(
+    reference_fasta: StrPath,
+    reads_files: List[StrPath],
+    output_vcf_file_path: StrPath,
+    sample_name: str = "sample",
+    ploidy: int = 1,
+    tmp_directory: PathLike = None,
+    mem_height: Union[int, str] = 22,
+    cleanup: bool = True,
+    index_cache: Optional[IndexCache] = None,
+    on_progress: Optional[utils.ProgressCallback] = None,
+    timeout: Optional[float] = None,
+    cancel: Optional[threading.Event] = None,
+    resume: bool = False,
+    preprocess_reads: Optional[ReadsPreprocessing] = None,
+    scratch: Optional[ScratchPolicy] = None,
+    max_mem_height: Optional[int] = None,
+    mem_height_history: Optional[memory.MemHeightHistory] = None,
+    result_cache: Optional[ResultCache] = None,
+    governor: Optional[NodeGovernor] = None,
+    decompress_reads: bool = False,
+) -> RunReport:
+    """
+    Returns a report of the time, memory and disk used by each stage; ignore it if
+    you do not need it.
+
+    With `resume`, stages that already completed in `tmp_directory` with the same
+    inputs (e.g. before the process got killed) are skipped.
+
+    With `preprocess_reads`, reads get subsampled and quality trimmed into
+    `tmp_directory` before cortex reads them.
+
+    Without `tmp_directory`, `scratch` chooses where to make one (by default, the
+    system's tmp directory).
+
+    If cortex's hash table fills up, indexing the reference or calling, that step is
+    retried with mem_height one larger (doubling the hash table), up to
+    `max_mem_height`; otherwise HashTableFull is raised. A built index and the input
+    files are reused. `mem_height_history` records the
+    mem_height that worked, and runs on alike inputs start from it.
+
+    With `result_cache`, a run identical to a cached one (same reference, reads and
+    parameters) delivers its cached VCF, and other runs add theirs.
+
+    With `governor`, cortex only starts once the node has room for its hash table (at
+    `max_mem_height`, if set), reserved until calls end; the wait is the report's
+    "admission" stage.
+
+    With `decompress_reads`, gzipped reads files get decompressed by threads, one
+    per file, into FIFOs that cortex reads (see `cortex.fifo`).
+    """
+    return _run_blocking(
+        _run_stages(
+            _BlockingSteps(timeout, cancel),
+            reference_fasta,
+            reads_files,
+            output_vcf_file_path,
+            sample_name,
+            ploidy,
+            tmp_directory,
+            mem_height,
+            cleanup,
+            index_cache,
+            on_progress,
+            resume,
+            preprocess_reads,
+            scratch,
+            max_mem_height,
+            mem_height_history,
+            result_cache,
+            governor,
+            decompress_reads,
+        )
+    )
+
+
+async def run_async(
+    reference_fasta: StrPath,
+    reads_files: List[StrPath],
+    output_vcf_file_path: StrPath,
+    sample_name: str = "sample",
+    ploidy: int = 1,
+    tmp_directory: PathLike = None,
+    mem_height: Union[int, str] = 22,
+    cleanup: bool = True,
+    index_cache: Optional[IndexCache] = None,
+    on_progress: Optional[utils.ProgressCallback] = None,
+    resume: bool = False,
+    preprocess_reads: Optional[ReadsPreprocessing] = None,
+    scratch: Optional[ScratchPolicy] = None,
+    max_mem_height: Optional[int] = None,
+    mem_height_history: Optional[memory.MemHeightHistory] = None,
+    result_cache: Optional[ResultCache] = None,
+    governor: Optional[NodeGovernor] = None,
+    decompress_reads: bool = False,
+) -> RunReport:
+    """
+    `run` for asyncio: cortex runs in asyncio subprocesses, and file preparation in
+    the event loop's default executor.
+    Cancelling it kills cortex and, if `cleanup` (and not `resume`), removes
+    `tmp_directory`.
+    """
+    return await _run_stages(
+        _AsyncSteps(),
+        reference_fasta,
+        reads_files,
+        output_vcf_file_path,
+        sample_name,
+        ploidy,
+        tmp_directory,
+        mem_height,
+        cleanup,
+        index_cache,
+        on_progress,
+        resume,
+        preprocess_reads,
+        scratch,
+        max_mem_height,
+        mem_height_history,
+        result_cache,
+        governor,
+        decompress_reads,
+    )
+
+
+class Sample(NamedTuple):
+    reference_fasta: StrPath
+    reads_files: List[StrPath]
+    output_vcf_file_path: StrPath
+    sample_name: str = "sample"
+    # Overrides the run's tmp_directory
+    tmp_directory: Optional[StrPath] = None
+
+
+class SampleResult(NamedTuple):
+    sample: Sample
+    error: Optional[BaseException] = None
+    # The sample's RunReport, as its to_dict(), when it succeeded
+    report: Optional[Dict] = None
+
+    @property
+    def success(self) -> bool:
+        return self.error is None
+
+
+def _run_sample(
+    sample: Sample,
+    mem_height: Union[int, str],
+    run_kwargs: dict,
+    process_group_directory: Optional[Path] = None,
+) -> Dict:
+    # Run in a process of its own: the process groups of its commands get recorded
+    utils.process_group_directory = process_group_directory
+    if sample.tmp_directory is not None:
+        run_kwargs = {**run_kwargs, "tmp_directory": sample.tmp_directory}
+    report = run(
+        sample.reference_fasta,
+        sample.reads_files,
+        sample.output_vcf_file_path,
+        sample_name=sample.sample_name,
+        mem_height=mem_height,
+        **run_kwargs,
+    )
+    return report.to_dict()
+
+
+def _sample_auto_mem_height(sample: Sample) -> Union[int, Exception]:
+    try:
+        return memory.auto_mem_height(
+            [sample.reference_fasta] + list(sample.reads_files), _KMER_SIZE, _MEM_WIDTH
+        )
+    except Exception as error:
+        return error
+
+
+def _result_cached(
+    sample: Sample, mem_height: Union[int, str], run_kwargs: dict
+) -> bool:
+    """Whether `run` would deliver the sample's VCF from its result cache"""
+    result_cache = run_kwargs.get("result_cache")
+    if result_cache is None:
+        return False
+    ploidy = run_kwargs.get("ploidy", 1)
+    try:
+        reference_fasta, reads_files, mem_height = _resolve_inputs(
+            sample.reference_fasta, list(sample.reads_files), ploidy, mem_height
+        )
+        _, cached_vcf = _look_up_result(
+            result_cache,
+            reference_fasta,
+            reads_files,
+            sample_name=sample.sample_name,
+            ploidy=ploidy,
+            mem_height=mem_height,
+            preprocess_reads=run_kwargs.get("preprocess_reads"),
+        )
+    except (OSError, ValueError):
+        return False  # `run` reports it
+    return cached_vcf is not None
+
+
+def _sample_memory(mem_height: Union[int, str], max_mem_height: Optional[int]) -> int:
+    """
+    `_reserved_memory` of a sample; mem_height stays "auto" for samples whose VCF is
+    cached, needing no hash table
+    """
+    if mem_height == "auto":
+        return 0
+    return _reserved_memory(mem_height, max_mem_height)
+
+
+def _reserved_memory(mem_height: int, max_mem_height: Optional[int]) -> int:
+    """Hash table memory of a run, at the largest mem_height it may retry with"""
+    return memory.hash_table_bytes(max(mem_height, max_mem_height or 0), _MEM_WIDTH)
+
+
+def _over_budget_error(sample_memory: int, max_memory: int) -> ValueError:
+    return ValueError(
+        f"Estimated memory {sample_memory} bytes exceeds max_memory {max_memory} bytes"
+    )
+
+
+def _check_picklable(run_kwargs: dict):
+    """Samples' processes get `run_kwargs` pickled: e.g. no events, nor closures"""
+    for name, value in run_kwargs.items():
+        try:
+            pickle.dumps(value)
+        except (pickle.PicklingError, TypeError, AttributeError) as error:
+            raise ValueError(
+                f"run_many cannot pass {name} to the samples' processes: {error}"
+            ) from None
+
+
+def run_many(
+    samples: List[Sample],
+    max_memory: Optional[int] = None,
+    max_workers: Optional[int] = None,
+    executor: Optional[Executor] = None,
+    **run_kwargs,
+) -> List[SampleResult]:
+    """
+    Runs `run` on each sample, in a process of its own. Samples are started in order,
+    at most `max_workers` at once, and only while the estimated hash table memory of
+    all running samples fits in `max_memory` bytes. A sample whose process dies (e.g.
+    OOM-killed) fails with BrokenProcessPool, and its cortex commands get killed.
+    `run_kwargs` are passed on to `run` for every sample. With `mem_height="auto"`,
+    each sample's mem_height is estimated (in a pool of processes) before scheduling
+    any sample, except for samples whose VCF is in the `result_cache`.
+
+    With `executor` (e.g. a `cortex.executors.CommandExecutor`), samples run with it
+    instead; it is left running.
+
+    A failing sample does not stop the others: check each result's `success`.
+    """
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    _check_picklable(run_kwargs)
+    mem_height = run_kwargs.pop("mem_height", 22)
+    if mem_height == "auto":
+        cached = [_result_cached(sample, mem_height, run_kwargs) for sample in samples]
+        uncached = [sample for sample, hit in zip(samples, cached) if not hit]
+        if executor is None:
+            with ProcessPoolExecutor(max_workers) as pool:
+                estimates = iter(list(pool.map(_sample_auto_mem_height, uncached)))
+        else:
+            estimates = iter(list(executor.map(_sample_auto_mem_height, uncached)))
+        mem_heights = ["auto" if hit else next(estimates) for hit in cached]
+    else:
+        mem_heights = [mem_height] * len(samples)
+
+    results: List[Optional[SampleResult]] = [None] * len(samples)
+    pending = deque(enumerate(samples))
+    running: Dict = dict()  # future -> (sample index, reserved memory, own pool)
+    memory_in_use = 0
+    process_groups = Path(tempfile.mkdtemp(prefix="cortex_process_groups_"))
+    try:
+        while pending or running:
+            while pending and len(running) < max_workers:
+                index, sample = pending[0]
+                sample_mem_height = mem_heights[index]
+                if isinstance(sample_mem_height, Exception):
+                    pending.popleft()
+                    results[index] = SampleResult(sample, sample_mem_height)
+                    continue
+                sample_memory = _sample_memory(
+                    sample_mem_height, run_kwargs.get("max_mem_height")
+                )
+                if max_memory is not None:
+                    if sample_memory > max_memory:
+                        pending.popleft()
+                        results[index] = SampleResult(
+                            sample, _over_budget_error(sample_memory, max_memory)
+                        )
+                        continue
+                    if memory_in_use + sample_memory > max_memory:
+                        break
+                pending.popleft()
+                if executor is None:
+                    # A process of its own, so that dying abruptly (e.g. OOM-killed)
+                    # fails only this sample
+                    pool = ProcessPoolExecutor(1)
+                    sample_process_groups = process_groups / str(index)
+                    sample_process_groups.mkdir()
+                    future = pool.submit(
+                        _run_sample,
+                        sample,
+                        sample_mem_height,
+                        run_kwargs,
+                        sample_process_groups,
+                    )
+                else:
+                    pool = None
+                    future = executor.submit(
+                        _run_sample, sample, sample_mem_height, run_kwargs
+                    )
+                running[future] = (index, sample_memory, pool)
+                memory_in_use += sample_memory
+
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, reserved_memory, pool = running.pop(future)
+                memory_in_use -= reserved_memory
+                error = future.exception()
+                if pool is not None:
+                    pool.shutdown()
+                    if isinstance(error, BrokenProcessPool):
+                        # The sample's cortex outlives its process: kill it
+                        utils.kill_recorded_process_groups(process_groups / str(index))
+                results[index] = SampleResult(
+                    samples[index], error, None if error else future.result()
+                )
+    finally:
+        for future, (_, _, pool) in running.items():
+            if pool is not None:
+                future.cancel()
+                pool.shutdown()
+        shutil.rmtree(process_groups, ignore_errors=True)
+
+    return results
+
+
+class _Admission:
+    """
+    Admits asyncio tasks while at most `max_concurrency` run, and their reserved
+    memory fits in `max_memory` bytes.
+    """
+
+    def __init__(
+        self, max_concurrency: Optional[int] = None, max_memory: Optional[int] = None
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_memory = max_memory
+        self.condition = asyncio.Condition()
+        self.num_running = 0
+        self.memory_in_use = 0
+
+    def _admissible(self, reserved_memory: int) -> bool:
+        if self.max_concurrency is not None:
+            if self.num_running >= self.max_concurrency:
+                return False
+        return (
+            self.max_memory is None
+            or self.memory_in_use + reserved_memory <= self.max_memory
+        )
+
+    @contextlib.asynccontextmanager
+    async def admit(self, reserved_memory: int):
+        async with self.condition:
+            await self.condition.wait_for(lambda: self._admissible(reserved_memory))
+            self.num_running += 1
+            self.memory_in_use += reserved_memory
+        try:
+            yield
+        finally:
+            async with self.condition:
+                self.num_running -= 1
+                self.memory_in_use -= reserved_memory
+                self.condition.notify_all()
+
+
+async def run_many_async(
+    samples: List[Sample],
+    max_memory: Optional[int] = None,
+    max_concurrency: Optional[int] = None,
+    **run_kwargs,
+) -> List[SampleResult]:
+    """
+    `run_many` for asyncio, running each sample with `run_async`.
+    At most `max_concurrency` samples run at once, and only while their estimated
+    hash table memory fits in `max_memory` bytes.
+    """
+    mem_height = run_kwargs.pop("mem_height", 22)
+    admission = _Admission(max_concurrency, max_memory)
+
+    async def run_sample(sample: Sample) -> SampleResult:
+        sample_mem_height = mem_height
+        if sample_mem_height == "auto" and not await _in_executor(
+            _result_cached, sample, mem_height, run_kwargs
+        ):
+            sample_mem_height = await _in_executor(_sample_auto_mem_height, sample)
+            if isinstance(sample_mem_height, Exception):
+                return SampleResult(sample, sample_mem_height)
+        sample_memory = _sample_memory(
+            sample_mem_height, run_kwargs.get("max_mem_height")
+        )
+        if max_memory is not None and sample_memory > max_memory:
+            return SampleResult(sample, _over_budget_error(sample_memory, max_memory))
+
+        sample_run_kwargs = run_kwargs
+        if sample.tmp_directory is not None:
+            sample_run_kwargs = {**run_kwargs, "tmp_directory": sample.tmp_directory}
+        try:
+            async with admission.admit(sample_memory):
+                report = await run_async(
+                    sample.reference_fasta,
+                    sample.reads_files,
+                    sample.output_vcf_file_path,
+                    sample_name=sample.sample_name,
+                    mem_height=sample_mem_height,
+                    **sample_run_kwargs,
+                )
+        except Exception as error:
+            return SampleResult(sample, error)
+        return SampleResult(sample, report=report.to_dict())
+
+    return list(await asyncio.gather(*(run_sample(sample) for sample in samples)))
+
+
+def run_sharded(
+    reference_fasta: StrPath,
+    reads_files: List[StrPath],
+    output_vcf_file_path: StrPath,
+    sample_name: str = "sample",
+    window_size: Optional[int] = None,
+    overlap: int = sharding.DEFAULT_OVERLAP,
+    tmp_directory: Optional[PathLike] = None,
+    cleanup: bool = True,
+    max_memory: Optional[int] = None,
+    max_workers: Optional[int] = None,
+    **run_kwargs,
+) -> None:
+    """
+    `run` for one sample, with the reference split into shards called in parallel
+    (with `run_many`): one per sequence, or with `window_size`, windows overlapping by
+    `overlap` bases. Reads go to the shards they share kmers with.
+    The shards' calls get merged into one VCF, each call coming from the shard whose
+    window it is most central in. Raises the first error if any shard failed.
+    """
+    reference_fasta = Path(reference_fasta).resolve()
+    reads_files = [Path(reads_file).resolve() for reads_file in reads_files]
+    tmp_directory = _make_tmp_directory(tmp_directory)
+
+    shards = sharding.make_shards(
+        utils.get_fai_records(reference_fasta), window_size, overlap
+    )
+    shard_inputs = sharding.write_shard_inputs(
+        reference_fasta,
+        reads_files,
+        shards,
+        tmp_directory / "shards",
+        _KMER_SIZE,
+        max_workers,
+    )
+    # Shards no read got routed to have nothing to call
+    shard_inputs = [inputs for inputs in shard_inputs if inputs.reads_files]
+    samples = [
+        Sample(
+            inputs.reference_fasta,
+            inputs.reads_files,
+            inputs.directory / "calls.vcf",
+            sample_name,
+            tmp_directory=inputs.directory / "cortex",
+        )
+        for inputs in shard_inputs
+    ]
+    results = run_many(samples, max_memory, max_workers, cleanup=cleanup, **run_kwargs)
+    for result in results:
+        if not result.success:
+            raise result.error
+
+    merged_vcf = tmp_directory / "merged.vcf"
+    sharding.merge_shard_vcfs(
+        [
+            (inputs.shard, Path(sample.output_vcf_file_path))
+            for inputs, sample in zip(shard_inputs, samples)
+        ],
+        merged_vcf,
+        sample_name,
+    )
+    _write_output_vcf(merged_vcf, output_vcf_file_path, cleanup)
+    _finish(tmp_directory, cleanup)
+
+
+def _kmer_progress(
+    on_progress: Optional[utils.ProgressCallback], kmer_size: int
+) -> Optional[utils.ProgressCallback]:
+    if on_progress is None:
+        return None
+    return lambda stage, line: on_progress(f"k{kmer_size} {stage}", line)
+
+
+def _index_and_call(
+    caller: _CortexCall,
+    reference_fasta: Path,
+    index_cache: Optional[IndexCache],
+    genome_size: int,
+    on_progress: Optional[utils.ProgressCallback],
+    timeout: Optional[float],
+    stop: threading.Event,
+):
+    caller.make_index(reference_fasta, index_cache)
+    if stop.is_set():
+        raise utils.SyscallCancelled(f"Calls at k={caller.kmer_size} cancelled")
+    caller.execute_calls(
+        genome_size, _kmer_progress(on_progress, caller.kmer_size), timeout, stop
+    )
+
+
+def _call_concurrently(
+    callers: List[_CortexCall],
+    cancel: Optional[threading.Event],
+    *args,
+):
+    """
+    `_index_and_call` for each caller, in threads. A failure (or `cancel`) stops the
+    others, and the first failure gets raised.
+    """
+    stop = threading.Event()
+    with ThreadPoolExecutor(len(callers)) as pool:
+        futures = [
+            pool.submit(_index_and_call, caller, *args, stop) for caller in callers
+        ]
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=1, return_when=FIRST_EXCEPTION)
+            if (cancel is not None and cancel.is_set()) or any(
+                future.exception() is not None for future in done
+            ):
+                stop.set()
+    errors = [future.exception() for future in futures if future.exception()]
+    if errors:
+        # Rather than the cancellations it caused
+        raise next(
+            (
+                error
+                for error in errors
+                if not isinstance(error, utils.SyscallCancelled)
+            ),
+            errors[0],
+        )
+
+
+def run_multi_k(
+    reference_fasta: StrPath,
+    reads_files: List[StrPath],
+    output_vcf_file_path: StrPath,
+    kmer_sizes: Sequence[int] = multik.DEFAULT_KMER_SIZES,
+    sample_name: str = "sample",
+    ploidy: int = 1,
+    tmp_directory: PathLike = None,
+    mem_height: Union[int, str] = 22,
+    cleanup: bool = True,
+    index_cache: Optional[IndexCache] = None,
+    on_progress: Optional[utils.ProgressCallback] = None,
+    timeout: Optional[float] = None,
+    cancel: Optional[threading.Event] = None,
+) -> RunReport:
+    """
+    `run` at several kmer sizes at once: the reads get profiled and the genome size
+    computed once, then each kmer size gets its reference index built and its calls
+    made, concurrently. Each holds its own hash table, so memory adds up.
+    The calls get merged into one VCF, keeping a call made at several kmer sizes once,
+    as made at the first of `kmer_sizes`. Kmer sizes larger than every read are
+    skipped. `on_progress` gets stages prefixed with their kmer size ("k31 cleaning").
+    """
+    kmer_sizes = multik.check_kmer_sizes(kmer_sizes)
+    report = RunReport()
+    with report.stage("inputs"):
+        reference_fasta, reads_files, mem_height = _resolve_inputs(
+            reference_fasta, reads_files, ploidy, mem_height
+        )
+        mem_height = _resolve_mem_height(reference_fasta, reads_files, mem_height)
+        tmp_directory = _make_tmp_directory(tmp_directory, None, mem_height)
+    _start_report(
+        report,
+        reference_fasta,
+        reads_files,
+        tmp_directory,
+        output_vcf_file_path=output_vcf_file_path,
+        sample_name=sample_name,
+        ploidy=ploidy,
+        mem_height=mem_height,
+        cleanup=cleanup,
+    )
+    report.parameters["kmer_size"] = kmer_sizes
+
+    try:
+        with report.stage("reads profile"):
+            max_read_len = _profile_reads(report, reads_files, min(kmer_sizes))
+        with report.stage("genome size"):
+            genome_size = utils.get_sequence_length(reference_fasta)
+            seq_ids = [record.name for record in utils.get_fai_records(reference_fasta)]
+        callers = [
+            _CortexCall(
+                tmp_directory / f"k{kmer_size}",
+                ploidy,
+                mem_height,
+                max_read_len,
+                kmer_size,
+            )
+            for kmer_size in kmer_sizes
+            if max_read_len is not None and kmer_size <= max_read_len
+        ]
+        with report.stage("input files"):
+            for caller in callers:
+                caller.make_input_files(reference_fasta, reads_files, sample_name)
+        if callers:
+            with report.stage("index and calls"):
+                _call_concurrently(
+                    callers,
+                    cancel,
+                    reference_fasta,
+                    index_cache,
+                    genome_size,
+                    on_progress,
+                    timeout,
+                )
+        with report.stage("vcf merge"):
+            kmer_vcfs = list()
+            for caller in callers:
+                final_vcf_path = _find_final_vcf_file_path(caller.base)
+                if final_vcf_path is not None:
+                    kmer_vcfs.append((caller.kmer_size, Path(final_vcf_path)))
+            merged_vcf = tmp_directory / "merged.vcf"
+            multik.merge_kmer_vcfs(kmer_vcfs, merged_vcf, sample_name, seq_ids)
+        with report.stage("vcf delivery"):
+            _write_output_vcf(merged_vcf, output_vcf_file_path, cleanup)
+        with report.stage("cleanup"):
+            _finish(tmp_directory, cleanup)
+    finally:
+        report.stop()
+    return report
+
+
+def run_joint(
+    reference_fasta: StrPath,
+    samples: Dict[str, List[StrPath]],
+    output_vcf_file_path: StrPath,
+    sample_vcfs: Optional[Dict[str, StrPath]] = None,
+    ploidy: int = 1,
+    tmp_directory: PathLike = None,
+    mem_height: Union[int, str] = 22,
+    cleanup: bool = True,
+    index_cache: Optional[IndexCache] = None,
+    on_progress: Optional[utils.ProgressCallback] = None,
+    timeout: Optional[float] = None,
+    cancel: Optional[threading.Event] = None,
+) -> RunReport:
+    """
+    Calls a cohort in one cortex run, with its joint workflow: `samples` (sample name:
+    reads files) get pooled into one graph with the reference, built once, and each
+    sample gets genotyped at the variants of the pool. The VCF has a column per
+    sample. With `sample_vcfs` (sample name: VCF path), each of those samples' calls
+    (records where it carries a non-reference allele) also get written to its own VCF.
+    The hash table holds the kmers of all samples: size `mem_height` for that.
+    """
+    if not samples:
+        raise ValueError("No samples to call")
+    # A colour per sample, and one for the reference
+    joint_binary = _cortex_var_binary(_KMER_SIZE, len(samples) + 1)
+    if len(samples) > _MAX_JOINT_SAMPLES and not os.path.exists(joint_binary):
+        raise ValueError(
+            f"Calling {len(samples)} samples jointly needs {joint_binary}, not "
+            f"built: the installed builds call up to {_MAX_JOINT_SAMPLES} samples. "
+            f"Build it with `make NUM_COLS={len(samples) + 1} cortex_var` in "
+            f"{settings.CORTEX_ROOT}"
+        )
+    if sample_vcfs is not None and not set(sample_vcfs) <= set(samples):
+        raise ValueError(f"Unknown samples: {sorted(set(sample_vcfs) - set(samples))}")
+    for reads_files in samples.values():
+        if type(reads_files) is not list:
+            raise ValueError("read files must be passed as list, even if single file")
+    report = RunReport()
+    with report.stage("inputs"):
+        reference_fasta, all_reads_files, mem_height = _resolve_inputs(
+            reference_fasta,
+            list(itertools.chain.from_iterable(samples.values())),
+            ploidy,
+            mem_height,
+        )
+        mem_height = _resolve_mem_height(reference_fasta, all_reads_files, mem_height)
+        samples = {
+            sample_name: [Path(reads_file).resolve() for reads_file in reads_files]
+            for sample_name, reads_files in samples.items()
+        }
+        tmp_directory = _make_tmp_directory(tmp_directory, None, mem_height)
+    _start_report(
+        report,
+        reference_fasta,
+        all_reads_files,
+        tmp_directory,
+        output_vcf_file_path=output_vcf_file_path,
+        sample_name=list(samples),
+        ploidy=ploidy,
+        mem_height=mem_height,
+        cleanup=cleanup,
+    )
+
+    try:
+        with report.stage("reads profile"):
+            max_read_len = _profile_reads(report, all_reads_files)
+        if max_read_len is not None:
+            caller = _CortexCall(
+                tmp_directory,
+                ploidy,
+                mem_height,
+                max_read_len,
+                num_samples=len(samples),
+            )
+            with report.stage("index"):
+                caller.make_index(reference_fasta, index_cache)
+            with report.stage("input files"):
+                caller.make_joint_input_files(reference_fasta, samples)
+            with report.stage("genome size"):
+                genome_size = utils.get_sequence_length(reference_fasta)
+            with report.stage("calls"):
+                caller.execute_calls(genome_size, on_progress, timeout, cancel)
+        with report.stage("vcf delivery"):
+            joint_vcf = _deliver_vcf(
+                tmp_directory, output_vcf_file_path, list(samples), cleanup
+            )
+            if sample_vcfs:
+                split_directory = tmp_directory / "samples"
+                split_directory.mkdir(exist_ok=True)
+                split_vcfs = {
+                    sample_name: split_directory / f"{index}.vcf"
+                    for index, sample_name in enumerate(sample_vcfs)
+                }
+                _split_vcf_by_sample(joint_vcf, split_vcfs)
+                for sample_name, split_vcf in split_vcfs.items():
+                    _write_output_vcf(split_vcf, sample_vcfs[sample_name], cleanup)
+        with report.stage("cleanup"):
+            _finish(tmp_directory, cleanup)
+    finally:
+        report.stop()
+    return report
@@ -0,0 +1,44 @@
+import json
+import os
+from pathlib import Path
+from typing import Iterable
+
+
+class Checkpoints:
+    """
+    Completion markers of the stages of a run, kept under its tmp directory.
+
+    A stage is done if its marker records the same fingerprint (of the stage's inputs,
+    including the previous stage's fingerprint) and its recorded outputs are all
+    still there with the same sizes.
+    """
+
+    def __init__(self, tmp_directory: Path):
+        self.directory = tmp_directory / "checkpoints"
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _marker(self, stage: str) -> Path:
+        return self.directory / f"{stage.replace(' ', '_')}.json"
+
+    def done(self, stage: str, fingerprint: str) -> bool:
+        try:
+            with self._marker(stage).open() as f:
+                marker = json.load(f)
+            if marker["fingerprint"] != fingerprint:
+                return False
+            return all(
+                os.stat(output).st_size == size
+                for output, size in marker["outputs"].items()
+            )
+        except (OSError, ValueError, KeyError):
+            return False
+
+    def mark(self, stage: str, fingerprint: str, outputs: Iterable[Path] = ()):
+        marker = {
+            "fingerprint": fingerprint,
+            "outputs": {str(output): os.stat(output).st_size for output in outputs},
+        }
+        tmp_marker = self._marker(stage).with_suffix(".tmp")
+        with tmp_marker.open("w") as f:
+            json.dump(marker, f)
+        os.replace(tmp_marker, self._marker(stage))
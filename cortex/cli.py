@@ -0,0 +1,336 @@
+"""
+The `py-cortex` command.
+
+    py-cortex run reference.fa reads.fq --output out.vcf
+    py-cortex batch samples.tsv --jobs 4 --summary summary.tsv
+    py-cortex submit --socket /tmp/cortex.sock reference.fa reads.fq --output out.vcf
+
+Only argparse gets imported up front; each subcommand imports what it needs, so that
+`--help` and `submit` start fast.
+"""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+# Columns of a batch manifest; the others are optional
+_MANIFEST_COLUMNS = ("sample_name", "reference_fasta", "reads_files", "output_vcf")
+_MANIFEST_OPTIONAL_COLUMNS = ("tmp_directory",)
+_SUMMARY_COLUMNS = (
+    "sample_name",
+    "outcome",
+    "wall_seconds",
+    "cpu_seconds",
+    "mem_height",
+    "output_vcf",
+    "error",
+)
+
+
+def _mem_height(value: str) -> Union[int, str]:
+    if value == "auto":
+        return value
+    try:
+        return int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError('must be an int or "auto"') from None
+
+
+def _add_run_options(parser: argparse.ArgumentParser):
+    parser.add_argument("--ploidy", type=int, choices=(1, 2), default=1)
+    parser.add_argument("--mem_height", type=_mem_height, default=22)
+    parser.add_argument(
+        "--max_mem_height", type=int, help="retry up to this if the hash table fills"
+    )
+    parser.add_argument(
+        "--no_cleanup",
+        action="store_true",
+        help="keep the tmp directory, with cortex output and logs",
+    )
+    parser.add_argument(
+        "--decompress_reads",
+        action="store_true",
+        help="feed gzipped reads to cortex through FIFOs, decompressed by threads",
+    )
+
+
+def _run_kwargs(args: argparse.Namespace) -> Dict:
+    return dict(
+        ploidy=args.ploidy,
+        mem_height=args.mem_height,
+        max_mem_height=args.max_mem_height,
+        cleanup=not args.no_cleanup,
+        decompress_reads=args.decompress_reads,
+    )
+
+
+def _add_result_cache_options(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--result_cache", type=Path, help="directory keeping VCFs of earlier runs"
+    )
+    parser.add_argument(
+        "--result_cache_max_bytes", type=int, help="evict VCFs beyond this size"
+    )
+
+
+def _result_cache(args: argparse.Namespace):
+    if args.result_cache is None:
+        return None
+    from cortex.cache import ResultCache
+
+    return ResultCache(args.result_cache, args.result_cache_max_bytes)
+
+
+def _add_governor_options(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--governor",
+        type=Path,
+        help="node-local directory where concurrent runs queue for memory",
+    )
+    parser.add_argument(
+        "--governor_max_memory",
+        type=int,
+        help="bytes of hash tables of the node's running samples "
+        "(default: physical memory)",
+    )
+    parser.add_argument(
+        "--governor_timeout", type=float, help="seconds to wait for memory"
+    )
+
+
+def _governor(args: argparse.Namespace):
+    if args.governor is None:
+        return None
+    from cortex.governor import NodeGovernor
+
+    return NodeGovernor(
+        args.governor, args.governor_max_memory, timeout=args.governor_timeout
+    )
+
+
+def _run(args: argparse.Namespace) -> int:
+    from cortex import calls
+
+    report = calls.run(
+        args.reference_fasta,
+        args.reads_files,
+        args.output,
+        sample_name=args.sample_name,
+        tmp_directory=args.tmp_directory,
+        result_cache=_result_cache(args),
+        governor=_governor(args),
+        **_run_kwargs(args),
+    )
+    if args.report is not None:
+        args.report.write_text(report.to_json(indent=2))
+    return 0
+
+
+def _split_reads_files(reads_files: Union[str, List[str]]) -> List[str]:
+    if isinstance(reads_files, str):
+        return [path for path in reads_files.split(",") if path]
+    return list(reads_files)
+
+
+def _read_manifest(manifest_path: Path) -> List:
+    """
+    Samples of a manifest: a JSON list of objects, or a TSV file with a header line,
+    with keys sample_name, reference_fasta, reads_files (a list, or comma-separated),
+    output_vcf and optionally tmp_directory. Relative paths are relative to the
+    manifest's directory. Each sample gets its own tmp directory.
+    """
+    from cortex.calls import Sample
+
+    text = manifest_path.read_text()
+    if manifest_path.suffix == ".json":
+        rows = json.loads(text)
+    else:
+        lines = [line for line in text.splitlines() if line and line[0] != "#"]
+        header = lines[0].split("\t") if lines else []
+        rows = [dict(zip(header, line.split("\t"))) for line in lines[1:]]
+
+    def resolve(path: str) -> str:
+        return str(manifest_path.parent / path)
+
+    samples = list()
+    for number, row in enumerate(rows, start=1):
+        missing = [column for column in _MANIFEST_COLUMNS if not row.get(column)]
+        if missing:
+            raise ValueError(f"{manifest_path}: sample {number} lacks {missing}")
+        unknown = set(row) - set(_MANIFEST_COLUMNS) - set(_MANIFEST_OPTIONAL_COLUMNS)
+        if unknown:
+            raise ValueError(f"{manifest_path}: unknown columns {sorted(unknown)}")
+        tmp_directory = row.get("tmp_directory") or None
+        samples.append(
+            Sample(
+                resolve(row["reference_fasta"]),
+                list(map(resolve, _split_reads_files(row["reads_files"]))),
+                resolve(row["output_vcf"]),
+                row["sample_name"],
+                None if tmp_directory is None else resolve(tmp_directory),
+            )
+        )
+    return samples
+
+
+def _summary_row(result) -> Dict:
+    row = dict(
+        sample_name=result.sample.sample_name,
+        outcome="ok" if result.success else "failed",
+        output_vcf=result.sample.output_vcf_file_path,
+        error="" if result.success else repr(result.error),
+    )
+    if result.report is not None:
+        stages = result.report["stages"]
+        row["wall_seconds"] = f"{sum(stage['wall_seconds'] for stage in stages):.1f}"
+        row["cpu_seconds"] = f"{sum(stage['cpu_seconds'] for stage in stages):.1f}"
+        row["mem_height"] = result.report["parameters"].get("mem_height", "")
+    return row
+
+
+def _write_summary(results: List, file) -> None:
+    """A TSV table of each sample's outcome and timings"""
+    print(*_SUMMARY_COLUMNS, sep="\t", file=file)
+    for result in results:
+        row = _summary_row(result)
+        print(
+            *(row.get(column, "") for column in _SUMMARY_COLUMNS), sep="\t", file=file
+        )
+
+
+def _executor(args: argparse.Namespace):
+    if args.submit_command is None:
+        return None
+    if args.shared_directory is None:
+        raise SystemExit("--submit_command needs --shared_directory")
+    from cortex.executors import CommandExecutor
+
+    return CommandExecutor(
+        args.shared_directory, args.submit_command, job_timeout=args.job_timeout
+    )
+
+
+def _batch(args: argparse.Namespace) -> int:
+    from cortex import calls
+
+    samples = _read_manifest(args.manifest)
+    executor = _executor(args)
+    try:
+        results = calls.run_many(
+            samples,
+            args.max_memory,
+            args.jobs,
+            executor=executor,
+            result_cache=_result_cache(args),
+            governor=_governor(args),
+            **_run_kwargs(args),
+        )
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    if args.summary is None:
+        _write_summary(results, sys.stdout)
+    else:
+        with args.summary.open("w") as f:
+            _write_summary(results, f)
+    failed = sum(not result.success for result in results)
+    print(
+        f"{len(results) - failed} samples succeeded, {failed} failed", file=sys.stderr
+    )
+    return 1 if failed else 0
+
+
+def _submit(args: argparse.Namespace) -> int:
+    from cortex.client import Client
+
+    job = dict(
+        sample_name=args.sample_name,
+        tmp_directory=args.tmp_directory,
+        **_run_kwargs(args),
+    )
+    job = {key: value for key, value in job.items() if value is not None}
+    client = Client(args.socket)
+    job_id = client.submit(args.reference_fasta, args.reads_files, args.output, **job)
+    print(job_id)
+    if args.wait:
+        client.wait(job_id)
+    return 0
+
+
+def _parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="py-cortex", description="Variant calling with cortex"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="call variants of one sample")
+    submit_parser = subparsers.add_parser(
+        "submit", help="queue a sample on a `python -m cortex.server` daemon"
+    )
+    submit_parser.add_argument("--socket", type=Path, required=True)
+    submit_parser.add_argument(
+        "--wait", action="store_true", help="wait for the job to end"
+    )
+    for subparser in (run_parser, submit_parser):
+        subparser.add_argument("reference_fasta", type=Path)
+        subparser.add_argument("reads_files", type=Path, nargs="+")
+        subparser.add_argument("--output", type=Path, required=True, help="VCF")
+        subparser.add_argument("--sample_name", default="sample")
+        subparser.add_argument(
+            "--tmp_directory", type=Path, help="(default: a new system tmp directory)"
+        )
+        _add_run_options(subparser)
+    run_parser.add_argument(
+        "--report", type=Path, help="write the run's report here, as JSON"
+    )
+    _add_result_cache_options(run_parser)
+    _add_governor_options(run_parser)
+    run_parser.set_defaults(function=_run)
+    submit_parser.set_defaults(function=_submit)
+
+    batch_parser = subparsers.add_parser(
+        "batch", help="call variants of the samples of a TSV or JSON manifest"
+    )
+    batch_parser.add_argument(
+        "manifest",
+        type=Path,
+        help="columns: " + ", ".join(_MANIFEST_COLUMNS + _MANIFEST_OPTIONAL_COLUMNS),
+    )
+    batch_parser.add_argument(
+        "--jobs", type=int, help="samples running at once (default: CPU count)"
+    )
+    batch_parser.add_argument(
+        "--max_memory", type=int, help="bytes of hash tables of running samples"
+    )
+    batch_parser.add_argument(
+        "--summary", type=Path, help="write the summary table here (default: stdout)"
+    )
+    batch_parser.add_argument(
+        "--submit_command",
+        help="run each sample as a job submitted with this command template, e.g. "
+        '"sbatch --job-name {job_name} --output {log} --wrap {command}"',
+    )
+    batch_parser.add_argument(
+        "--shared_directory",
+        type=Path,
+        help="directory of submitted jobs, seen by the nodes running them",
+    )
+    batch_parser.add_argument(
+        "--job_timeout", type=float, help="seconds after which a job counts as lost"
+    )
+    _add_run_options(batch_parser)
+    _add_result_cache_options(batch_parser)
+    _add_governor_options(batch_parser)
+    batch_parser.set_defaults(function=_batch)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = _parser().parse_args(argv)
+    return args.function(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
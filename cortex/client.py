@@ -0,0 +1,88 @@
+"""
+The client of a `cortex.server` daemon. It only needs the standard library, so that
+submitting a job starts fast.
+"""
+
+import json
+import socket
+from pathlib import Path
+from typing import Dict, Iterator, List, Union
+
+# cortex.file_manip's, whose imports are not needed here
+PathLike = Union[str, Path]
+
+
+class JobFailed(RuntimeError):
+    pass
+
+
+class Client:
+    """Talks to the `cortex.server` daemon on `socket_path`, one connection per call"""
+
+    def __init__(self, socket_path: PathLike):
+        self.socket_path = str(socket_path)
+
+    def _requests(self, request: Dict) -> Iterator[Dict]:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(self.socket_path)
+            sock.sendall(json.dumps(request).encode() + b"\n")
+            with sock.makefile("rb") as replies:
+                for line in replies:
+                    reply = json.loads(line)
+                    if "error" in reply and "job_id" not in reply:
+                        raise ValueError(reply["error"])
+                    yield reply
+
+    def _request(self, request: Dict) -> Dict:
+        replies = self._requests(request)
+        try:
+            return next(replies)
+        finally:
+            replies.close()
+
+    def submit(
+        self,
+        reference_fasta: PathLike,
+        reads_files: List[PathLike],
+        output_vcf_file_path: PathLike,
+        **run_kwargs,
+    ) -> str:
+        """Queues a `run`, returning its job id. Paths are resolved here."""
+        job = {
+            "reference_fasta": str(Path(reference_fasta).resolve()),
+            "reads_files": [str(Path(path).resolve()) for path in reads_files],
+            "output_vcf_file_path": str(Path(output_vcf_file_path).resolve()),
+            **run_kwargs,
+        }
+        if run_kwargs.get("tmp_directory") is not None:
+            job["tmp_directory"] = str(Path(run_kwargs["tmp_directory"]).resolve())
+        return self._request({"op": "submit", "job": job})["job_id"]
+
+    def status(self, job_id: str) -> Dict:
+        return self._request({"op": "status", "job_id": job_id})
+
+    def jobs(self) -> List[Dict]:
+        return self._request({"op": "jobs"})["jobs"]
+
+    def watch(self, job_id: str) -> Iterator[Dict]:
+        """The job's events, past and future: state changes and progress"""
+        return self._requests({"op": "watch", "job_id": job_id})
+
+    def wait(self, job_id: str) -> Dict:
+        """Waits for the job to end; raises JobFailed unless it is done"""
+        for _ in self.watch(job_id):
+            pass
+        status = self.status(job_id)
+        if status["state"] != "done":
+            raise JobFailed(f"Job {job_id} {status['state']}: {status['error']}")
+        return status
+
+    def cancel(self, job_id: str):
+        self._request({"op": "cancel", "job_id": job_id})
+
+    def forget(self, job_id: str):
+        """Drops a finished job from the daemon"""
+        self._request({"op": "forget", "job_id": job_id})
+
+    def shutdown(self):
+        self._request({"op": "shutdown"})
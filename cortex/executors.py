@@ -0,0 +1,205 @@
+"""
+Executors running batch jobs (`cortex.calls.run_many`) elsewhere than in a local pool
+of processes: `CommandExecutor` submits each job with a command (sbatch, bsub...), and
+follows it through files in a directory shared with the nodes running jobs.
+
+A job's directory holds its pickled call, its `state` (JSON: submitted, running, done
+or failed) and once ended, its pickled outcome. Nodes run a job with
+
+    python -m cortex.executors <job directory>
+"""
+
+import itertools
+import json
+import os
+import pickle
+import shlex
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import Executor, Future
+from pathlib import Path
+from typing import Dict, Optional
+
+from cortex.file_manip import PathLike
+
+_CALL_FILE = "call.pickle"
+_OUTCOME_FILE = "outcome.pickle"
+_STATE_FILE = "state"
+_LOG_FILE = "job.log"
+
+
+def _write_atomically(path: Path, data: bytes):
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
+
+
+def _write_state(job_directory: Path, state: str, **details):
+    details = {"state": state, "updated": time.time(), **details}
+    _write_atomically(job_directory / _STATE_FILE, json.dumps(details).encode())
+
+
+def job_states(directory: PathLike) -> Dict[str, Dict]:
+    """The state of each job under `directory`, by job id"""
+    states = dict()
+    for state_file in sorted(Path(directory).glob(f"*/{_STATE_FILE}")):
+        try:
+            states[state_file.parent.name] = json.loads(state_file.read_text())
+        except (OSError, ValueError):
+            continue  # Being replaced
+    return states
+
+
+class CommandExecutor(Executor):
+    """
+    Submits each call as a job with `submit_command`, a template formatted (and run
+    by the shell) with shell-quoted fields: {command}, the command running the job;
+    {job_name}; {job_directory} and {log}, the job's output file. E.g.
+
+        sbatch --job-name {job_name} --output {log} --mem 32G --wrap {command}
+        bsub -J {job_name} -o {log} {command}
+
+    The submit command's output is kept as the job's `scheduler_id`.
+    Jobs live in `directory`, which nodes running them must see at the same path, and
+    whose python (default: this one) must import cortex.
+    Jobs are polled every `poll_seconds`; those not ended within `job_timeout` seconds
+    of their submission (e.g. killed by the scheduler) fail with TimeoutError.
+    A call's function and arguments must pickle.
+    """
+
+    def __init__(
+        self,
+        directory: PathLike,
+        submit_command: str,
+        python: str = sys.executable,
+        poll_seconds: float = 5,
+        job_timeout: Optional[float] = None,
+    ):
+        self.directory = Path(directory)
+        self.submit_command = submit_command
+        self.python = python
+        self.poll_seconds = poll_seconds
+        self.job_timeout = job_timeout
+        self._run_id = uuid.uuid4().hex[:8]
+        self._job_numbers = itertools.count(1)
+        self._jobs: Dict[Path, tuple] = dict()  # job directory -> (future, deadline)
+        self._lock = threading.Lock()
+        self._jobs_changed = threading.Condition(self._lock)
+        self._shutdown = False
+        self._poller: Optional[threading.Thread] = None
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError("Cannot submit to an executor after shutdown")
+            job_id = f"{self._run_id}-{next(self._job_numbers)}"
+        job_directory = self.directory / job_id
+        job_directory.mkdir(parents=True)
+        (job_directory / _CALL_FILE).write_bytes(pickle.dumps((fn, args, kwargs)))
+
+        future: Future = Future()
+        future.set_running_or_notify_cancel()
+        command = f"{self.python} -m cortex.executors {job_directory}"
+        try:
+            submitted = subprocess.run(
+                self.submit_command.format(
+                    command=shlex.quote(command),
+                    job_name=shlex.quote(f"py-cortex-{job_id}"),
+                    job_directory=shlex.quote(str(job_directory)),
+                    log=shlex.quote(str(job_directory / _LOG_FILE)),
+                ),
+                shell=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                universal_newlines=True,
+                check=True,
+            )
+        except subprocess.CalledProcessError as error:
+            _write_state(job_directory, "failed", error=error.stderr.strip())
+            future.set_exception(error)
+            return future
+        _write_state(job_directory, "submitted", scheduler_id=submitted.stdout.strip())
+
+        deadline = None
+        if self.job_timeout is not None:
+            deadline = time.monotonic() + self.job_timeout
+        with self._lock:
+            self._jobs[job_directory] = (future, deadline)
+            if self._poller is None:
+                self._poller = threading.Thread(target=self._poll, daemon=True)
+                self._poller.start()
+            self._jobs_changed.notify_all()
+        return future
+
+    def _poll(self):
+        while True:
+            with self._lock:
+                while not self._jobs and not self._shutdown:
+                    self._jobs_changed.wait()
+                if not self._jobs:
+                    return
+                jobs = dict(self._jobs)
+            ended = list()
+            for job_directory, (future, deadline) in jobs.items():
+                if _collect(job_directory, future, deadline):
+                    ended.append(job_directory)
+            with self._lock:
+                for job_directory in ended:
+                    del self._jobs[job_directory]
+                if self._jobs:
+                    self._jobs_changed.wait(self.poll_seconds)
+
+    def shutdown(self, wait: bool = True):
+        with self._lock:
+            self._shutdown = True
+            self._jobs_changed.notify_all()
+            poller = self._poller
+        if wait and poller is not None:
+            poller.join()
+
+
+def _collect(job_directory: Path, future: Future, deadline: Optional[float]) -> bool:
+    """Whether the job ended, setting its future's outcome"""
+    try:
+        outcome = (job_directory / _OUTCOME_FILE).read_bytes()
+    except FileNotFoundError:
+        if deadline is None or time.monotonic() < deadline:
+            return False
+        future.set_exception(
+            TimeoutError(f"Job {job_directory.name} did not end in time")
+        )
+        return True
+    try:
+        succeeded, value = pickle.loads(outcome)
+    except Exception as error:
+        future.set_exception(error)
+        return True
+    if succeeded:
+        future.set_result(value)
+    else:
+        future.set_exception(value)
+    return True
+
+
+def run_job(job_directory: Path):
+    _write_state(job_directory, "running", host=socket.gethostname(), pid=os.getpid())
+    fn, args, kwargs = pickle.loads((job_directory / _CALL_FILE).read_bytes())
+    try:
+        outcome = (True, fn(*args, **kwargs))
+    except Exception as error:
+        outcome = (False, error)
+    try:
+        data = pickle.dumps(outcome)
+    except Exception:
+        outcome = (False, RuntimeError(repr(outcome[1])))
+        data = pickle.dumps(outcome)
+    _write_atomically(job_directory / _OUTCOME_FILE, data)
+    _write_state(job_directory, "done" if outcome[0] else "failed")
+
+
+if __name__ == "__main__":
+    run_job(Path(sys.argv[1]))
@@ -57,3 +57,11 @@ git checkout "${cortex_revision}"
 bash install.sh
 make NUM_COLS=1 cortex_var
 make NUM_COLS=2 cortex_var
+# For calling at kmer sizes above 31
+make MAXK=63 NUM_COLS=1 cortex_var
+make MAXK=63 NUM_COLS=2 cortex_var
+# For joint calling of cohorts of up to 8 samples: a colour per sample, one for the
+# reference
+for num_colours in 3 4 5 6 7 8 9; do
+  make NUM_COLS=$num_colours cortex_var
+done
@@ -0,0 +1,122 @@
+"""
+Feeding gzipped reads to cortex decompressed, through named pipes (FIFOs): cortex reads
+the FIFOs while threads inflate the reads into them, so that decompression overlaps
+graph building and no decompressed copy gets written to disk.
+"""
+
+import contextlib
+import errno
+import gzip
+import os
+import shutil
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterator, List, Optional
+
+from cortex import bgzf
+
+_CHUNK_BYTES = 1 << 20
+# BGZF blocks inflated in parallel at a time, each up to 64KiB
+_BLOCKS_PER_BATCH = 64
+_OPEN_POLL_SECONDS = 0.05
+
+
+def fifo_paths(reads_files: List[Path], directory: Path) -> List[Path]:
+    """Where each reads file gets fed: named like it, without .gz"""
+    paths = list()
+    for index, reads_file in enumerate(reads_files):
+        name = (
+            reads_file.name[:-3] if reads_file.name.endswith(".gz") else reads_file.name
+        )
+        paths.append(directory / f"{index}_{name}")
+    return paths
+
+
+def _inflate_bgzf(f_in: BinaryIO, f_out: BinaryIO, pool: ThreadPoolExecutor):
+    blocks = bgzf.iter_blocks(f_in)
+    while True:
+        batch = [block for _, block in zip(range(_BLOCKS_PER_BATCH), blocks)]
+        if not batch:
+            return
+        f_out.writelines(pool.map(bgzf.inflate_block, batch))
+
+
+def _inflate(reads_file: Path, f_out: BinaryIO, pool: ThreadPoolExecutor):
+    with reads_file.open("rb") as f_in:
+        if bgzf.is_bgzf(f_in):
+            _inflate_bgzf(f_in, f_out, pool)
+            return
+    with gzip.open(str(reads_file), "rb") as f_in:
+        shutil.copyfileobj(f_in, f_out, _CHUNK_BYTES)
+
+
+def _open_for_writing(fifo: Path, stop: threading.Event) -> Optional[int]:
+    """Waits for a reader to open the FIFO, unless stopped first"""
+    while not stop.is_set():
+        try:
+            fd = os.open(str(fifo), os.O_WRONLY | os.O_NONBLOCK)
+        except OSError as error:
+            if error.errno != errno.ENXIO:  # No reader yet
+                raise
+            stop.wait(_OPEN_POLL_SECONDS)
+            continue
+        os.set_blocking(fd, True)
+        return fd
+    return None
+
+
+def _feed(
+    reads_file: Path,
+    fifo: Path,
+    pool: ThreadPoolExecutor,
+    stop: threading.Event,
+    errors: Dict[Path, Exception],
+):
+    try:
+        fd = _open_for_writing(fifo, stop)
+        if fd is None:
+            return
+        with os.fdopen(fd, "wb") as f_out:
+            _inflate(reads_file, f_out, pool)
+    except BrokenPipeError:
+        pass  # The reader went away: its own failure gets reported
+    except (OSError, EOFError, ValueError, zlib.error) as error:
+        errors[reads_file] = error
+
+
+@contextlib.contextmanager
+def feeding(fifos: Dict[Path, Path], inflate_workers: int = 4) -> Iterator[None]:
+    """
+    Makes the FIFOs (FIFO path: gzipped reads file), and while in the context, feeds
+    each its reads file, decompressed, in a thread of its own. BGZF files (bgzip's)
+    get their blocks inflated by `inflate_workers` threads shared by all files.
+    Each FIFO gets fed once, to its first reader.
+    On leaving, unfinished feeding stops; raises RuntimeError if a reads file failed
+    to decompress.
+    """
+    for fifo in fifos:
+        with contextlib.suppress(FileNotFoundError):
+            fifo.unlink()
+        os.mkfifo(str(fifo))
+    stop = threading.Event()
+    errors: Dict[Path, Exception] = dict()
+    with ThreadPoolExecutor(inflate_workers) as pool:
+        threads = [
+            threading.Thread(
+                target=_feed, args=(reads_file, fifo, pool, stop, errors), daemon=True
+            )
+            for fifo, reads_file in fifos.items()
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+    if errors:
+        reads_file, error = next(iter(errors.items()))
+        raise RuntimeError(f"Decompressing {reads_file} failed: {error}")
@@ -1,6 +1,23 @@
+import contextlib
+import fcntl
 import glob
+import gzip
 import hashlib
-from typing import Optional, Union
+import os
+import re
+import shutil
+from typing import (
+    Callable,
+    Collection,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    TextIO,
+    Tuple,
+    Union,
+)
 from pathlib import Path
 
 from cortex.utils import syscall
@@ -40,7 +57,8 @@ def _find_final_vcf_file_path(cortex_directory: Path) -> Optional[PathLike]:
     return found[0]
 
 
-def _make_empty_vcf(output_file_path: PathLike, sample_name: str):
+def _make_empty_vcf(output_file_path: PathLike, sample_name: Union[str, Sequence[str]]):
+    """`sample_name` may be a list of names, for a multi-sample VCF"""
     print(
         "Cortex made no vcfs, so making an empty one.\n"
         "Known possible reasons why no vcf:\n"
@@ -61,13 +79,266 @@ def _make_empty_vcf(output_file_path: PathLike, sample_name: str):
         "FILTER",
         "INFO",
         "FORMAT",
-        sample_name,
+        *([sample_name] if isinstance(sample_name, str) else sample_name),
     ]
     with open(str(output_file_path), "w") as f_out:
         print(*header_lines, sep="\n", file=f_out)
         print(*header_tabs, sep="\t", file=f_out)
 
 
+class Call:
+    """
+    One VCF record. `pos` is 1-based, `qual` is None when missing ('.'), and
+    `samples` holds each sample's unparsed FORMAT values.
+    """
+
+    __slots__ = (
+        "chrom",
+        "pos",
+        "id",
+        "ref",
+        "alt",
+        "qual",
+        "filter",
+        "info",
+        "format",
+        "samples",
+    )
+
+    def __init__(
+        self,
+        chrom: str,
+        pos: int,
+        id: str,
+        ref: str,
+        alt: List[str],
+        qual: Optional[float],
+        filter: str,
+        info: str,
+        format: str,
+        samples: List[str],
+    ):
+        self.chrom = chrom
+        self.pos = pos
+        self.id = id
+        self.ref = ref
+        self.alt = alt
+        self.qual = qual
+        self.filter = filter
+        self.info = info
+        self.format = format
+        self.samples = samples
+
+    def __repr__(self) -> str:
+        return (
+            f"Call({self.chrom}:{self.pos} {self.ref}>{','.join(self.alt)}, "
+            f"filter={self.filter})"
+        )
+
+    def sample_values(self, sample_index: int = 0) -> Dict[str, str]:
+        """A sample's FORMAT values, e.g. {'GT': '1/1', 'COV': '0,12', ...}"""
+        return dict(zip(self.format.split(":"), self.samples[sample_index].split(":")))
+
+    def genotype(self, sample_index: int = 0) -> Optional[str]:
+        return self.sample_values(sample_index).get("GT")
+
+
+Region = Union[str, Tuple[str, int, int]]
+_REGION = re.compile(r"^(?P<chrom>.+?)(:(?P<start>[\d,]+)(-(?P<end>[\d,]+))?)?$")
+
+
+def _parse_region(region: Region) -> Tuple[str, int, float]:
+    """'chrom', 'chrom:start' or 'chrom:start-end' (1-based, inclusive, as samtools)"""
+    if not isinstance(region, str):
+        chrom, start, end = region
+        return chrom, start, end
+    match = _REGION.match(region)
+    if match is None:
+        raise ValueError(f"Invalid region: {region}")
+    start, end = match.group("start"), match.group("end")
+    return (
+        match.group("chrom"),
+        1 if start is None else int(start.replace(",", "")),
+        float("inf") if end is None else int(end.replace(",", "")),
+    )
+
+
+def _open_text(file_path: PathLike) -> TextIO:
+    with open(str(file_path), "rb") as f:
+        gzipped = f.read(2) == b"\x1f\x8b"
+    if gzipped:
+        return gzip.open(str(file_path), "rt")
+    return open(str(file_path))
+
+
+def iter_calls(
+    vcf_file_path: PathLike,
+    filter: Union[None, str, Collection[str]] = None,
+    region: Optional[Region] = None,
+    min_qual: Optional[float] = None,
+    predicate: Optional[Callable[[Call], bool]] = None,
+) -> Iterator[Call]:
+    """
+    Lazily reads the calls of a VCF[.gz], keeping those:
+      - whose FILTER is `filter` (or one of them), e.g. "PASS"
+      - overlapping `region`, e.g. "ref:1000-2000" or ("ref", 1000, 2000)
+      - with QUAL at least `min_qual` (calls with missing QUAL are dropped)
+      - for which `predicate` is true
+    Lines failing the chrom, position and FILTER checks get dropped before being
+    fully split.
+    """
+    if isinstance(filter, str):
+        filter = {filter}
+    chrom_prefix, start, end = None, 1, float("inf")
+    if region is not None:
+        chrom, start, end = _parse_region(region)
+        chrom_prefix = chrom + "\t"
+
+    with _open_text(vcf_file_path) as vcf:
+        for line in vcf:
+            if line.startswith("#"):
+                continue
+            if chrom_prefix is not None:
+                if not line.startswith(chrom_prefix):
+                    continue
+                pos = int(line.split("\t", 2)[1])
+                if pos > end:
+                    continue
+            fields = line.rstrip("\n").split("\t", 8)
+            if filter is not None and fields[6] not in filter:
+                continue
+            pos, ref = int(fields[1]), fields[3]
+            if pos + len(ref) - 1 < start:
+                continue
+            qual = None if fields[5] == "." else float(fields[5])
+            if min_qual is not None and (qual is None or qual < min_qual):
+                continue
+
+            format_and_samples = fields[8].split("\t") if len(fields) > 8 else [""]
+            call = Call(
+                fields[0],
+                pos,
+                fields[2],
+                ref,
+                fields[4].split(","),
+                qual,
+                fields[6],
+                fields[7],
+                format_and_samples[0],
+                format_and_samples[1:],
+            )
+            if predicate is None or predicate(call):
+                yield call
+
+
+_GT_ALLELE_SEPARATOR = re.compile(r"[/|]")
+
+
+def _carries_alt(sample_field: str, gt_index: int) -> bool:
+    values = sample_field.split(":")
+    if gt_index >= len(values):
+        return False
+    return any(
+        allele not in ("0", ".")
+        for allele in _GT_ALLELE_SEPARATOR.split(values[gt_index])
+    )
+
+
+def _split_vcf_by_sample(vcf_path: Path, sample_vcfs: Dict[str, Path]):
+    """
+    Writes each sample's column of a multi-sample VCF to its own VCF, keeping the
+    records where its genotype holds a non-reference allele.
+    """
+    with vcf_path.open() as vcf, contextlib.ExitStack() as stack:
+        meta_lines = list()
+        for line in vcf:
+            if not line.startswith("##"):
+                break
+            meta_lines.append(line)
+        columns = line.rstrip("\n").split("\t")
+        missing = set(sample_vcfs) - set(columns[9:])
+        if missing:
+            raise ValueError(f"No samples {sorted(missing)} in {vcf_path}")
+        # (column of the sample, its output)
+        outputs: List[Tuple[int, TextIO]] = list()
+        for sample_name, sample_vcf in sample_vcfs.items():
+            f_out = stack.enter_context(Path(sample_vcf).open("w"))
+            f_out.writelines(meta_lines)
+            print(*columns[:9], sample_name, sep="\t", file=f_out)
+            outputs.append((columns.index(sample_name, 9), f_out))
+
+        for line in vcf:
+            fields = line.rstrip("\n").split("\t")
+            format_keys = fields[8].split(":")
+            if "GT" not in format_keys:
+                continue
+            gt_index = format_keys.index("GT")
+            for column, f_out in outputs:
+                if _carries_alt(fields[column], gt_index):
+                    print(*fields[:9], fields[column], sep="\t", file=f_out)
+
+
+def _vcf_is_sorted(vcf_path: PathLike) -> bool:
+    """Records of each chromosome are contiguous, in increasing position order"""
+    seen_chroms = set()
+    previous_chrom, previous_pos = None, 0
+    with open(str(vcf_path), "rb") as f:
+        for line in f:
+            if line.startswith(b"#"):
+                continue
+            chrom, pos = line.split(b"\t", 2)[:2]
+            pos = int(pos)
+            if chrom != previous_chrom:
+                if chrom in seen_chroms:
+                    return False
+                seen_chroms.add(chrom)
+                previous_chrom, previous_pos = chrom, pos
+            elif pos < previous_pos:
+                return False
+            previous_pos = pos
+    return True
+
+
+# Linux ioctl sharing the source's extents with the destination (btrfs, XFS, ...)
+_FICLONE = 0x40049409
+
+
+def _copy_file(source: Path, destination: Path):
+    """Reflinks where the filesystem can, else copies in the kernel, else in Python"""
+    with source.open("rb") as fin, destination.open("wb") as fout:
+        try:
+            fcntl.ioctl(fout.fileno(), _FICLONE, fin.fileno())
+            return
+        except OSError:
+            pass
+        try:
+            while os.copy_file_range(fin.fileno(), fout.fileno(), 1 << 30):
+                pass
+            return
+        except (AttributeError, OSError):  # Older Python or kernel, or across devices
+            fin.seek(0)
+            fout.seek(0)
+            fout.truncate()
+        shutil.copyfileobj(fin, fout, 1 << 20)
+
+
+def _deliver_file(source: Path, destination: Path, source_is_disposable: bool):
+    """
+    Puts a copy of `source` at `destination`. When the source is about to be deleted,
+    a hard link (on the same filesystem) does that without writing any data.
+    """
+    if source_is_disposable:
+        staging = destination.with_name(f".{destination.name}.{os.getpid()}.tmp")
+        try:
+            os.link(source, staging)
+            os.replace(staging, destination)
+            return
+        except OSError:
+            with contextlib.suppress(FileNotFoundError):
+                staging.unlink()
+    _copy_file(source, destination)
+
+
 # TODO: unused
 def md5(filename):
     """Given a file, returns a string that is the md5 sum of the file"""
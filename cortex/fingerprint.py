@@ -0,0 +1,63 @@
+import hashlib
+import json
+from pathlib import Path
+from typing import Dict, Tuple
+
+from cortex.file_manip import PathLike
+
+_CHUNK_SIZE = 1 << 20
+_SAMPLED_BLOCKS = 16
+_SAMPLED_BLOCK_SIZE = 1 << 16
+
+# (path, size, mtime_ns) -> digest, so repeated runs in one process do not rehash
+_file_digests: Dict[Tuple[str, int, int], str] = dict()
+
+
+def file_digest(file_path: PathLike) -> str:
+    """sha256 of a file's contents"""
+    file_path = Path(file_path).resolve()
+    stat = file_path.stat()
+    memo_key = (str(file_path), stat.st_size, stat.st_mtime_ns)
+    if memo_key in _file_digests:
+        return _file_digests[memo_key]
+
+    sha256 = hashlib.sha256()
+    with file_path.open("rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+            sha256.update(chunk)
+    digest = sha256.hexdigest()
+    _file_digests[memo_key] = digest
+    return digest
+
+
+def params_digest(**params) -> str:
+    """Order-independent sha256 of keyword parameters; values must be json-able"""
+    serialised = json.dumps(params, sort_keys=True, default=str)
+    return hashlib.sha256(serialised.encode()).hexdigest()
+
+
+def fast_file_fingerprint(file_path: PathLike) -> str:
+    """Cheap stand-in for a file's digest: its resolved path, size and mtime"""
+    file_path = Path(file_path).resolve()
+    stat = file_path.stat()
+    return f"{file_path}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def sampled_file_fingerprint(file_path: PathLike) -> str:
+    """
+    Cheaper than `file_digest` on large files: sha256 of the file's size, mtime and
+    blocks spread evenly over it. Unlike `fast_file_fingerprint`, it does not depend
+    on the file's path.
+    """
+    file_path = Path(file_path)
+    stat = file_path.stat()
+    sha256 = hashlib.sha256(f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+    with file_path.open("rb") as f:
+        if stat.st_size <= _SAMPLED_BLOCKS * _SAMPLED_BLOCK_SIZE:
+            sha256.update(f.read())
+        else:
+            last_offset = stat.st_size - _SAMPLED_BLOCK_SIZE
+            for block in range(_SAMPLED_BLOCKS):
+                f.seek(block * last_offset // (_SAMPLED_BLOCKS - 1))
+                sha256.update(f.read(_SAMPLED_BLOCK_SIZE))
+    return sha256.hexdigest()
@@ -0,0 +1,172 @@
+"""
+Node-wide admission of cortex runs: processes that share a governor directory queue
+for memory (and job slots) in a ledger there, so that together they do not exhaust
+the node. Reservations of dead processes get reclaimed.
+"""
+
+import asyncio
+import contextlib
+import fcntl
+import json
+import os
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+from cortex.file_manip import PathLike
+from cortex.scratch import _process_alive
+
+_LEDGER_FILE = "ledger.json"
+_LOCK_FILE = "ledger.lock"
+
+
+class GovernorTimeout(TimeoutError):
+    pass
+
+
+def _process_start_time(pid: int) -> Optional[int]:
+    """In clock ticks since boot, telling a process from a later one reusing its pid"""
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # Fields after the command, which is in parentheses and may hold spaces
+    return int(stat.rsplit(b")", 1)[1].split()[19])
+
+
+def _owner_alive(entry: Dict) -> bool:
+    if not _process_alive(entry["pid"]):
+        return False
+    start_time = entry.get("start_time")
+    return start_time is None or _process_start_time(entry["pid"]) == start_time
+
+
+def _physical_memory() -> int:
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+
+
+class NodeGovernor:
+    """
+    Admits reservations first come, first served, while the memory reserved by
+    admitted ones fits in `max_memory` bytes (default: the node's physical memory),
+    and at most `max_jobs` are admitted. `directory` must be local to the node, and
+    shared by all processes to govern.
+    A reservation not admitted within `timeout` seconds raises GovernorTimeout.
+    """
+
+    def __init__(
+        self,
+        directory: PathLike,
+        max_memory: Optional[int] = None,
+        max_jobs: Optional[int] = None,
+        timeout: Optional[float] = None,
+        poll_seconds: float = 0.5,
+    ):
+        self.directory = Path(directory)
+        self.max_memory = _physical_memory() if max_memory is None else max_memory
+        self.max_jobs = max_jobs
+        self.timeout = timeout
+        self.poll_seconds = poll_seconds
+
+    @contextlib.contextmanager
+    def _ledger(self) -> Iterator[List[Dict]]:
+        """The queue of reservations, locked; changes to it get saved"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with (self.directory / _LOCK_FILE).open("a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                ledger_path = self.directory / _LEDGER_FILE
+                try:
+                    with ledger_path.open() as f:
+                        entries = json.load(f)
+                except (FileNotFoundError, ValueError):
+                    entries = list()
+                entries[:] = [entry for entry in entries if _owner_alive(entry)]
+                yield entries
+                tmp_path = ledger_path.with_name(f".{_LEDGER_FILE}.{os.getpid()}.tmp")
+                with tmp_path.open("w") as f:
+                    json.dump(entries, f)
+                os.replace(tmp_path, ledger_path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _enqueue(self, memory_bytes: int) -> str:
+        if memory_bytes > self.max_memory:
+            raise ValueError(
+                f"Reserving {memory_bytes} bytes, over the node's max_memory "
+                f"{self.max_memory} bytes"
+            )
+        ticket = uuid.uuid4().hex
+        with self._ledger() as entries:
+            entries.append(
+                {
+                    "ticket": ticket,
+                    "pid": os.getpid(),
+                    "start_time": _process_start_time(os.getpid()),
+                    "memory": memory_bytes,
+                    "admitted": False,
+                    "enqueued": time.time(),
+                }
+            )
+        return ticket
+
+    def _try_admit(self, ticket: str) -> bool:
+        with self._ledger() as entries:
+            admitted = [entry for entry in entries if entry["admitted"]]
+            waiting = [entry for entry in entries if not entry["admitted"]]
+            # First come, first served: only the head of the queue may go
+            if not waiting or waiting[0]["ticket"] != ticket:
+                return False
+            entry = waiting[0]
+            if self.max_jobs is not None and len(admitted) >= self.max_jobs:
+                return False
+            reserved = sum(other["memory"] for other in admitted)
+            if reserved + entry["memory"] > self.max_memory:
+                return False
+            entry["admitted"] = True
+            return True
+
+    def _release(self, ticket: str):
+        with self._ledger() as entries:
+            entries[:] = [entry for entry in entries if entry["ticket"] != ticket]
+
+    def _timed_out(self, deadline: Optional[float], memory_bytes: int) -> bool:
+        if deadline is None or time.monotonic() < deadline:
+            return False
+        raise GovernorTimeout(
+            f"Could not reserve {memory_bytes} bytes within {self.timeout} seconds"
+        )
+
+    @contextlib.contextmanager
+    def reserve(self, memory_bytes: int):
+        """Waits its turn, and for `memory_bytes` to fit, then holds them"""
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        ticket = self._enqueue(memory_bytes)
+        try:
+            while not self._try_admit(ticket):
+                self._timed_out(deadline, memory_bytes)
+                time.sleep(self.poll_seconds)
+            yield
+        finally:
+            self._release(ticket)
+
+    @contextlib.asynccontextmanager
+    async def reserve_async(self, memory_bytes: int):
+        """`reserve` for asyncio: waits without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        ticket = await loop.run_in_executor(None, self._enqueue, memory_bytes)
+        try:
+            while not await loop.run_in_executor(None, self._try_admit, ticket):
+                self._timed_out(deadline, memory_bytes)
+                await asyncio.sleep(self.poll_seconds)
+            yield
+        finally:
+            await loop.run_in_executor(None, self._release, ticket)
+
+    def reservations(self) -> List[Dict]:
+        """The live reservations, in queue order"""
+        with self._ledger() as entries:
+            return list(entries)
@@ -0,0 +1,254 @@
+import fcntl
+import hashlib
+import json
+import math
+import os
+import re
+import tempfile
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from cortex import fingerprint
+from cortex.file_manip import PathLike
+from cortex.reads import is_gzipped, iter_sequences
+
+# Bytes per cortex hash table entry. run_calls.pl builds two-colour graphs
+# (reference + sample) with cortex_var_31_c2, whose elements hold one 64-bit binary
+# kmer, per colour one byte of edges and a 32-bit coverage, and a status byte:
+# 19 bytes, aligned to 24.
+HASH_ENTRY_BYTES = 24
+
+# cortex fails as soon as any one bucket fills up, so leave plenty of room
+TARGET_LOAD_FACTOR = 0.7
+
+_COMPLEMENT = bytes.maketrans(b"ACGT", b"TGCA")
+_NON_ACGT = re.compile(rb"[^ACGT]+")
+
+# Inputs of more bases than this get their kmers sampled, hashing about this many
+MAX_HASHED_KMERS = 4_000_000
+# Sampled kmers start with a prefix of it (or end with its reverse complement). Free
+# of CG, which is rare in many genomes.
+_ANCHOR = b"ACAGTCATGAGTCA"
+# Gzipped fasta/q holds about this many bases per byte
+_GZIP_BASES_PER_BYTE = 4
+
+
+def hash_table_bytes(mem_height: int, mem_width: int) -> int:
+    """Memory cortex allocates for its hash table"""
+    return (2**mem_height) * mem_width * HASH_ENTRY_BYTES
+
+
+class _HyperLogLog:
+    """Estimates the number of distinct 64-bit hashes added to it"""
+
+    def __init__(self, precision: int = 14):
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, hash_value: int):
+        remaining_bits = 64 - self.precision
+        index = hash_value >> remaining_bits
+        rank = remaining_bits - (hash_value & ((1 << remaining_bits) - 1)).bit_length()
+        if rank + 1 > self.registers[index]:
+            self.registers[index] = rank + 1
+
+    def cardinality(self) -> float:
+        num_registers = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / num_registers)
+        estimate = (
+            alpha
+            * num_registers**2
+            / sum(2.0**-register for register in self.registers)
+        )
+        num_zeros = self.registers.count(0)
+        if estimate <= 2.5 * num_registers and num_zeros > 0:
+            # Small range correction: linear counting
+            estimate = num_registers * math.log(num_registers / num_zeros)
+        return estimate
+
+
+def _canonical_kmers(
+    sequence: bytes, kmer_size: int, stride: int = 1
+) -> Iterable[bytes]:
+    """Every `stride`th kmer of each stretch of ACGTs"""
+    for stretch in _NON_ACGT.split(sequence):
+        stretch_len = len(stretch)
+        if stretch_len < kmer_size:
+            continue
+        reverse_complement = stretch.translate(_COMPLEMENT)[::-1]
+        for start in range(0, stretch_len - kmer_size + 1, stride):
+            forward = stretch[start : start + kmer_size]
+            rc_end = stretch_len - start
+            reverse = reverse_complement[rc_end - kmer_size : rc_end]
+            yield forward if forward < reverse else reverse
+
+
+def _kmer_hash(kmer: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(kmer, digest_size=8).digest(), "little")
+
+
+def _anchor_length(fastx_files: List[PathLike], max_hashed_kmers: int) -> int:
+    """
+    Length of the anchor sampling about `max_hashed_kmers` of the files' kmers, from
+    the files' sizes; 0 to take every kmer
+    """
+    approx_bases = 0
+    for fastx_file in fastx_files:
+        size = os.stat(fastx_file).st_size
+        approx_bases += size * _GZIP_BASES_PER_BYTE if is_gzipped(fastx_file) else size
+    if approx_bases <= max_hashed_kmers:
+        return 0
+    # An anchor of length m starts 2 / 4^m of kmers (either strand)
+    return min(
+        len(_ANCHOR), math.ceil(math.log(2 * approx_bases / max_hashed_kmers, 4))
+    )
+
+
+def _anchored_kmers(
+    sequence: bytes, kmer_size: int, anchor: bytes
+) -> Tuple[int, List[bytes]]:
+    """
+    The number of kmer positions in the sequence, and the canonical kmers of those
+    starting with `anchor` or ending with its reverse complement (so that a kmer and
+    its reverse complement get sampled alike)
+    """
+    forward_anchor = re.compile(b"(?=%s)" % anchor)
+    reverse_anchor = re.compile(b"(?=%s)" % anchor.translate(_COMPLEMENT)[::-1])
+    num_positions = 0
+    kmers = list()
+    for stretch in _NON_ACGT.split(sequence):
+        last_start = len(stretch) - kmer_size
+        if last_start < 0:
+            continue
+        num_positions += last_start + 1
+        starts = {
+            match.start()
+            for match in forward_anchor.finditer(stretch)
+            if match.start() <= last_start
+        }
+        starts.update(
+            match.start() + len(anchor) - kmer_size
+            for match in reverse_anchor.finditer(stretch)
+            if match.start() + len(anchor) >= kmer_size
+        )
+        if not starts:
+            continue
+        reverse_complement = stretch.translate(_COMPLEMENT)[::-1]
+        for start in starts:
+            forward = stretch[start : start + kmer_size]
+            rc_end = len(stretch) - start
+            reverse = reverse_complement[rc_end - kmer_size : rc_end]
+            kmers.append(forward if forward < reverse else reverse)
+    return num_positions, kmers
+
+
+def estimate_distinct_kmers(
+    fastx_files: Iterable[PathLike],
+    kmer_size: int,
+    max_hashed_kmers: int = MAX_HASHED_KMERS,
+) -> float:
+    """
+    Streams fasta/q[.gz] files once, estimating how many distinct canonical kmers
+    (kmer and reverse complement counted once, as in cortex) they contain.
+
+    Hashing every kmer in Python takes microseconds each, so inputs larger than
+    `max_hashed_kmers` bases get sampled: only kmers starting with a short anchor
+    sequence (chosen by content, so that all copies of a kmer get sampled alike) are
+    counted, and their count is scaled up by the fraction of kmer positions sampled.
+    This adds a few percent of error on top of HyperLogLog's ~1%, more if the
+    inputs' composition is skewed; mem_height, a power of 2, rarely changes with it.
+    """
+    fastx_files = list(fastx_files)
+    anchor = _ANCHOR[: _anchor_length(fastx_files, max_hashed_kmers)]
+    hll = _HyperLogLog()
+    num_positions = num_sampled = 0
+    for fastx_file in fastx_files:
+        for sequence in iter_sequences(fastx_file):
+            if not anchor:
+                for kmer in _canonical_kmers(sequence, kmer_size):
+                    hll.add(_kmer_hash(kmer))
+                continue
+            sequence_positions, kmers = _anchored_kmers(sequence, kmer_size, anchor)
+            num_positions += sequence_positions
+            num_sampled += len(kmers)
+            for kmer in kmers:
+                hll.add(_kmer_hash(kmer))
+    if not anchor:
+        return hll.cardinality()
+    if not num_sampled:
+        return 0.0
+    return hll.cardinality() * num_positions / num_sampled
+
+
+def mem_height_for(
+    num_kmers: float, mem_width: int, load_factor: float = TARGET_LOAD_FACTOR
+) -> int:
+    """Smallest mem_height keeping a hash table of `num_kmers` below `load_factor`"""
+    required_buckets = num_kmers / (mem_width * load_factor)
+    return max(1, math.ceil(math.log2(max(required_buckets, 1))))
+
+
+def auto_mem_height(
+    fastx_files: Iterable[PathLike], kmer_size: int, mem_width: int
+) -> int:
+    fastx_files = list(fastx_files)
+    num_kmers = estimate_distinct_kmers(fastx_files, kmer_size)
+    mem_height = mem_height_for(num_kmers, mem_width)
+    print(
+        f"Estimated {num_kmers:.0f} distinct {kmer_size}-mers "
+        f"in {', '.join(map(str, fastx_files))}; "
+        f"using mem_height {mem_height} (mem_width {mem_width}, "
+        f"target load factor {TARGET_LOAD_FACTOR})"
+    )
+    return mem_height
+
+
+class MemHeightHistory:
+    """
+    The mem_heights that worked, per reference (by contents) and size class of the
+    reads (total bytes, within a factor of 2), kept in a JSON file; so that runs on
+    alike inputs can start at a height that works.
+    """
+
+    def __init__(self, path: PathLike):
+        self.path = Path(path)
+
+    @staticmethod
+    def _key(reference_fasta: PathLike, reads_files: List[PathLike]) -> str:
+        reads_bytes = sum(Path(reads_file).stat().st_size for reads_file in reads_files)
+        return f"{fingerprint.file_digest(reference_fasta)}:{reads_bytes.bit_length()}"
+
+    def _load(self) -> Dict[str, int]:
+        try:
+            with self.path.open() as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return dict()
+
+    def get(
+        self, reference_fasta: PathLike, reads_files: List[PathLike]
+    ) -> Optional[int]:
+        return self._load().get(self._key(reference_fasta, reads_files))
+
+    def record(
+        self, reference_fasta: PathLike, reads_files: List[PathLike], mem_height: int
+    ):
+        key = self._key(reference_fasta, reads_files)
+        # Locked, so that concurrent runs' records don't overwrite each other
+        with self.path.with_name(f".{self.path.name}.lock").open("a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                history = self._load()
+                history[key] = mem_height
+                fd, tmp_path = tempfile.mkstemp(
+                    prefix=f".{self.path.name}.", suffix=".tmp", dir=self.path.parent
+                )
+                try:
+                    with os.fdopen(fd, "w") as f:
+                        json.dump(history, f, indent=1)
+                    os.replace(tmp_path, self.path)
+                except BaseException:
+                    os.unlink(tmp_path)
+                    raise
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
@@ -0,0 +1,86 @@
+"""
+Calling at several kmer sizes: checking the sizes, and merging the calls made at each
+into one call set.
+"""
+
+from pathlib import Path
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+from cortex.file_manip import _make_empty_vcf
+from cortex.sharding import _read_header
+
+# Small kmers resolve low-coverage regions, large ones repeats
+DEFAULT_KMER_SIZES = (31, 61)
+# The largest kmer size of the cortex_var builds installed with this package
+MAX_KMER_SIZE = 63
+
+
+def check_kmer_sizes(kmer_sizes: Iterable[int]) -> List[int]:
+    """The kmer sizes without repeats, in order; raises ValueError on invalid ones"""
+    kmer_sizes = list(dict.fromkeys(kmer_sizes))
+    if not kmer_sizes:
+        raise ValueError("At least one kmer size is needed")
+    for kmer_size in kmer_sizes:
+        if (
+            type(kmer_size) is not int
+            or kmer_size % 2 == 0
+            or not 3 <= kmer_size <= MAX_KMER_SIZE
+        ):
+            raise ValueError(
+                f"Kmer sizes must be odd ints from 3 to {MAX_KMER_SIZE}, "
+                f"not {kmer_size!r}"
+            )
+    return kmer_sizes
+
+
+def merge_kmer_vcfs(
+    kmer_vcfs: Sequence[Tuple[int, Path]],
+    output_vcf: Path,
+    sample_name: str,
+    seq_ids: Sequence[str],
+):
+    """
+    Merges the VCFs of calls at each kmer size into one VCF sorted in `seq_ids` order.
+    A call (same position, ref and alt) made at several kmer sizes is kept once, as
+    made at the first of them in `kmer_vcfs`. Call ids get prefixed with their kmer
+    size (k31_var_1), keeping them unique.
+    """
+    if not kmer_vcfs:
+        _make_empty_vcf(output_vcf, sample_name)
+        return
+
+    meta_lines: Dict[bytes, None] = dict()
+    columns_line = None
+    calls: Dict[Tuple[bytes, int, bytes, bytes], bytes] = dict()
+    for kmer_size, vcf_path in kmer_vcfs:
+        for line in _read_header(vcf_path):
+            if line.startswith(b"##"):
+                meta_lines.setdefault(line)
+            elif columns_line is None:
+                columns_line = line
+        id_prefix = b"k%d_" % kmer_size
+        with vcf_path.open("rb") as f:
+            for line in f:
+                if line.startswith(b"#") or not line.strip():
+                    continue
+                chrom, pos, call_id, ref, alt, rest = line.split(b"\t", 5)
+                key = (chrom, int(pos), ref, alt)
+                if key in calls:
+                    continue
+                if call_id != b".":
+                    call_id = id_prefix + call_id
+                calls[key] = b"\t".join((chrom, pos, call_id, ref, alt, rest))
+
+    seq_order = {seq_id.encode(): index for index, seq_id in enumerate(seq_ids)}
+
+    def sort_key(key: Tuple[bytes, int, bytes, bytes]):
+        chrom, pos = key[:2]
+        return seq_order.get(chrom, len(seq_order)), chrom, pos
+
+    with output_vcf.open("wb") as f_out:
+        f_out.writelines(meta_lines)
+        if columns_line is not None:
+            f_out.write(columns_line)
+        for key in sorted(calls, key=sort_key):
+            line = calls[key]
+            f_out.write(line if line.endswith(b"\n") else line + b"\n")
@@ -0,0 +1,128 @@
+"""
+Streaming read preprocessing before cortex: subsampling to a target coverage,
+trimming low-quality read ends, and dropping reads too short to hold a kmer.
+"""
+
+import gzip
+import random
+import re
+from pathlib import Path
+from typing import List, NamedTuple, Optional
+
+from cortex.reads import FastxRecord, iter_records, open_fastx
+
+_PHRED_OFFSET = 33
+_GZIP_LEVEL = 1
+
+
+class ReadsPreprocessing(NamedTuple):
+    # Fold coverage of the reference to subsample reads to; None keeps all reads
+    target_coverage: Optional[float] = None
+    # Seeds the subsampling
+    seed: int = 0
+
+
+class PreprocessingStats(NamedTuple):
+    reads_in: int
+    bases_in: int
+    reads_out: int
+    bases_out: int
+
+    @property
+    def bases_removed(self) -> int:
+        return self.bases_in - self.bases_out
+
+
+class _QualityTrimmer:
+    """
+    Trims read ends of bases with quality at most `qthresh`, which cortex would
+    not use anyway (its --qthresh).
+    """
+
+    def __init__(self, qthresh: int):
+        low = re.escape(bytes(range(_PHRED_OFFSET, _PHRED_OFFSET + qthresh + 1)))
+        self.low_start = re.compile(b"^[" + low + b"]+")
+        self.low_end = re.compile(b"[" + low + b"]+$")
+
+    def trim(self, record: FastxRecord) -> FastxRecord:
+        qualities = record.qualities
+        if qualities is None:
+            return record
+        start, end = 0, len(qualities)
+        match = self.low_start.match(qualities)
+        if match is not None:
+            start = match.end()
+        match = self.low_end.search(qualities, start)
+        if match is not None:
+            end = match.start()
+        if start == 0 and end == len(qualities):
+            return record
+        return FastxRecord(
+            record.name, record.sequence[start:end], qualities[start:end]
+        )
+
+
+def output_paths(reads_files: List[Path], directory: Path) -> List[Path]:
+    """Where `preprocess_reads` writes each reads file, keeping its format"""
+    paths = list()
+    for index, reads_file in enumerate(reads_files):
+        with open_fastx(reads_file) as f:
+            suffix = "fq" if f.read(1) == b"@" else "fa"
+        paths.append(directory / f"reads_{index}.{suffix}.gz")
+    return paths
+
+
+def _count_bases(reads_files: List[Path]) -> int:
+    return sum(
+        len(record.sequence)
+        for reads_file in reads_files
+        for record in iter_records(reads_file)
+    )
+
+
+def preprocess_reads(
+    reads_files: List[Path],
+    output_files: List[Path],
+    preprocessing: ReadsPreprocessing,
+    kmer_size: int,
+    qthresh: int,
+    genome_size: int,
+) -> PreprocessingStats:
+    """
+    Streams each reads file to its (gzipped) output file, keeping reads with
+    probability that brings total bases to `target_coverage` x `genome_size`, then
+    trimming their low-quality ends and dropping them if shorter than `kmer_size`.
+    A target coverage takes an extra pass over the reads, to count their bases.
+    """
+    keep_fraction = 1.0
+    if preprocessing.target_coverage is not None:
+        total_bases = _count_bases(reads_files)
+        if total_bases > 0:
+            keep_fraction = min(
+                1.0, preprocessing.target_coverage * genome_size / total_bases
+            )
+    rng = random.Random(preprocessing.seed)
+    trimmer = _QualityTrimmer(qthresh)
+
+    reads_in = bases_in = reads_out = bases_out = 0
+    for reads_file, output_file in zip(reads_files, output_files):
+        output_file.parent.mkdir(parents=True, exist_ok=True)
+        with gzip.open(str(output_file), "wb", compresslevel=_GZIP_LEVEL) as f_out:
+            for record in iter_records(reads_file):
+                reads_in += 1
+                bases_in += len(record.sequence)
+                if keep_fraction < 1.0 and rng.random() >= keep_fraction:
+                    continue
+                record = trimmer.trim(record)
+                if len(record.sequence) < kmer_size:
+                    continue
+                reads_out += 1
+                bases_out += len(record.sequence)
+                f_out.write(record.to_bytes())
+
+    stats = PreprocessingStats(reads_in, bases_in, reads_out, bases_out)
+    print(
+        f"Preprocessed reads: kept {reads_out} of {reads_in} reads, "
+        f"{bases_out} of {bases_in} bases ({stats.bases_removed} bases removed)"
+    )
+    return stats
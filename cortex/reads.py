@@ -0,0 +1,116 @@
+import gzip
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Iterator, List, NamedTuple, Optional
+
+from cortex.file_manip import PathLike
+
+_GZIP_MAGIC = b"\x1f\x8b"
+
+
+def is_gzipped(file_path: PathLike) -> bool:
+    with open(str(file_path), "rb") as f:
+        return f.read(2) == _GZIP_MAGIC
+
+
+def open_fastx(file_path: PathLike) -> BinaryIO:
+    """Opens a fasta/q file for reading bytes, decompressing it if gzipped"""
+    if is_gzipped(file_path):
+        return gzip.open(str(file_path), "rb")
+    return open(str(file_path), "rb")
+
+
+class FastxRecord(NamedTuple):
+    # Header line, without its leading > or @
+    name: bytes
+    sequence: bytes
+    # None for fasta records
+    qualities: Optional[bytes] = None
+
+    def to_bytes(self) -> bytes:
+        if self.qualities is None:
+            return b">%s\n%s\n" % (self.name, self.sequence)
+        return b"@%s\n%s\n+\n%s\n" % (self.name, self.sequence, self.qualities)
+
+
+def iter_records(file_path: PathLike) -> Iterator[FastxRecord]:
+    """
+    Yields each record of a fasta or fastq[.gz] file.
+    Fastq records must not wrap over several lines.
+    """
+    with open_fastx(file_path) as f:
+        first_line = f.readline()
+        if first_line.startswith(b"@"):
+            header = first_line
+            while header:
+                sequence, _, qualities = f.readline(), f.readline(), f.readline()
+                yield FastxRecord(
+                    header[1:].rstrip(), sequence.rstrip(), qualities.rstrip()
+                )
+                header = f.readline()
+            return
+
+        if not first_line.startswith(b">"):
+            if first_line.strip():
+                raise ValueError(f"{file_path} is neither fasta nor fastq")
+            return
+
+        name = first_line[1:].rstrip()
+        sequence_lines = []
+        for line in f:
+            if line.startswith(b">"):
+                yield FastxRecord(name, b"".join(sequence_lines))
+                name = line[1:].rstrip()
+                sequence_lines = []
+            else:
+                sequence_lines.append(line.rstrip())
+        yield FastxRecord(name, b"".join(sequence_lines))
+
+
+def iter_sequences(file_path: PathLike) -> Iterator[bytes]:
+    """Yields each record's sequence, upper-cased, from a fasta or fastq[.gz] file"""
+    for record in iter_records(file_path):
+        yield record.sequence.upper()
+
+
+class ReadsProfile(NamedTuple):
+    reads: int
+    bases: int
+    max_read_len: int
+
+    @property
+    def mean_read_len(self) -> float:
+        return self.bases / self.reads if self.reads else 0.0
+
+
+def profile_reads(file_path: PathLike) -> ReadsProfile:
+    """
+    Counts reads and bases of a fasta or fastq[.gz] file, and its longest read.
+    Raises ValueError if the file is a truncated or corrupt gzip file.
+    """
+    reads = bases = max_read_len = 0
+    try:
+        for record in iter_records(file_path):
+            read_len = len(record.sequence)
+            reads += 1
+            bases += read_len
+            if read_len > max_read_len:
+                max_read_len = read_len
+    except (EOFError, gzip.BadGzipFile, zlib.error) as error:
+        raise ValueError(f"{file_path} is not an intact gzip file: {error}") from None
+    return ReadsProfile(reads, bases, max_read_len)
+
+
+def profile_reads_files(
+    reads_files: List[PathLike], max_workers: Optional[int] = None
+) -> ReadsProfile:
+    """`profile_reads` of all files together, profiling them in parallel threads"""
+    if not reads_files:
+        return ReadsProfile(0, 0, 0)
+    with ThreadPoolExecutor(max_workers or len(reads_files)) as pool:
+        profiles = list(pool.map(profile_reads, reads_files))
+    return ReadsProfile(
+        sum(profile.reads for profile in profiles),
+        sum(profile.bases for profile in profiles),
+        max(profile.max_read_len for profile in profiles),
+    )
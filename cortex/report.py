@@ -0,0 +1,164 @@
+import contextlib
+import json
+import resource
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
+
+from cortex.utils import disk_usage
+
+_DISK_SAMPLING_SECONDS = 5.0
+
+
+class StageReport(NamedTuple):
+    name: str
+    wall_seconds: float
+    # User + system time of this process and its children. Under run_async, that
+    # includes whatever else the process was doing meanwhile.
+    cpu_seconds: float
+    # Peak resident memory of a child process during this stage; None when no child
+    # during this stage exceeded an earlier stage's peak (so it is at most that).
+    peak_child_rss_bytes: Optional[int]
+
+
+def _cpu_seconds() -> float:
+    total = 0.0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        usage = resource.getrusage(who)
+        total += usage.ru_utime + usage.ru_stime
+    return total
+
+
+def _peak_child_rss_bytes() -> int:
+    # Linux reports ru_maxrss in kilobytes
+    return resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+
+
+class RunReport:
+    """
+    What a `cortex.calls.run` did: wall and CPU time and peak child memory per stage,
+    input sizes, the peak disk usage of its tmp directory and resolved parameters.
+    """
+
+    def __init__(self):
+        self.stages: List[StageReport] = list()
+        self.input_sizes: Dict[str, int] = dict()
+        self.parameters: Dict = dict()
+        self.peak_tmp_directory_bytes = 0
+        # A cortex.preprocess.PreprocessingStats, when reads got preprocessed
+        self.reads_preprocessing: Optional[NamedTuple] = None
+        # A cortex.reads.ReadsProfile of the input reads
+        self.reads_profile: Optional[NamedTuple] = None
+        self._tmp_directory: Optional[Path] = None
+        self._sampling_stopped = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+
+    def add_inputs(self, *file_paths: Path):
+        for file_path in file_paths:
+            self.input_sizes[str(file_path)] = file_path.stat().st_size
+
+    def watch_tmp_directory(self, tmp_directory: Path):
+        """Samples the directory's disk usage in the background until `stop`"""
+        self._tmp_directory = tmp_directory
+        self._sampler = threading.Thread(target=self._sample_disk_usage, daemon=True)
+        self._sampler.start()
+
+    def _record_disk_usage(self):
+        if self._tmp_directory is not None and self._tmp_directory.exists():
+            self.peak_tmp_directory_bytes = max(
+                self.peak_tmp_directory_bytes, disk_usage(self._tmp_directory)
+            )
+
+    def _sample_disk_usage(self):
+        while not self._sampling_stopped.wait(_DISK_SAMPLING_SECONDS):
+            self._record_disk_usage()
+
+    def stop(self):
+        self._sampling_stopped.set()
+        if self._sampler is not None:
+            self._sampler.join()
+            self._sampler = None
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        start_wall, start_cpu = time.monotonic(), _cpu_seconds()
+        start_peak_rss = _peak_child_rss_bytes()
+        try:
+            yield
+        finally:
+            peak_rss = _peak_child_rss_bytes()
+            self.stages.append(
+                StageReport(
+                    name,
+                    time.monotonic() - start_wall,
+                    _cpu_seconds() - start_cpu,
+                    peak_rss if peak_rss > start_peak_rss else None,
+                )
+            )
+            self._record_disk_usage()
+
+    def to_dict(self) -> Dict:
+        return {
+            "stages": [stage._asdict() for stage in self.stages],
+            "input_sizes": self.input_sizes,
+            "peak_tmp_directory_bytes": self.peak_tmp_directory_bytes,
+            "parameters": self.parameters,
+            "reads_preprocessing": (
+                None
+                if self.reads_preprocessing is None
+                else self.reads_preprocessing._asdict()
+            ),
+            "reads_profile": (
+                None if self.reads_profile is None else self.reads_profile._asdict()
+            ),
+        }
+
+    def to_json(self, **kwargs) -> str:
+        return json.dumps(self.to_dict(), default=str, **kwargs)
+
+    def to_prometheus(
+        self, labels: Optional[Dict[str, str]] = None, prefix: str = "py_cortex"
+    ) -> str:
+        """In the Prometheus text format, e.g. for node_exporter's textfile collector"""
+        labels = dict() if labels is None else labels
+
+        def sample(metric: str, value, **extra_labels) -> str:
+            all_labels = {**labels, **extra_labels}
+            label_text = ",".join(
+                '{}="{}"'.format(
+                    key, str(value).replace("\\", "\\\\").replace('"', '\\"')
+                )
+                for key, value in sorted(all_labels.items())
+            )
+            return f"{prefix}_{metric}{{{label_text}}} {value}"
+
+        lines = []
+        stage_metrics = [
+            ("stage_wall_seconds", "wall_seconds", "Wall time per stage"),
+            ("stage_cpu_seconds", "cpu_seconds", "CPU time per stage"),
+            (
+                "stage_peak_child_rss_bytes",
+                "peak_child_rss_bytes",
+                "Peak resident memory of a child process per stage",
+            ),
+        ]
+        for metric, field, description in stage_metrics:
+            lines.append(f"# HELP {prefix}_{metric} {description}")
+            lines.append(f"# TYPE {prefix}_{metric} gauge")
+            for stage in self.stages:
+                value = getattr(stage, field)
+                if value is not None:
+                    lines.append(sample(metric, value, stage=stage.name))
+
+        lines.append(f"# HELP {prefix}_input_bytes Size of input files")
+        lines.append(f"# TYPE {prefix}_input_bytes gauge")
+        for file_path, size in self.input_sizes.items():
+            lines.append(sample("input_bytes", size, file=file_path))
+
+        lines.append(
+            f"# HELP {prefix}_peak_tmp_directory_bytes Peak disk usage of tmp directory"
+        )
+        lines.append(f"# TYPE {prefix}_peak_tmp_directory_bytes gauge")
+        lines.append(sample("peak_tmp_directory_bytes", self.peak_tmp_directory_bytes))
+        return "\n".join(lines) + "\n"
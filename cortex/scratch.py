@@ -0,0 +1,129 @@
+"""
+Placement of runs' tmp directories on fast scratch space, their removal in the
+background, and sweeping of those left behind by crashed runs.
+"""
+
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Iterable, List, NamedTuple, Optional, Sequence
+
+from cortex.file_manip import PathLike
+
+_PREFIX = "py-cortex-"
+_OWNER_FILE = ".py-cortex-owner"
+_DELETING_SUFFIX = ".deleting"
+
+
+class ScratchPolicy(NamedTuple):
+    # Tried in order: the first with enough free space holds the tmp directory
+    preferred_directories: Sequence[PathLike] = ("/dev/shm",)
+    # Free space required of a preferred directory; None estimates it from the
+    # size of cortex's hash table, whose graph cortex dumps to disk
+    min_free_bytes: Optional[int] = None
+    # Used when no preferred directory fits; None is the system tmp directory
+    fallback_directory: Optional[PathLike] = None
+    # Remove the tmp directory in a background thread, so that `run` returns
+    # as soon as the VCF is delivered
+    background_cleanup: bool = True
+
+
+def _free_bytes(directory: Path) -> int:
+    try:
+        return shutil.disk_usage(directory).free
+    except OSError:
+        return -1
+
+
+def make_scratch_directory(policy: ScratchPolicy, estimated_bytes: int) -> Path:
+    min_free_bytes = policy.min_free_bytes
+    if min_free_bytes is None:
+        min_free_bytes = estimated_bytes
+    directory = policy.fallback_directory
+    for preferred in map(Path, policy.preferred_directories):
+        if preferred.is_dir() and _free_bytes(preferred) >= min_free_bytes:
+            directory = preferred
+            break
+    scratch = Path(tempfile.mkdtemp(prefix=_PREFIX, dir=directory))
+    owner = {"host": socket.gethostname(), "pid": os.getpid(), "started": time.time()}
+    with (scratch / _OWNER_FILE).open("w") as f:
+        json.dump(owner, f)
+    return scratch
+
+
+def remove_in_background(directory: Path) -> threading.Thread:
+    """
+    Renames the directory out of the way, then removes it in a thread. The thread is
+    not a daemon, so the interpreter waits for it before exiting.
+    """
+    doomed = directory.with_name(
+        f".{directory.name}.{uuid.uuid4().hex}{_DELETING_SUFFIX}"
+    )
+    os.rename(directory, doomed)
+    thread = threading.Thread(
+        target=shutil.rmtree, args=(doomed,), kwargs={"ignore_errors": True}
+    )
+    thread.start()
+    return thread
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _is_orphan(scratch: Path, max_age_seconds: float) -> bool:
+    try:
+        with (scratch / _OWNER_FILE).open() as f:
+            owner = json.load(f)
+        if owner["host"] == socket.gethostname():
+            return not _process_alive(owner["pid"])
+        started = owner["started"]
+    except (OSError, ValueError, KeyError):
+        try:
+            started = scratch.stat().st_mtime
+        except FileNotFoundError:
+            return False
+    # Another host's process: only its age tells
+    return time.time() - started > max_age_seconds
+
+
+def sweep_orphans(
+    directories: Optional[Iterable[PathLike]] = None,
+    max_age_seconds: float = 7 * 24 * 3600,
+) -> List[Path]:
+    """
+    Removes tmp directories of runs that are gone, from `directories` (default: the
+    default ScratchPolicy's directories). A run is gone if its process (on this host)
+    is; runs of other hosts are gone after `max_age_seconds`.
+    Returns the removed directories.
+    """
+    if directories is None:
+        policy = ScratchPolicy()
+        directories = [*policy.preferred_directories, tempfile.gettempdir()]
+    removed = list()
+    for directory in map(Path, directories):
+        if not directory.is_dir():
+            continue
+        for scratch in directory.iterdir():
+            name = scratch.name
+            if not (
+                name.startswith(_PREFIX)
+                or (name.startswith("." + _PREFIX) and name.endswith(_DELETING_SUFFIX))
+            ):
+                continue
+            if scratch.is_dir() and _is_orphan(scratch, max_age_seconds):
+                shutil.rmtree(scratch, ignore_errors=True)
+                removed.append(scratch)
+    return removed
@@ -0,0 +1,309 @@
+"""
+A long-lived local daemon running `cortex.calls.run_async` jobs, submitted over a Unix
+domain socket, and a client for it.
+
+    python -m cortex.server --socket /tmp/cortex.sock --index_cache ~/.cortex_indexes
+
+The protocol is one JSON object per line, with one request per connection.
+A request is {"op": ..., ...}; the reply is one line, except for "watch", which streams
+a job's events until the job ends. Replies with an "error" key report a failed request.
+The client is `cortex.client.Client`, which does not import the server's dependencies.
+"""
+
+import argparse
+import asyncio
+import collections
+import itertools
+import json
+import os
+import sys
+from pathlib import Path
+from typing import Deque, Dict, List, Optional
+
+from cortex import calls, memory
+from cortex.cache import IndexCache
+from cortex.client import Client, JobFailed  # noqa: F401
+from cortex.file_manip import PathLike
+from cortex.governor import NodeGovernor
+
+_JOB_ARGUMENTS = {"reference_fasta", "reads_files", "output_vcf_file_path"}
+# run_async keyword arguments a job may set
+_JOB_OPTIONS = {
+    "sample_name",
+    "ploidy",
+    "tmp_directory",
+    "mem_height",
+    "cleanup",
+    "resume",
+    "max_mem_height",
+    "decompress_reads",
+}
+_FINAL_STATES = {"done", "failed", "cancelled"}
+_MAX_FINISHED_JOBS = 1000
+_MAX_REQUEST_BYTES = 1 << 20
+
+
+class _Job:
+    def __init__(self, job_id: str, params: Dict):
+        self.id = job_id
+        self.params = params
+        self.state = "queued"
+        self.stage: Optional[str] = None
+        self.error: Optional[str] = None
+        self.report: Optional[Dict] = None
+        self.events: List[Dict] = list()
+        self.watchers: List[asyncio.Queue] = list()
+        self.task: Optional[asyncio.Task] = None
+
+    def summary(self) -> Dict:
+        return {
+            "job_id": self.id,
+            "state": self.state,
+            "stage": self.stage,
+            "error": self.error,
+            "report": self.report,
+            "params": self.params,
+        }
+
+    def publish(self, **event):
+        event = {"job_id": self.id, "state": self.state, **event}
+        self.events.append(event)
+        for watcher in self.watchers:
+            watcher.put_nowait(event)
+
+    def set_state(self, state: str, **details):
+        self.state = state
+        self.publish(**details)
+
+
+def _check_params(params: Dict) -> Dict:
+    missing = _JOB_ARGUMENTS - set(params)
+    if missing:
+        raise ValueError(f"Missing job parameters: {sorted(missing)}")
+    unknown = set(params) - _JOB_ARGUMENTS - _JOB_OPTIONS
+    if unknown:
+        raise ValueError(f"Unknown job parameters: {sorted(unknown)}")
+    return params
+
+
+class Server:
+    """
+    Runs submitted jobs, at most `max_jobs` at once (default: CPU count) and only while
+    their estimated hash table memory fits in `max_memory` bytes. Reference indexes
+    are kept in `index_cache` between jobs. With `governor`, jobs also queue for
+    memory with the node's other cortex runs.
+    Only the last `max_finished_jobs` finished jobs are kept, with their events, for
+    "status" and "watch"; older ones, or ones sent "forget", are dropped.
+    """
+
+    def __init__(
+        self,
+        socket_path: PathLike,
+        index_cache: Optional[IndexCache] = None,
+        max_jobs: Optional[int] = None,
+        max_memory: Optional[int] = None,
+        governor: Optional[NodeGovernor] = None,
+        max_finished_jobs: int = _MAX_FINISHED_JOBS,
+    ):
+        self.socket_path = Path(socket_path)
+        self.index_cache = index_cache
+        self.governor = governor
+        self.max_memory = max_memory
+        self.admission = calls._Admission(max_jobs or os.cpu_count() or 1, max_memory)
+        self.max_finished_jobs = max_finished_jobs
+        self.jobs: Dict[str, _Job] = dict()
+        self._finished: Deque[str] = collections.deque()
+        self._job_ids = itertools.count(1)
+        self._stopped: Optional[asyncio.Event] = None
+
+    async def serve(self):
+        """Serves until a "shutdown" request, then cancels unfinished jobs"""
+        self._stopped = asyncio.Event()
+        if self.socket_path.is_socket():
+            self.socket_path.unlink()  # Left behind by a dead server
+        server = await asyncio.start_unix_server(
+            self._handle_connection, str(self.socket_path), limit=_MAX_REQUEST_BYTES
+        )
+        try:
+            async with server:
+                try:
+                    await self._stopped.wait()
+                finally:
+                    tasks = [job.task for job in self.jobs.values() if job.task]
+                    for task in tasks:
+                        task.cancel()
+                    await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            self.socket_path.unlink(missing_ok=True)
+
+    async def _run_job(self, job: _Job):
+        params = dict(job.params)
+        mem_height = params.pop("mem_height", 22)
+        try:
+            if mem_height == "auto":
+                mem_height = await calls._in_executor(
+                    memory.auto_mem_height,
+                    [params["reference_fasta"], *params["reads_files"]],
+                    calls._KMER_SIZE,
+                    calls._MEM_WIDTH,
+                )
+            job_memory = calls._reserved_memory(
+                mem_height, params.get("max_mem_height")
+            )
+            if self.max_memory is not None and job_memory > self.max_memory:
+                raise calls._over_budget_error(job_memory, self.max_memory)
+
+            def on_progress(stage: str, line: str):
+                job.stage = stage
+                job.publish(stage=stage, line=line)
+
+            async with self.admission.admit(job_memory):
+                job.set_state("running")
+                report = await calls.run_async(
+                    mem_height=mem_height,
+                    index_cache=self.index_cache,
+                    on_progress=on_progress,
+                    governor=self.governor,
+                    **params,
+                )
+            job.report = json.loads(report.to_json())
+            job.set_state("done")
+        except asyncio.CancelledError:
+            job.set_state("cancelled")
+            raise
+        except Exception as error:
+            job.error = repr(error)
+            job.set_state("failed", error=job.error)
+        finally:
+            self._retire(job)
+
+    def _retire(self, job: _Job):
+        """Keeps the finished job, dropping the oldest beyond `max_finished_jobs`"""
+        self._finished.append(job.id)
+        while len(self._finished) > self.max_finished_jobs:
+            self.jobs.pop(self._finished.popleft(), None)
+
+    def _submit(self, params: Dict) -> _Job:
+        job = _Job(str(next(self._job_ids)), _check_params(params))
+        self.jobs[job.id] = job
+        job.set_state("queued")
+        job.task = asyncio.ensure_future(self._run_job(job))
+        return job
+
+    def _job(self, request: Dict) -> _Job:
+        try:
+            return self.jobs[str(request["job_id"])]
+        except KeyError:
+            raise ValueError(f"No job {request.get('job_id')}") from None
+
+    async def _watch(self, job: _Job, writer: asyncio.StreamWriter):
+        watcher: asyncio.Queue = asyncio.Queue()
+        job.watchers.append(watcher)
+        try:
+            events = list(job.events)
+            while True:
+                for event in events:
+                    await _send(writer, event)
+                    if event["state"] in _FINAL_STATES:
+                        return
+                events = [await watcher.get()]
+        finally:
+            job.watchers.remove(watcher)
+
+    async def _handle_request(self, request: Dict, writer: asyncio.StreamWriter):
+        op = request.get("op")
+        if op == "submit":
+            job = self._submit(request.get("job", dict()))
+            await _send(writer, {"job_id": job.id})
+        elif op == "status":
+            await _send(writer, self._job(request).summary())
+        elif op == "jobs":
+            await _send(writer, {"jobs": [job.summary() for job in self.jobs.values()]})
+        elif op == "watch":
+            await self._watch(self._job(request), writer)
+        elif op == "cancel":
+            job = self._job(request)
+            if job.task is not None:
+                job.task.cancel()
+            await _send(writer, {"job_id": job.id})
+        elif op == "forget":
+            job = self._job(request)
+            if job.state not in _FINAL_STATES:
+                raise ValueError(f"Job {job.id} is {job.state}: cancel it first")
+            del self.jobs[job.id]
+            await _send(writer, {"job_id": job.id})
+        elif op == "shutdown":
+            await _send(writer, {})
+            self._stopped.set()
+        else:
+            raise ValueError(f"Unknown op: {op}")
+
+    async def _handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        """One request per connection, closed once replied to"""
+        try:
+            line = await reader.readline()
+            try:
+                await self._handle_request(json.loads(line), writer)
+            except (ValueError, TypeError) as error:
+                await _send(writer, {"error": str(error)})
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+async def _send(writer: asyncio.StreamWriter, message: Dict):
+    writer.write(json.dumps(message, default=str).encode() + b"\n")
+    await writer.drain()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--socket", type=Path, required=True)
+    parser.add_argument(
+        "--index_cache", type=Path, help="directory keeping reference indexes"
+    )
+    parser.add_argument(
+        "--index_cache_max_bytes", type=int, help="evict indexes beyond this size"
+    )
+    parser.add_argument(
+        "--max_jobs", type=int, help="jobs running at once (default: CPU count)"
+    )
+    parser.add_argument(
+        "--max_memory", type=int, help="bytes of hash tables of running jobs"
+    )
+    parser.add_argument(
+        "--max_finished_jobs",
+        type=int,
+        default=_MAX_FINISHED_JOBS,
+        help="finished jobs kept for status (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--governor",
+        type=Path,
+        help="node-local directory where concurrent runs queue for memory",
+    )
+    args = parser.parse_args(argv)
+
+    index_cache = None
+    if args.index_cache is not None:
+        index_cache = IndexCache(args.index_cache, args.index_cache_max_bytes)
+    governor = None
+    if args.governor is not None:
+        governor = NodeGovernor(args.governor)
+    server = Server(
+        args.socket,
+        index_cache,
+        args.max_jobs,
+        args.max_memory,
+        governor,
+        args.max_finished_jobs,
+    )
+    asyncio.run(server.serve())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,30 @@
 from pathlib import Path
+from typing import Dict
+
+from cortex import __version__
 
 base_directory = Path(__file__).resolve().parent
 CORTEX_ROOT = base_directory / "ext/cortex"
 MINIMAP2 = base_directory / "ext/minimap2"
 VCFTOOLS_DIRECTORY = base_directory / "ext/vcftools"
+
+# Bundled tools, whose builds the calls depend on
+_TOOL_PATHS = {
+    "cortex_var": CORTEX_ROOT / "bin" / "cortex_var_31_c1",
+    "run_calls": CORTEX_ROOT / "scripts" / "calling" / "run_calls.pl",
+    "minimap2": MINIMAP2,
+    "vcftools": VCFTOOLS_DIRECTORY,
+}
+
+
+def tool_versions() -> Dict[str, str]:
+    """This package's version, and stand-ins for the bundled tools': size and mtime"""
+    versions = {"py-cortex-api": __version__}
+    for tool, path in _TOOL_PATHS.items():
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            versions[tool] = "missing"
+            continue
+        versions[tool] = f"{stat.st_size}:{stat.st_mtime_ns}"
+    return versions
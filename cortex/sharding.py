@@ -0,0 +1,347 @@
+"""
+Splitting a reference into shards (contigs, or overlapping windows of them) that get
+called independently, routing reads to shards, and merging the shards' calls.
+"""
+
+import bisect
+import heapq
+import itertools
+import os
+import shutil
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from cortex.file_manip import _make_empty_vcf, _vcf_is_sorted
+from cortex.memory import _canonical_kmers
+from cortex.reads import iter_records
+from cortex.utils import FaiRecord
+
+DEFAULT_OVERLAP = 5000
+# Index every 16th reference kmer for read routing
+_ROUTING_STRIDE = 16
+# Kmers indexed for routing get sorted this many at a time
+_PIECE_KMERS = 1 << 20
+# Bases of a kmer 2-bit encoded in 64 bits
+_MAX_CODED_BASES = 32
+_BASE_DIGITS = bytes.maketrans(b"ACGT", b"0123")
+_FASTA_LINE_WIDTH = 60
+_READS_BUFFER_BYTES = 1 << 24
+
+
+class Shard(NamedTuple):
+    """
+    The reference window [start, end) (0-based) of sequence `seq_id`.
+    Calls at positions in [own_start, own_end) are this shard's to report: overlapping
+    windows split their overlap in the middle.
+    """
+
+    seq_id: str
+    start: int
+    end: int
+    own_start: int
+    own_end: int
+
+
+def make_shards(
+    fai_records: List[FaiRecord],
+    window_size: Optional[int] = None,
+    overlap: int = DEFAULT_OVERLAP,
+) -> List[Shard]:
+    """
+    One shard per sequence, or with `window_size`, windows overlapping by `overlap`
+    bases
+    """
+    if window_size is not None and not 0 <= overlap < window_size:
+        raise ValueError(
+            f"overlap ({overlap}) must be at least 0 and less than "
+            f"window_size ({window_size})"
+        )
+    shards = list()
+    for record in fai_records:
+        if window_size is None or record.length <= window_size:
+            shards.append(Shard(record.name, 0, record.length, 0, record.length))
+            continue
+        step = window_size - overlap
+        starts = list(range(0, record.length - overlap, step))
+        ends = [min(start + window_size, record.length) for start in starts]
+        # Middles of the overlaps
+        boundaries = (
+            [0]
+            + [(start + end) // 2 for start, end in zip(starts[1:], ends)]
+            + [record.length]
+        )
+        for i, (start, end) in enumerate(zip(starts, ends)):
+            shards.append(
+                Shard(record.name, start, end, boundaries[i], boundaries[i + 1])
+            )
+    return shards
+
+
+class _ReadRouter:
+    """
+    Finds the shards a read belongs to, by the shards' kmers it contains.
+
+    Only every `stride`th kmer of each shard is indexed, each 2-bit encoded (its first
+    32 bases for longer kmers) in a sorted array next to its shard's index: 12 bytes per
+    `stride` reference bases, e.g. 2.3GB for a 3Gb reference at the default stride
+    (up to 20 bytes while building). A read is scanned until its first indexed kmer.
+    Reads sharing no indexed kmer with any shard are not routed.
+    Call `build` once all shards are added, before routing.
+    """
+
+    def __init__(self, kmer_size: int, stride: int = _ROUTING_STRIDE):
+        self.kmer_size = kmer_size
+        self.stride = stride
+        # Sorted, distinct kmer codes of a piece of one shard, and that shard's index
+        self._pieces: List[Tuple[array, int]] = list()
+        # Indexed kmer codes, sorted, and the index of the shard containing each
+        self.codes = array("Q")
+        self.shard_indices = array("I")
+
+    @staticmethod
+    def _code(kmer: bytes) -> int:
+        return int(kmer[:_MAX_CODED_BASES].translate(_BASE_DIGITS), 4)
+
+    def add(self, shard_index: int, sequence: bytes):
+        kmers = _canonical_kmers(sequence, self.kmer_size, self.stride)
+        while True:
+            codes = {self._code(kmer) for kmer in itertools.islice(kmers, _PIECE_KMERS)}
+            if not codes:
+                return
+            self._pieces.append((array("Q", sorted(codes)), shard_index))
+
+    def build(self):
+        """Merges the added shards' kmers into the index"""
+        pieces = [
+            zip(codes, itertools.repeat(shard_index))
+            for codes, shard_index in self._pieces
+        ]
+        previous = None
+        for code, shard_index in heapq.merge(*pieces):
+            # A kmer repeated in several pieces of a shard gets indexed once
+            if (code, shard_index) == previous:
+                continue
+            previous = (code, shard_index)
+            self.codes.append(code)
+            self.shard_indices.append(shard_index)
+        self._pieces = list()
+
+    def route(self, sequence: bytes) -> Iterator[int]:
+        """Indices of the shards the read belongs to"""
+        for kmer in _canonical_kmers(sequence, self.kmer_size):
+            code = self._code(kmer)
+            index = bisect.bisect_left(self.codes, code)
+            if index < len(self.codes) and self.codes[index] == code:
+                break
+        else:
+            return
+        while index < len(self.codes) and self.codes[index] == code:
+            yield self.shard_indices[index]
+            index += 1
+
+
+class ShardInputs(NamedTuple):
+    shard: Shard
+    directory: Path
+    reference_fasta: Path
+    reads_files: List[Path]
+
+
+class _BufferedAppender:
+    """Appends to many files, without keeping them all open"""
+
+    def __init__(self):
+        self.buffers: Dict[Path, List[bytes]] = dict()
+        self.buffered_bytes = 0
+
+    def write(self, file_path: Path, data: bytes):
+        self.buffers.setdefault(file_path, list()).append(data)
+        self.buffered_bytes += len(data)
+        if self.buffered_bytes > _READS_BUFFER_BYTES:
+            self.flush()
+
+    def flush(self):
+        for file_path, chunks in self.buffers.items():
+            with file_path.open("ab") as f:
+                f.write(b"".join(chunks))
+        self.buffers = dict()
+        self.buffered_bytes = 0
+
+
+_router: Optional[_ReadRouter] = None
+
+
+def _set_router(router: _ReadRouter):
+    global _router
+    _router = router
+
+
+def _route_reads_file(
+    file_index: int, reads_file: Path, shard_directories: List[Path]
+) -> Tuple[List[Tuple[int, Path]], int, int]:
+    """
+    Routes one reads file's reads with the process's router. Returns the (shard index,
+    reads file) written, and the numbers of reads routed and not.
+    """
+    shard_reads: Dict[int, Path] = dict()
+    num_routed = num_unrouted = 0
+    appender = _BufferedAppender()
+    for record in iter_records(reads_file):
+        suffix = "fa" if record.qualities is None else "fq"
+        routed = False
+        for index in _router.route(record.sequence.upper()):
+            reads_path = shard_directories[index] / f"reads_{file_index}.{suffix}"
+            shard_reads.setdefault(index, reads_path)
+            appender.write(reads_path, record.to_bytes())
+            routed = True
+        if routed:
+            num_routed += 1
+        else:
+            num_unrouted += 1
+    appender.flush()
+    return sorted(shard_reads.items()), num_routed, num_unrouted
+
+
+def write_shard_inputs(
+    reference_fasta: Path,
+    reads_files: List[Path],
+    shards: List[Shard],
+    directory: Path,
+    kmer_size: int,
+    max_workers: Optional[int] = None,
+) -> List[ShardInputs]:
+    """
+    Writes each shard's reference window and the reads routed to it (per reads file,
+    in the same format) under `directory`/shard_<index>. Reads files get routed in
+    parallel, by up to `max_workers` processes (default: CPU count).
+    """
+    shutil.rmtree(directory, ignore_errors=True)
+    router = _ReadRouter(kmer_size)
+    shard_indices: Dict[str, List[int]] = dict()
+    for index, shard in enumerate(shards):
+        shard_indices.setdefault(shard.seq_id, list()).append(index)
+    shard_inputs = list()
+    for index, shard in enumerate(shards):
+        shard_directory = directory / f"shard_{index}"
+        shard_directory.mkdir(parents=True, exist_ok=True)
+        shard_inputs.append(
+            ShardInputs(shard, shard_directory, shard_directory / "ref.fa", list())
+        )
+
+    for record in iter_records(reference_fasta):
+        seq_id = record.name.split()[0].decode() if record.name.strip() else ""
+        sequence = record.sequence.upper()
+        for index in shard_indices.get(seq_id, ()):
+            shard = shards[index]
+            window = sequence[shard.start : shard.end]
+            with shard_inputs[index].reference_fasta.open("wb") as f:
+                f.write(b">%s\n" % seq_id.encode())
+                for start in range(0, len(window), _FASTA_LINE_WIDTH):
+                    f.write(window[start : start + _FASTA_LINE_WIDTH] + b"\n")
+            router.add(index, window)
+
+    router.build()
+
+    shard_directories = [inputs.directory for inputs in shard_inputs]
+    jobs = list(enumerate(reads_files))
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    max_workers = min(max_workers, len(jobs))
+    if max_workers > 1:
+        with ProcessPoolExecutor(
+            max_workers, initializer=_set_router, initargs=(router,)
+        ) as pool:
+            routings = list(
+                pool.map(
+                    _route_reads_file, *zip(*jobs), itertools.repeat(shard_directories)
+                )
+            )
+    else:
+        _set_router(router)
+        routings = [
+            _route_reads_file(file_index, reads_file, shard_directories)
+            for file_index, reads_file in jobs
+        ]
+
+    num_routed = num_unrouted = 0
+    for shard_reads, file_routed, file_unrouted in routings:
+        for index, reads_path in shard_reads:
+            shard_inputs[index].reads_files.append(reads_path)
+        num_routed += file_routed
+        num_unrouted += file_unrouted
+
+    print(
+        f"Routed {num_routed} reads to {len(shards)} shards; "
+        f"{num_unrouted} reads sharing no indexed {kmer_size}-mer with the "
+        "reference were dropped"
+    )
+    return shard_inputs
+
+
+def _record_key(line: bytes) -> int:
+    return int(line.split(b"\t", 2)[1])
+
+
+def _shard_records(shard: Shard, vcf_path: Path) -> Iterator[Tuple[int, bytes]]:
+    """The shard's own calls, sorted, with positions on the whole sequence"""
+    with vcf_path.open("rb") as f:
+        lines = (line for line in f if not line.startswith(b"#"))
+        if not _vcf_is_sorted(vcf_path):
+            lines = iter(sorted(lines, key=_record_key))
+        for line in lines:
+            chrom, pos, rest = line.split(b"\t", 2)
+            pos = shard.start + int(pos)  # 1-based
+            if shard.own_start < pos <= shard.own_end:
+                yield pos, b"%s\t%d\t%s" % (chrom, pos, rest)
+
+
+def _read_header(vcf_path: Path) -> List[bytes]:
+    header = list()
+    with vcf_path.open("rb") as f:
+        for line in f:
+            if not line.startswith(b"#"):
+                break
+            header.append(line)
+    return header
+
+
+def merge_shard_vcfs(
+    shard_vcfs: List[Tuple[Shard, Path]], output_vcf: Path, sample_name: str
+):
+    """
+    Merges the shards' VCFs, in shard order, into one sorted VCF: calls of the
+    shards of each sequence get merged with a k-way merge, keeping each shard's own
+    calls, and dropping any repeated call.
+    """
+    if not shard_vcfs:
+        _make_empty_vcf(output_vcf, sample_name)
+        return
+
+    meta_lines: Dict[bytes, None] = dict()
+    columns_line = None
+    for _, vcf_path in shard_vcfs:
+        for line in _read_header(vcf_path):
+            if line.startswith(b"##"):
+                meta_lines.setdefault(line)
+            elif columns_line is None:
+                columns_line = line
+
+    with output_vcf.open("wb") as f_out:
+        f_out.writelines(meta_lines)
+        if columns_line is not None:
+            f_out.write(columns_line)
+        for _, seq_shard_vcfs in itertools.groupby(
+            shard_vcfs, key=lambda shard_vcf: shard_vcf[0].seq_id
+        ):
+            previous_call = None
+            for _, line in heapq.merge(
+                *(_shard_records(shard, vcf) for shard, vcf in seq_shard_vcfs),
+                key=lambda record: record[0],
+            ):
+                chrom, pos, _, ref, alt = line.split(b"\t", 5)[:5]
+                if (pos, ref, alt) == previous_call:
+                    continue
+                previous_call = (pos, ref, alt)
+                f_out.write(line)
@@ -0,0 +1,246 @@
+"""
+Benchmarks `cortex.calls.run` on simulated datasets, and compares benchmark results.
+
+    python -m cortex.tests.benchmark run -o results.json
+    python -m cortex.tests.benchmark compare baseline.json results.json
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+import numpy as np
+
+import cortex
+from cortex.calls import run as cortex_run
+from cortex.tests.simulate_stream import (
+    ErrorModel,
+    apply_variants,
+    random_snps,
+    simulate_genomes,
+    stream_reads,
+    write_fasta,
+)
+
+
+class Case(NamedTuple):
+    genome_size: int
+    coverage: int
+    read_length: int
+    # Variants per kilobase
+    variant_density: float
+
+    @property
+    def name(self) -> str:
+        return (
+            f"genome{self.genome_size}_cov{self.coverage}"
+            f"_len{self.read_length}_dens{self.variant_density}"
+        )
+
+
+class Result(NamedTuple):
+    case: Case
+    wall_seconds: Optional[float]
+    peak_rss_bytes: Optional[int]
+    variants_simulated: int
+    variants_recovered: int
+    error: Optional[str] = None
+
+
+def make_grid(
+    genome_sizes: List[int],
+    coverages: List[int],
+    read_lengths: List[int],
+    variant_densities: List[float],
+) -> List[Case]:
+    return [
+        Case(*params)
+        for params in itertools.product(
+            genome_sizes, coverages, read_lengths, variant_densities
+        )
+    ]
+
+
+def _called_positions(vcf_path: Path) -> Set[Tuple[str, int]]:
+    positions = set()
+    with vcf_path.open() as vcf:
+        for line in vcf:
+            if not line.startswith("#"):
+                chrom, pos = line.split("\t", 2)[:2]
+                positions.add((chrom, int(pos)))
+    return positions
+
+
+def run_case(case: Case, seed: int = 0, error_rate: float = 0.0) -> Result:
+    rng = np.random.default_rng(seed)
+    work_dir = Path(tempfile.mkdtemp())
+    snps = list()
+    try:
+        genomes = simulate_genomes(["ref"], [case.genome_size], rng)
+        snps = random_snps(genomes, case.variant_density, rng)
+        ref_path, reads_path = work_dir / "ref.fa", work_dir / "reads.fq.gz"
+        vcf_path = work_dir / "out.vcf"
+        write_fasta(genomes, ref_path)
+        stream_reads(
+            apply_variants(genomes, snps),
+            reads_path,
+            case.read_length,
+            case.coverage,
+            rng,
+            ErrorModel(substitution_rate=error_rate),
+        )
+        del genomes
+
+        start = time.monotonic()
+        report = cortex_run(
+            ref_path,
+            [reads_path],
+            vcf_path,
+            tmp_directory=work_dir / "cortex",
+            mem_height="auto",
+        )
+        wall_seconds = time.monotonic() - start
+
+        peak_rss = [
+            stage.peak_child_rss_bytes
+            for stage in report.stages
+            if stage.peak_child_rss_bytes is not None
+        ]
+        called = _called_positions(vcf_path)
+        recovered = sum((snp.ref_ID, snp.pos[0] + 1) in called for snp in snps)
+        return Result(
+            case, wall_seconds, max(peak_rss, default=None), len(snps), recovered
+        )
+    except Exception as error:
+        return Result(case, None, None, len(snps), 0, repr(error))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def run_benchmarks(cases: List[Case], seed: int = 0, error_rate: float = 0.0) -> Dict:
+    results = list()
+    for case in cases:
+        # A fresh process per case, so peak child memory is that case's own
+        with ProcessPoolExecutor(1) as pool:
+            result = pool.submit(run_case, case, seed, error_rate).result()
+        print(
+            f"{case.name}: {result.wall_seconds}s, {result.peak_rss_bytes} bytes, "
+            f"{result.variants_recovered}/{result.variants_simulated} variants"
+            + (f", failed: {result.error}" if result.error else ""),
+            file=sys.stderr,
+        )
+        results.append(result)
+
+    return {
+        "environment": {
+            "py-cortex-api": cortex.__version__,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "seed": seed,
+            "error_rate": error_rate,
+        },
+        "results": [
+            {**result._asdict(), "case": result.case._asdict()} for result in results
+        ],
+    }
+
+
+def compare(baseline: Dict, current: Dict, threshold: float) -> List[str]:
+    """
+    Regressions of `current` relative to `baseline` results: wall time or peak memory
+    up by more than `threshold` (a fraction), fewer variants recovered, or failure.
+    """
+    baseline_results = {
+        Case(**result["case"]): result for result in baseline["results"]
+    }
+    regressions = list()
+    for result in current["results"]:
+        case = Case(**result["case"])
+        base = baseline_results.get(case)
+        if base is None:
+            continue
+        if result["error"] is not None:
+            if base["error"] is None:
+                regressions.append(f"{case.name}: now fails ({result['error']})")
+            continue
+        for metric in ("wall_seconds", "peak_rss_bytes"):
+            if base[metric] is None or result[metric] is None:
+                continue
+            if result[metric] > base[metric] * (1 + threshold):
+                regressions.append(
+                    f"{case.name}: {metric} {base[metric]} -> {result[metric]}"
+                )
+        if result["variants_recovered"] < base["variants_recovered"]:
+            regressions.append(
+                f"{case.name}: variants_recovered "
+                f"{base['variants_recovered']} -> {result['variants_recovered']}"
+            )
+    return regressions
+
+
+def _int_list(text: str) -> List[int]:
+    return [int(value) for value in text.split(",")]
+
+
+def _float_list(text: str) -> List[float]:
+    return [float(value) for value in text.split(",")]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="benchmark over a grid of datasets")
+    run_parser.add_argument("-o", "--output", type=Path, required=True)
+    run_parser.add_argument("--genome_sizes", type=_int_list, default=[100000, 1000000])
+    run_parser.add_argument("--coverages", type=_int_list, default=[30])
+    run_parser.add_argument("--read_lengths", type=_int_list, default=[100])
+    run_parser.add_argument("--variant_densities", type=_float_list, default=[1.0])
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument(
+        "--error_rate", type=float, default=0.0, help="per-base substitution rate"
+    )
+
+    compare_parser = subparsers.add_parser(
+        "compare", help="exits 1 if the current results regressed"
+    )
+    compare_parser.add_argument("baseline", type=Path)
+    compare_parser.add_argument("current", type=Path)
+    compare_parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="tolerated fractional increase in time and memory",
+    )
+
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        cases = make_grid(
+            args.genome_sizes, args.coverages, args.read_lengths, args.variant_densities
+        )
+        with args.output.open("w") as f:
+            json.dump(run_benchmarks(cases, args.seed, args.error_rate), f, indent=2)
+        return 0
+
+    with args.baseline.open() as f:
+        baseline = json.load(f)
+    with args.current.open() as f:
+        current = json.load(f)
+    regressions = compare(baseline, current, args.threshold)
+    for regression in regressions:
+        print(regression)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -68,7 +68,7 @@ class Reads:
     def write(self, path: Path):
         with path.open("w") as fout:
             for read in self.reads:
-                print(read.id, read.seq, "+", read.qual, sep="\n", file=fout)
+                print(f"@{read.id}", read.seq, "+", read.qual, sep="\n", file=fout)
 
 
 def simulate_refs(seq_ids: List[str], seq_lengths: List[int]) -> SeqRecords:
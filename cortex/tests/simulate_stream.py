@@ -0,0 +1,171 @@
+"""
+NumPy-backed simulation of large genomes and whole-genome read sets, streamed to disk
+in fixed-size chunks. Requires numpy (`pip install py-cortex-api[benchmark]`).
+"""
+
+import gzip
+from pathlib import Path
+from typing import BinaryIO, Dict, List, NamedTuple, Optional
+
+import numpy as np
+
+from cortex.tests.simulate_seqs import Variant
+
+_BASES = np.frombuffer(b"ACGT", dtype=np.uint8)
+_COMPLEMENT = np.zeros(256, dtype=np.uint8)
+_COMPLEMENT[_BASES] = np.frombuffer(b"TGCA", dtype=np.uint8)
+_BASE_INDEX = np.zeros(256, dtype=np.uint8)
+_BASE_INDEX[_BASES] = np.arange(4, dtype=np.uint8)
+
+Genomes = Dict[str, np.ndarray]
+
+
+class ErrorModel(NamedTuple):
+    """Uniform substitution errors; qualities are phred scores"""
+
+    substitution_rate: float = 0.001
+    quality: int = 40
+    error_quality: int = 10
+
+
+def _open_output(path: Path) -> BinaryIO:
+    if path.suffix == ".gz":
+        return gzip.open(str(path), "wb", compresslevel=1)
+    return path.open("wb")
+
+
+def simulate_genomes(
+    seq_ids: List[str], seq_lengths: List[int], rng: np.random.Generator
+) -> Genomes:
+    """Uniformly random sequences, as arrays of ASCII bases"""
+    return {
+        seq_id: _BASES[rng.integers(0, 4, size=seq_len, dtype=np.uint8)]
+        for seq_id, seq_len in zip(seq_ids, seq_lengths)
+    }
+
+
+def write_fasta(genomes: Genomes, path: Path, line_width: int = 60):
+    with _open_output(path) as fout:
+        for seq_id, seq in genomes.items():
+            fout.write(f">{seq_id}\n".encode())
+            for start in range(0, len(seq), line_width * 10000):
+                block = seq[start : start + line_width * 10000]
+                full_lines = len(block) // line_width * line_width
+                if full_lines:
+                    lines = block[:full_lines].reshape(-1, line_width)
+                    newlines = np.full((len(lines), 1), ord("\n"), dtype=np.uint8)
+                    fout.write(np.hstack([lines, newlines]).tobytes())
+                if full_lines < len(block):
+                    fout.write(block[full_lines:].tobytes() + b"\n")
+
+
+def random_snps(
+    genomes: Genomes, density_per_kb: float, rng: np.random.Generator
+) -> List[Variant]:
+    """SNPs at distinct uniformly random positions, each to a different base"""
+    snps = list()
+    for seq_id, seq in genomes.items():
+        num_snps = min(int(len(seq) * density_per_kb / 1000), len(seq))
+        positions = np.sort(rng.choice(len(seq), size=num_snps, replace=False))
+        shifts = rng.integers(1, 4, size=num_snps, dtype=np.uint8)
+        alts = _BASES[(_BASE_INDEX[seq[positions]] + shifts) % 4]
+        snps.extend(
+            Variant(seq_id, (int(pos), int(pos)), chr(alt))
+            for pos, alt in zip(positions, alts)
+        )
+    return snps
+
+
+def apply_variants(genomes: Genomes, variants: List[Variant]) -> Genomes:
+    """
+    Applies all variants in one pass per sequence. Variants (0-based, inclusive
+    positions) must not overlap.
+    """
+    by_seq: Dict[str, List[Variant]] = dict()
+    for variant in variants:
+        by_seq.setdefault(variant.ref_ID, list()).append(variant)
+
+    applied = dict(genomes)
+    for seq_id, seq_variants in by_seq.items():
+        seq = genomes[seq_id]
+        pieces = list()
+        previous_end = 0
+        for variant in sorted(seq_variants, key=lambda variant: variant.pos):
+            start, end = variant.pos
+            if start < previous_end:
+                raise ValueError(f"Overlapping variants at {seq_id}:{start}")
+            pieces.append(seq[previous_end:start])
+            pieces.append(np.frombuffer(str(variant.alt).encode(), dtype=np.uint8))
+            previous_end = end + 1
+        pieces.append(seq[previous_end:])
+        applied[seq_id] = np.concatenate(pieces)
+    return applied
+
+
+def _sample_reads(
+    seq: np.ndarray,
+    num_reads: int,
+    read_len: int,
+    rng: np.random.Generator,
+    error_model: ErrorModel,
+):
+    starts = rng.integers(0, len(seq) - read_len + 1, size=num_reads)
+    reads = seq[starts[:, None] + np.arange(read_len)]
+
+    reverse = rng.random(num_reads) < 0.5
+    reads[reverse] = _COMPLEMENT[reads[reverse][:, ::-1]]
+
+    quals = np.full(reads.shape, 33 + error_model.quality, dtype=np.uint8)
+    if error_model.substitution_rate > 0:
+        errors = rng.random(reads.shape) < error_model.substitution_rate
+        shifts = rng.integers(1, 4, size=int(errors.sum()), dtype=np.uint8)
+        reads[errors] = _BASES[(_BASE_INDEX[reads[errors]] + shifts) % 4]
+        quals[errors] = 33 + error_model.error_quality
+    return starts, reverse, reads, quals
+
+
+def stream_reads(
+    genomes: Genomes,
+    path: Path,
+    read_len: int,
+    fold_cov: float,
+    rng: np.random.Generator,
+    error_model: Optional[ErrorModel] = None,
+    chunk_size: int = 100000,
+) -> int:
+    """
+    Writes reads sampled uniformly across `genomes` (both strands) to `fold_cov`
+    coverage, as fastq (gzipped if `path` ends in .gz), `chunk_size` reads at a time.
+    Returns the number of reads written.
+    """
+    if error_model is None:
+        error_model = ErrorModel(substitution_rate=0)
+    seq_ids = [seq_id for seq_id, seq in genomes.items() if len(seq) >= read_len]
+    seq_lengths = np.array([len(genomes[seq_id]) for seq_id in seq_ids])
+    num_reads = int(seq_lengths.sum() * fold_cov / read_len)
+    reads_per_seq = rng.multinomial(num_reads, seq_lengths / seq_lengths.sum())
+
+    separator = b"\n+\n"
+    with _open_output(path) as fout:
+        for seq_id, seq_num_reads in zip(seq_ids, reads_per_seq):
+            for chunk_start in range(0, seq_num_reads, chunk_size):
+                chunk_num_reads = min(chunk_size, seq_num_reads - chunk_start)
+                starts, reverse, reads, quals = _sample_reads(
+                    genomes[seq_id], chunk_num_reads, read_len, rng, error_model
+                )
+                records = [
+                    b"@%s_%d_%s\n%s%s%s\n"
+                    % (
+                        seq_id.encode(),
+                        start,
+                        b"-" if is_reverse else b"+",
+                        read.tobytes(),
+                        separator,
+                        qual.tobytes(),
+                    )
+                    for start, is_reverse, read, qual in zip(
+                        starts, reverse, reads, quals
+                    )
+                ]
+                fout.write(b"".join(records))
+    return num_reads
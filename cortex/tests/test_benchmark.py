@@ -0,0 +1,50 @@
+from unittest import TestCase, skipUnless
+
+try:
+    from cortex.tests.benchmark import Case, compare, make_grid
+except ImportError:  # numpy missing
+    Case = None
+
+
+def _results(*results):
+    return {"environment": {}, "results": list(results)}
+
+
+def _result(wall_seconds=1.0, peak_rss_bytes=100, recovered=2, error=None):
+    return {
+        "case": Case(1000, 10, 50, 1.0)._asdict(),
+        "wall_seconds": wall_seconds,
+        "peak_rss_bytes": peak_rss_bytes,
+        "variants_simulated": 2,
+        "variants_recovered": recovered,
+        "error": error,
+    }
+
+
+@skipUnless(Case is not None, "requires numpy")
+class TestMakeGrid(TestCase):
+    def test_all_combinations(self):
+        grid = make_grid([100, 200], [10], [50, 75], [1.0])
+        self.assertEqual(len(grid), 4)
+        self.assertIn(Case(200, 10, 75, 1.0), grid)
+
+
+@skipUnless(Case is not None, "requires numpy")
+class TestCompare(TestCase):
+    def test_within_threshold_passes(self):
+        baseline = _results(_result())
+        current = _results(_result(wall_seconds=1.05, peak_rss_bytes=109))
+        self.assertEqual(compare(baseline, current, 0.1), [])
+
+    def test_regressions_reported(self):
+        baseline = _results(_result())
+        current = _results(_result(wall_seconds=2.0, recovered=1))
+        regressions = compare(baseline, current, 0.1)
+        self.assertEqual(len(regressions), 2)
+        self.assertIn("wall_seconds", regressions[0])
+        self.assertIn("variants_recovered", regressions[1])
+
+    def test_new_failure_is_a_regression(self):
+        baseline = _results(_result())
+        current = _results(_result(wall_seconds=None, error="RuntimeError()"))
+        self.assertEqual(len(compare(baseline, current, 0.1)), 1)
@@ -0,0 +1,175 @@
+import gzip
+import os
+import struct
+import tempfile
+import zlib
+from unittest import TestCase
+from pathlib import Path
+
+from cortex.bgzf import (
+    BgzfWriter,
+    _reg2bin,
+    inflate_block,
+    is_bgzf,
+    iter_blocks,
+    write_indexed_vcf,
+)
+from cortex.file_manip import _deliver_file, _vcf_is_sorted
+
+_HEADER = "##fileformat=VCFv4.2\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n"
+
+
+def _record(chrom: str, pos: int) -> str:
+    return f"{chrom}\t{pos}\t.\tA\tG\t.\tPASS\t.\n"
+
+
+def _read_virtual_offset(path: Path, virtual_offset: int) -> bytes:
+    """The line starting at a BGZF virtual offset"""
+    with path.open("rb") as f:
+        f.seek(virtual_offset >> 16)
+        header = f.read(18)
+        block_size = struct.unpack("<H", header[16:18])[0] + 1
+        compressed = f.read(block_size - 18 - 8)
+    data = zlib.decompress(compressed, -15)
+    return data[virtual_offset & 0xFFFF :].split(b"\n", 1)[0]
+
+
+def _parse_tbi(path: Path):
+    data = gzip.decompress(path.read_bytes())
+    assert data[:4] == b"TBI\1"
+    n_ref, fmt, col_seq, col_beg, col_end, meta, skip, l_nm = struct.unpack(
+        "<8i", data[4:36]
+    )
+    names = data[36 : 36 + l_nm].split(b"\0")[:-1]
+    offset = 36 + l_nm
+    references = list()
+    for _ in range(n_ref):
+        (n_bin,) = struct.unpack_from("<i", data, offset)
+        offset += 4
+        bins = dict()
+        for _ in range(n_bin):
+            bin_number, n_chunk = struct.unpack_from("<Ii", data, offset)
+            offset += 8
+            chunks = struct.unpack_from(f"<{2 * n_chunk}Q", data, offset)
+            offset += 16 * n_chunk
+            bins[bin_number] = list(zip(chunks[::2], chunks[1::2]))
+        (n_intv,) = struct.unpack_from("<i", data, offset)
+        offset += 4
+        linear = struct.unpack_from(f"<{n_intv}Q", data, offset)
+        offset += 8 * n_intv
+        references.append((bins, linear))
+    return fmt, (col_seq, col_beg, col_end, chr(meta)), names, references
+
+
+class TestBgzfWriter(TestCase):
+    def test_blocks_decompress_and_offsets_point_at_data(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir) / "out.gz"
+            offsets = list()
+            with path.open("wb") as f:
+                writer = BgzfWriter(f)
+                for i in range(20000):
+                    offsets.append(writer.tell())
+                    writer.write(b"line %d\n" % i)
+                writer.close()
+
+            with gzip.open(path) as f:
+                self.assertEqual(len(f.read().splitlines()), 20000)
+            self.assertEqual(_read_virtual_offset(path, offsets[12345]), b"line 12345")
+
+    def test_incompressible_data_fits_in_blocks(self):
+        data = os.urandom(200000)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir) / "out.gz"
+            with path.open("wb") as f:
+                writer = BgzfWriter(f, compresslevel=9)
+                writer.write(data)
+                writer.close()
+            with gzip.open(path) as f:
+                self.assertEqual(f.read(), data)
+
+    def test_blocks_read_back(self):
+        data = b"".join(b"line %d\n" % i for i in range(20000))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir) / "out.gz"
+            with path.open("wb") as f:
+                writer = BgzfWriter(f)
+                writer.write(data)
+                writer.close()
+            with path.open("rb") as f:
+                self.assertTrue(is_bgzf(f))
+                blocks = list(iter_blocks(f))
+            self.assertEqual(b"".join(map(inflate_block, blocks)), data)
+
+            path.write_bytes(gzip.compress(data))
+            with path.open("rb") as f:
+                self.assertFalse(is_bgzf(f))
+
+
+class TestWriteIndexedVcf(TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.tmp_dir = Path(self._tmp_dir.name)
+        self.vcf = self.tmp_dir / "in.vcf"
+        self.output = self.tmp_dir / "out.vcf.gz"
+
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+
+    def test_index_locates_records(self):
+        records = [_record("ref1", pos) for pos in range(1, 200000, 50)]
+        records += [_record("ref2", 100)]
+        self.vcf.write_text(_HEADER + "".join(records))
+        write_indexed_vcf(self.vcf, self.output)
+
+        with gzip.open(self.output, "rt") as f:
+            self.assertEqual(f.read(), self.vcf.read_text())
+
+        fmt, columns, names, references = _parse_tbi(Path(f"{self.output}.tbi"))
+        self.assertEqual((fmt, columns), (2, (1, 2, 0, "#")))
+        self.assertEqual(names, [b"ref1", b"ref2"])
+
+        bins, linear = references[0]
+        self.assertEqual(len(linear), 199951 // 2**14 + 1)
+        pos = 150001
+        # Records of a bin written back to back make one chunk, starting at the
+        # bin's first record
+        ((beg, _),) = bins[_reg2bin(pos - 1, pos)]
+        first_in_bin = _read_virtual_offset(self.output, beg)
+        self.assertTrue(first_in_bin.startswith(b"ref1\t147501\t"))
+        first_in_window = _read_virtual_offset(self.output, linear[(pos - 1) >> 14])
+        self.assertTrue(first_in_window.startswith(b"ref1\t"))
+
+        bins, _ = references[1]
+        ((beg, _),) = bins[_reg2bin(99, 100)]
+        self.assertEqual(
+            _read_virtual_offset(self.output, beg), _record("ref2", 100)[:-1].encode()
+        )
+
+    def test_unsorted_records_get_sorted(self):
+        records = [_record("ref2", 5), _record("ref1", 9), _record("ref2", 1)]
+        self.vcf.write_text(_HEADER + "".join(records))
+        self.assertFalse(_vcf_is_sorted(self.vcf))
+
+        write_indexed_vcf(self.vcf, self.output)
+        with gzip.open(self.output, "rt") as f:
+            written = f.read()
+        self.assertEqual(
+            written,
+            _HEADER + _record("ref2", 1) + _record("ref2", 5) + _record("ref1", 9),
+        )
+
+
+class TestDeliverFile(TestCase):
+    def test_disposable_source_linked_else_copied(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            source, destination = Path(tmp_dir) / "source", Path(tmp_dir) / "dest"
+            source.write_text("calls")
+
+            _deliver_file(source, destination, source_is_disposable=False)
+            self.assertEqual(destination.read_text(), "calls")
+            self.assertFalse(source.samefile(destination))
+
+            _deliver_file(source, destination, source_is_disposable=True)
+            self.assertEqual(destination.read_text(), "calls")
+            self.assertTrue(source.samefile(destination))
@@ -0,0 +1,185 @@
+import os
+import tempfile
+import threading
+from unittest import TestCase, mock
+from pathlib import Path
+
+from cortex.cache import IndexCache, ResultCache
+from cortex.calls import _make_cached_index, run
+
+
+def _fill_entry(directory: Path, num_bytes: int):
+    with (directory / "k31.ctx").open("wb") as f:
+        f.write(b"x" * num_bytes)
+
+
+class TestIndexCache(TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.tmp_dir = Path(self._tmp_dir.name)
+        self.reference = self.tmp_dir / "ref.fa"
+        self.reference.write_text(">ref1\nACGTACGT\n")
+
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+
+    def test_key_depends_on_contents_and_parameters(self):
+        cache = IndexCache(self.tmp_dir / "cache")
+        key = cache.key(self.reference, 31, 22, 100)
+        self.assertEqual(key, cache.key(self.reference, 31, 22, 100))
+        self.assertNotEqual(key, cache.key(self.reference, 31, 23, 100))
+
+        other_reference = self.tmp_dir / "ref2.fa"
+        other_reference.write_text(">ref1\nACGTACGA\n")
+        self.assertNotEqual(key, cache.key(other_reference, 31, 22, 100))
+
+    def test_publish_then_get(self):
+        cache = IndexCache(self.tmp_dir / "cache")
+        self.assertIsNone(cache.get("key1"))
+
+        staging = cache.staging("key1")
+        _fill_entry(staging, 10)
+        entry = cache.publish("key1", staging)
+
+        self.assertEqual(cache.get("key1"), entry)
+        self.assertFalse(staging.exists())
+        self.assertTrue((entry / "k31.ctx").exists())
+
+    def test_concurrent_publish_keeps_first_entry(self):
+        cache = IndexCache(self.tmp_dir / "cache")
+        first, second = cache.staging("key1"), cache.staging("key1")
+        (first / "first").touch()
+        (second / "second").touch()
+
+        cache.publish("key1", first)
+        entry = cache.publish("key1", second)
+
+        self.assertTrue((entry / "first").exists())
+        self.assertFalse(second.exists())
+
+    def test_least_recently_used_entry_evicted(self):
+        cache = IndexCache(self.tmp_dir / "cache", max_bytes=25)
+        for age, key in enumerate(["key3", "key2", "key1"]):
+            staging = cache.staging(key)
+            _fill_entry(staging, 10)
+            entry = cache.publish(key, staging)
+            os.utime(entry, (1000 - age, 1000 - age))
+
+        cache.get("key1")
+        cache.evict()
+
+        self.assertIsNotNone(cache.get("key1"))
+        self.assertIsNotNone(cache.get("key3"))
+        self.assertIsNone(cache.get("key2"))
+        self.assertEqual(len(list(cache.root.iterdir())), 2)
+
+
+class TestMakeCachedIndex(TestCase):
+    def test_index_built_once_then_reused(self):
+        def fake_make(index, reference_fasta, mem_height):
+            _fill_entry(index.base, 10)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tmp_dir = Path(tmp_dir)
+            reference = tmp_dir / "ref.fa"
+            reference.write_text(">ref1\nACGTACGT\n")
+            cache = IndexCache(tmp_dir / "cache")
+
+            with mock.patch(
+                "cortex.calls._CortexIndex.make", autospec=True, side_effect=fake_make
+            ) as mock_make:
+                for run_directory in ["run1", "run2"]:
+                    (tmp_dir / run_directory).mkdir()
+                    index = _make_cached_index(
+                        tmp_dir / run_directory / "indexes", reference, 22, cache
+                    )
+                    self.assertTrue(index.dump_binary_ctx.exists())
+                mock_make.assert_called_once()
+
+
+class TestResultCache(TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.tmp_dir = Path(self._tmp_dir.name)
+        self.reference = self.tmp_dir / "ref.fa"
+        self.reference.write_text(">ref\n" + "ACGT" * 25 + "\n")
+        self.reads = self.tmp_dir / "reads.fa"
+        self.reads.write_text(">read\n" + "ACGT" * 10 + "\n")
+
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+
+    def test_key_depends_on_reads_and_parameters(self):
+        for cache in (
+            ResultCache(self.tmp_dir / "cache"),
+            ResultCache(self.tmp_dir / "cache", full_hash=True),
+        ):
+            key = cache.key(self.reference, [self.reads], ploidy=1)
+            self.assertEqual(key, cache.key(self.reference, [self.reads], ploidy=1))
+            self.assertNotEqual(key, cache.key(self.reference, [self.reads], ploidy=2))
+
+            other_reads = self.tmp_dir / "reads2.fa"
+            other_reads.write_text(">read\n" + "ACGA" * 10 + "\n")
+            self.assertNotEqual(key, cache.key(self.reference, [other_reads], ploidy=1))
+
+    def test_identical_run_delivers_cached_vcf(self):
+        def fake_calls(caller, *args, **kwargs):
+            vcf = caller.output_directory / "vcfs" / "sample_wk_FINAL_raw.vcf"
+            vcf.parent.mkdir(parents=True)
+            vcf.write_text("##fileformat=VCFv4.2\n#CHROM\tcalled\n")
+
+        cache = ResultCache(self.tmp_dir / "cache")
+        outputs = [self.tmp_dir / "out1.vcf", self.tmp_dir / "out2.vcf"]
+        with mock.patch("cortex.calls._CortexCall.make_index"), mock.patch(
+            "cortex.calls._CortexCall.execute_calls",
+            autospec=True,
+            side_effect=fake_calls,
+        ) as mock_execute_calls:
+            for output in outputs:
+                report = run(self.reference, [self.reads], output, result_cache=cache)
+            mock_execute_calls.assert_called_once()
+
+        self.assertEqual(
+            [stage.name for stage in report.stages], ["inputs", "vcf delivery"]
+        )
+        self.assertEqual(outputs[0].read_text(), outputs[1].read_text())
+        self.assertIn("called", outputs[1].read_text())
+
+    def test_auto_mem_height_not_estimated_for_cached_vcf(self):
+        cache = ResultCache(self.tmp_dir / "cache")
+        with mock.patch("cortex.calls._CortexCall.make_index"), mock.patch(
+            "cortex.calls._CortexCall.execute_calls"
+        ), mock.patch(
+            "cortex.memory.auto_mem_height", return_value=10
+        ) as mock_auto_mem_height:
+            for output in ("out1.vcf", "out2.vcf"):
+                report = run(
+                    self.reference,
+                    [self.reads],
+                    self.tmp_dir / output,
+                    mem_height="auto",
+                    result_cache=cache,
+                )
+            mock_auto_mem_height.assert_called_once()
+        self.assertEqual(report.parameters["mem_height"], "auto")
+        self.assertTrue(report.parameters["result_cache_hit"])
+
+    def test_cache_hit_with_str_tmp_directory(self):
+        cache = ResultCache(self.tmp_dir / "cache")
+        with mock.patch("cortex.calls._CortexCall.make_index"), mock.patch(
+            "cortex.calls._CortexCall.execute_calls"
+        ):
+            for output in ("out1.vcf", "out2.vcf"):
+                threads = threading.active_count()
+                report = run(
+                    self.reference,
+                    [self.reads],
+                    self.tmp_dir / output,
+                    tmp_directory=str(self.tmp_dir / f"tmp_{output}"),
+                    cleanup=False,
+                    result_cache=cache,
+                )
+        self.assertTrue(report.parameters["result_cache_hit"])
+        self.assertEqual(report.peak_tmp_directory_bytes, 0)
+        # No disk usage sampler left running
+        self.assertEqual(threading.active_count(), threads)
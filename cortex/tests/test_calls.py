@@ -1,3 +1,8 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures.process import BrokenProcessPool
 from unittest import TestCase, mock
 from pathlib import Path
 import tempfile
@@ -6,7 +11,21 @@ import random
 
 from Bio.Seq import Seq
 
-from cortex.calls import run as cortex_run
+from cortex.calls import (
+    HashTableFull,
+    _CortexIndex,
+    run as cortex_run,
+    run_async,
+    run_many,
+    run_joint,
+    run_many_async,
+    Sample,
+)
+from cortex import utils
+from cortex.file_manip import _make_empty_vcf
+from cortex.memory import MemHeightHistory
+from cortex.preprocess import ReadsPreprocessing
+from cortex.report import RunReport
 from cortex.tests.simulate_seqs import (
     SeqRecord,
     SeqRecords,
@@ -17,6 +36,9 @@ from cortex.tests.simulate_seqs import (
     dna_choices,
 )
 
+# Long enough to hold a kmer
+_ONE_READ = ">read\n" + "ACGT" * 10 + "\n"
+
 
 class tmpInputFiles:
     def __init__(self):
@@ -39,11 +61,17 @@ class tmpInputFiles:
 class TestCortexRunErrors(TestCase):
     def test_not_enough_memory_fails(self):
         refs = simulate_refs(["id1"], [10000])
-        reads = simulate_reads(refs, variants=list(), read_len=10)
+        ref_seq = str(refs.get_by_id("id1").seq)
 
         with tmpInputFiles() as paths:
             refs.write(paths.ref_out)
-            reads.write(paths.reads_out)
+            # Reads holding kmers, so that cortex runs (and fails) on them
+            paths.reads_out.write_text(
+                "".join(
+                    f">read{start}\n{ref_seq[start:start + 50]}\n"
+                    for start in range(0, 9950, 25)
+                )
+            )
 
             with self.assertRaises(RuntimeError):
                 cortex_run(
@@ -55,6 +83,403 @@ class TestCortexRunErrors(TestCase):
                 )
 
 
+class TestRunReport(TestCase):
+    def test_run_reports_stages_and_parameters(self):
+        with tmpInputFiles() as paths:
+            paths.ref_out.write_text(">ref\nACGT\n")
+            paths.reads_out.write_text(_ONE_READ)
+            with mock.patch("cortex.calls._CortexCall.make_index"), mock.patch(
+                "cortex.calls._CortexCall.execute_calls"
+            ):
+                report = cortex_run(
+                    paths.ref_out,
+                    [paths.reads_out],
+                    paths.out_vcf,
+                    tmp_directory=paths._tmp_dir / "run",
+                    mem_height=10,
+                )
+
+        self.assertEqual(
+            [stage.name for stage in report.stages],
+            [
+                "inputs",
+                "reads profile",
+                "index",
+                "input files",
+                "genome size",
+                "calls",
+                "vcf delivery",
+                "cleanup",
+            ],
+        )
+        self.assertEqual(report.parameters["mem_height"], 10)
+        self.assertEqual(report.input_sizes[str(paths.ref_out)], 10)
+        self.assertEqual(report.reads_profile.max_read_len, 40)
+
+    def test_reads_without_kmers_skip_cortex(self):
+        with tmpInputFiles() as paths:
+            paths.ref_out.write_text(">ref\nACGT\n")
+            paths.reads_out.write_text(">read\nACGT\n")
+            with mock.patch(
+                "cortex.calls._CortexCall.make_index"
+            ) as mock_make_index, mock.patch(
+                "cortex.calls._CortexCall.execute_calls"
+            ) as mock_execute_calls:
+                report = cortex_run(paths.ref_out, [paths.reads_out], paths.out_vcf)
+
+            self.assertEqual(
+                [stage.name for stage in report.stages],
+                ["inputs", "reads profile", "vcf delivery", "cleanup"],
+            )
+            mock_make_index.assert_not_called()
+            mock_execute_calls.assert_not_called()
+            self.assertIn("#CHROM", paths.out_vcf.read_text())
+
+
+class TestRunPreprocessReads(TestCase):
+    def test_cortex_gets_preprocessed_reads(self):
+        with tmpInputFiles() as paths:
+            paths.ref_out.write_text(">ref\n" + "ACGT" * 25 + "\n")
+            paths.reads_out.write_text(
+                "@long\n" + "ACGT" * 10 + "\n+\n" + "I" * 40 + "\n"
+                "@short\nACGT\n+\nIIII\n"
+            )
+            tmp_directory = paths._tmp_dir / "run"
+            with mock.patch("cortex.calls._CortexCall.make_index"), mock.patch(
+                "cortex.calls._CortexCall.execute_calls"
+            ):
+                report = cortex_run(
+                    paths.ref_out,
+                    [paths.reads_out],
+                    paths.out_vcf,
+                    tmp_directory=tmp_directory,
+                    mem_height=10,
+                    cleanup=False,
+                    preprocess_reads=ReadsPreprocessing(),
+                )
+
+            self.assertIn(
+                "reads preprocessing", [stage.name for stage in report.stages]
+            )
+            self.assertEqual(report.reads_preprocessing.reads_out, 1)
+            self.assertEqual(
+                (tmp_directory / "cortex_reads_in.fofn").read_text().strip(),
+                str(tmp_directory / "reads" / "reads_0.fq.gz"),
+            )
+
+
+def fake_calls_needing_mem_height(needed_mem_height: int):
+    """Fails calls like cortex does when its hash table fills up"""
+
+    def fake_calls(command, *args, **kwargs):
+        mem_height = command[command.index("--mem_height") + 1]
+        if mem_height < needed_mem_height:
+            log = Path(command[command.index("--logfile") + 1])
+            log.write_text("Cleaning...\nError: hash table is full\n")
+            raise RuntimeError("run_calls.pl exited with status 1")
+
+    return fake_calls
+
+
+class TestRunMemHeightRetry(TestCase):
+    def test_calls_retried_with_larger_mem_height(self):
+        with tmpInputFiles() as paths:
+            paths.ref_out.write_text(">ref\nACGT\n")
+            paths.reads_out.write_text(_ONE_READ)
+            history = MemHeightHistory(paths._tmp_dir / "mem_heights.json")
+            run_args = (paths.ref_out, [paths.reads_out], paths.out_vcf)
+            with mock.patch("cortex.calls._CortexCall.make_index") as mock_make_index:
+                with mock.patch(
+                    "cortex.utils.syscall_streaming",
+                    side_effect=fake_calls_needing_mem_height(12),
+                ) as mock_calls:
+                    report = cortex_run(
+                        *run_args,
+                        mem_height=10,
+                        max_mem_height=14,
+                        mem_height_history=history,
+                    )
+                self.assertEqual(mock_make_index.call_count, 1)
+                self.assertEqual(mock_calls.call_count, 3)
+                self.assertEqual(report.parameters["mem_height"], 12)
+                self.assertEqual(history.get(paths.ref_out, [paths.reads_out]), 12)
+
+                # The next run on the same inputs starts where the last one ended
+                with mock.patch(
+                    "cortex.utils.syscall_streaming",
+                    side_effect=fake_calls_needing_mem_height(12),
+                ) as mock_calls:
+                    cortex_run(*run_args, mem_height=10, mem_height_history=history)
+                self.assertEqual(mock_calls.call_count, 1)
+
+    def test_hash_table_full_raised_at_ceiling(self):
+        with tmpInputFiles() as paths:
+            paths.ref_out.write_text(">ref\nACGT\n")
+            paths.reads_out.write_text(_ONE_READ)
+            run_args = (paths.ref_out, [paths.reads_out], paths.out_vcf)
+            with mock.patch("cortex.calls._CortexCall.make_index"), mock.patch(
+                "cortex.utils.syscall_streaming",
+                side_effect=fake_calls_needing_mem_height(12),
+            ) as mock_calls:
+                with self.assertRaises(HashTableFull):
+                    cortex_run(*run_args, mem_height=10)
+                self.assertEqual(mock_calls.call_count, 1)
+                with self.assertRaises(HashTableFull):
+                    cortex_run(*run_args, mem_height=10, max_mem_height=11)
+                self.assertEqual(mock_calls.call_count, 3)
+
+    def test_index_build_retried_with_larger_mem_height(self):
+        def fake_cortex(command, log_file, *args, **kwargs):
+            mem_height = command[command.index("--mem_height") + 1]
+            if "--dump_binary" in command and mem_height < 12:
+                log_file.write_text("Loading reference\nHash table is full\n")
+                raise RuntimeError("Error in system call. Cannot continue")
+
+        with tmpInputFiles() as paths:
+            paths.ref_out.write_text(">ref\nACGT\n")
+            paths.reads_out.write_text(_ONE_READ)
+            run_args = (paths.ref_out, [paths.reads_out], paths.out_vcf)
+            with mock.patch(
+                "cortex.utils.syscall_streaming", side_effect=fake_cortex
+            ) as mock_cortex:
+                with self.assertRaises(HashTableFull):
+                    cortex_run(*run_args, mem_height=10)
+                mock_cortex.reset_mock()
+                report = cortex_run(*run_args, mem_height=10, max_mem_height=14)
+            # Two index builds failed, then an index build and calls at 12
+            self.assertEqual(mock_cortex.call_count, 4)
+            self.assertEqual(report.parameters["mem_height"], 12)
+
+
+class TestRunJoint(TestCase):
+    def test_samples_called_jointly_then_split(self):
+        joint_calls = (
+            "##fileformat=VCFv4.2\n"
+            "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\ts1\ts2\n"
+            "ref\t10\tvar_1\tA\tG\t.\tPASS\t.\tGT:COV\t1/1:0,9\t0/0:8,0\n"
+            "ref\t20\tvar_2\tC\tT\t.\tPASS\t.\tGT:COV\t0/1:4,5\t1/1:0,7\n"
+        )
+
+        def fake_calls(caller, *args, **kwargs):
+            self.assertEqual(caller.workflow, "joint")
+            self.assertIn("joint", caller._calls_command(100))
+            vcf = caller.output_directory / "vcfs" / "s1_wk_FINAL_raw.vcf"
+            vcf.parent.mkdir(parents=True)
+            vcf.write_text(joint_calls)
+
+        with tmpInputFiles() as paths:
+            paths.ref_out.write_text(">ref\n" + "ACGT" * 25 + "\n")
+            paths.reads_out.write_text(_ONE_READ)
+            tmp_directory = paths._tmp_dir / "run"
+            s2_vcf = paths._tmp_dir / "s2.vcf"
+            with mock.patch("cortex.calls._CortexCall.make_index"), mock.patch(
+                "cortex.calls._CortexCall.execute_calls",
+                autospec=True,
+                side_effect=fake_calls,
+            ) as mock_execute_calls:
+                run_joint(
+                    paths.ref_out,
+                    {"s1": [paths.reads_out], "s2": [paths.reads_out]},
+                    paths.out_vcf,
+                    sample_vcfs={"s2": s2_vcf},
+                    tmp_directory=tmp_directory,
+                    cleanup=False,
+                )
+
+            mock_execute_calls.assert_called_once()
+            reads_index = (tmp_directory / "cortex_reads_in.index").read_text()
+            self.assertEqual(
+                [line.split("\t")[0] for line in reads_index.splitlines()],
+                ["s1", "s2"],
+            )
+            self.assertEqual(paths.out_vcf.read_text(), joint_calls)
+            s2_calls = [
+                line.split("\t")
+                for line in s2_vcf.read_text().splitlines()
+                if not line.startswith("##")
+            ]
+            self.assertEqual(s2_calls[0][-1], "s2")
+            self.assertEqual([call[1] for call in s2_calls[1:]], ["20"])
+            self.assertEqual(s2_calls[1][-1], "1/1:0,7")
+
+    def test_cohort_without_cortex_build_rejected_up_front(self):
+        with tmpInputFiles() as paths:
+            samples = {f"s{index}": [paths.reads_out] for index in range(9)}
+            with mock.patch("cortex.calls._CortexCall.make_index") as mock_make_index:
+                with self.assertRaisesRegex(ValueError, "cortex_var_31_c10"):
+                    run_joint(paths.ref_out, samples, paths.out_vcf)
+            mock_make_index.assert_not_called()
+
+
+class TestRunResume(TestCase):
+    def test_resume_skips_completed_stages(self):
+        def fake_make_index(caller, reference_fasta, index_cache=None):
+            caller.index.dump_binary_ctx.write_text("ctx")
+
+        with tmpInputFiles() as paths:
+            paths.ref_out.write_text(">ref\nACGT\n")
+            paths.reads_out.write_text(_ONE_READ)
+            run_args = (paths.ref_out, [paths.reads_out], paths.out_vcf)
+            run_kwargs = dict(tmp_directory=paths._tmp_dir / "run", resume=True)
+
+            with mock.patch(
+                "cortex.calls._CortexCall.make_index",
+                autospec=True,
+                side_effect=fake_make_index,
+            ) as mock_make_index, mock.patch(
+                "cortex.calls._CortexCall.execute_calls",
+                side_effect=[RuntimeError("preempted"), None],
+            ) as mock_execute_calls:
+                with self.assertRaises(RuntimeError):
+                    cortex_run(*run_args, **run_kwargs)
+                cortex_run(*run_args, **run_kwargs)
+
+            self.assertEqual(mock_make_index.call_count, 1)
+            self.assertEqual(mock_execute_calls.call_count, 2)
+            self.assertTrue(paths.out_vcf.exists())
+
+    def test_resume_needs_tmp_directory(self):
+        with self.assertRaises(ValueError):
+            cortex_run("ref.fa", ["reads.fq"], "out.vcf", resume=True)
+
+
+class TestRunMany(TestCase):
+    def test_failing_samples_do_not_abort_batch(self):
+        with tmpInputFiles() as paths:
+            samples = [
+                Sample(paths.ref_out, str(paths.reads_out), paths.out_vcf, "s1"),
+                Sample(paths.ref_out, str(paths.reads_out), paths.out_vcf, "s2"),
+            ]
+            results = run_many(samples, max_workers=2)
+
+        self.assertEqual([result.sample for result in results], samples)
+        for result in results:
+            self.assertFalse(result.success)
+            self.assertIsInstance(result.error, ValueError)
+
+    def test_sample_over_memory_budget_fails(self):
+        with tmpInputFiles() as paths:
+            samples = [Sample(paths.ref_out, [paths.reads_out], paths.out_vcf)]
+            results = run_many(samples, max_memory=1000, mem_height=10)
+
+        self.assertFalse(results[0].success)
+        self.assertIn("exceeds max_memory", str(results[0].error))
+
+
+def _running(pid: int) -> bool:
+    """Whether the process runs, not counting zombies nobody reaps"""
+    try:
+        return Path(f"/proc/{pid}/stat").read_text().rsplit(")", 1)[1].split()[0] != "Z"
+    except FileNotFoundError:
+        return False
+
+
+def _run_or_die(reference_fasta, reads_files, output_vcf_file_path, **kwargs):
+    """Stands in for `run` in run_many's processes"""
+    if kwargs["sample_name"] == "dies":
+        pid_file = Path(output_vcf_file_path).with_suffix(".pid")
+        command = [
+            "sh",
+            "-c",
+            f"echo $$ > {pid_file}.tmp; mv {pid_file}.tmp {pid_file}; sleep 60",
+        ]
+        threading.Thread(
+            target=utils.syscall_streaming, args=(command, None), daemon=True
+        ).start()
+        # Die once the command runs and its process group got recorded
+        while not pid_file.exists() or not any(utils.process_group_directory.iterdir()):
+            time.sleep(0.01)
+        os._exit(9)
+    Path(output_vcf_file_path).write_text("##fileformat=VCFv4.2\n")
+    return RunReport()
+
+
+class TestRunManyProcessDeath(TestCase):
+    def test_dying_sample_fails_alone_and_its_commands_get_killed(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tmp_dir = Path(tmp_dir)
+            samples = [
+                Sample("ref.fa", ["reads.fq"], tmp_dir / f"{name}.vcf", name)
+                for name in ("s1", "dies", "s2")
+            ]
+            with mock.patch("cortex.calls.run", _run_or_die):
+                results = run_many(samples, max_workers=3)
+            pid = int((tmp_dir / "dies.pid").read_text())
+
+        self.assertEqual([result.success for result in results], [True, False, True])
+        self.assertIsInstance(results[1].error, BrokenProcessPool)
+        time.sleep(0.1)
+        self.assertFalse(_running(pid))
+
+    def test_index_build_process_group_recorded(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tmp_dir = Path(tmp_dir)
+            process_groups = tmp_dir / "process_groups"
+            process_groups.mkdir()
+            listing = tmp_dir / "listing"
+            index = _CortexIndex(tmp_dir / "index")
+            index.ref_names_file.touch()  # _make_command writes it
+            command = [
+                "sh",
+                "-c",
+                f"echo $$ > {listing}; ls {process_groups} >> {listing}",
+            ]
+            with mock.patch.object(
+                utils, "process_group_directory", process_groups
+            ), mock.patch.object(index, "_make_command", return_value=command):
+                index.make(tmp_dir / "ref.fa", 10)
+
+            pid, *recorded = listing.read_text().split()
+            self.assertEqual(recorded, [pid])
+            self.assertEqual(list(process_groups.iterdir()), [])
+
+    def test_unpicklable_run_kwargs_rejected(self):
+        samples = [Sample("ref.fa", ["reads.fq"], "out.vcf")]
+        with self.assertRaisesRegex(ValueError, "cancel"):
+            run_many(samples, cancel=threading.Event())
+
+
+class TestRunAsync(TestCase):
+    def test_cancellation_removes_tmp_directory(self):
+        async def never_finishes(*args, **kwargs):
+            await asyncio.sleep(60)
+
+        async def cancel_run(paths):
+            task = asyncio.ensure_future(
+                run_async(
+                    paths.ref_out,
+                    [paths.reads_out],
+                    paths.out_vcf,
+                    tmp_directory=paths._tmp_dir / "run",
+                )
+            )
+            await asyncio.sleep(0.2)
+            self.assertTrue((paths._tmp_dir / "run").exists())
+            task.cancel()
+            await task
+
+        with tmpInputFiles() as paths:
+            paths.ref_out.write_text(">ref\nACGT\n")
+            paths.reads_out.write_text(_ONE_READ)
+            with mock.patch("cortex.utils.syscall_async", side_effect=never_finishes):
+                with self.assertRaises(asyncio.CancelledError):
+                    asyncio.run(cancel_run(paths))
+            self.assertFalse((paths._tmp_dir / "run").exists())
+
+    def test_many_failing_samples_do_not_abort_batch(self):
+        with tmpInputFiles() as paths:
+            samples = [
+                Sample(paths.ref_out, str(paths.reads_out), paths.out_vcf, "s1"),
+                Sample(paths.ref_out, [paths.reads_out], paths.out_vcf, "s2"),
+            ]
+            results = asyncio.run(
+                run_many_async(samples, max_memory=1000, max_concurrency=1)
+            )
+
+        self.assertIsInstance(results[0].error, ValueError)
+        self.assertIn("exceeds max_memory", str(results[1].error))
+
+
 def setup_ref1() -> SeqRecords:
     chr1 = SeqRecord(
         Seq(
@@ -96,7 +521,9 @@ class TestCortexRunRef1(TestCase):
         reads: Reads = simulate_reads(self.ref, nonvars, read_len=15, fold_cov=1)
         reads.write(self.paths.reads_out)
 
-        with mock.patch("cortex.calls._make_empty_vcf") as mock_empty_vcf:
+        with mock.patch(
+            "cortex.calls._make_empty_vcf", wraps=_make_empty_vcf
+        ) as mock_empty_vcf:
             cortex_run(
                 self.paths.ref_out,
                 [self.paths.reads_out],
@@ -105,7 +532,10 @@ class TestCortexRunRef1(TestCase):
                 tmp_directory=self.paths._tmp_dir,
                 sample_name="mysample",
             )
-            mock_empty_vcf.assert_called_once_with(self.paths.out_vcf, "mysample")
+            # Made in the tmp directory, then delivered
+            mock_empty_vcf.assert_called_once_with(
+                self.paths._tmp_dir.resolve() / "empty.vcf", "mysample"
+            )
 
         # Check the vcf gets actually made
         self.setUp()
@@ -125,7 +555,9 @@ class TestCortexRunRef1(TestCase):
         reads: Reads = simulate_reads(self.ref, nonvars, read_len=40, fold_cov=30)
         reads.write(self.paths.reads_out)
 
-        with mock.patch("cortex.calls._make_empty_vcf") as mock_empty_vcf:
+        with mock.patch(
+            "cortex.calls._make_empty_vcf", wraps=_make_empty_vcf
+        ) as mock_empty_vcf:
             cortex_run(
                 self.paths.ref_out,
                 [self.paths.reads_out],
@@ -0,0 +1,35 @@
+import tempfile
+from unittest import TestCase
+from pathlib import Path
+
+from cortex.checkpoint import Checkpoints
+
+
+class TestCheckpoints(TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.tmp_dir = Path(self._tmp_dir.name)
+        self.output = self.tmp_dir / "output"
+        self.output.write_text("done")
+
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+
+    def test_marked_stage_done_with_same_fingerprint(self):
+        checkpoints = Checkpoints(self.tmp_dir)
+        self.assertFalse(checkpoints.done("index", "fp1"))
+
+        checkpoints.mark("index", "fp1", [self.output])
+        self.assertTrue(Checkpoints(self.tmp_dir).done("index", "fp1"))
+        self.assertFalse(checkpoints.done("index", "fp2"))
+
+    def test_damaged_outputs_not_done(self):
+        checkpoints = Checkpoints(self.tmp_dir)
+        checkpoints.mark("index", "fp1", [self.output])
+
+        self.output.write_text("same")
+        self.assertTrue(checkpoints.done("index", "fp1"))
+        self.output.write_text("tr")
+        self.assertFalse(checkpoints.done("index", "fp1"))
+        self.output.unlink()
+        self.assertFalse(checkpoints.done("index", "fp1"))
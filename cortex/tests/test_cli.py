@@ -0,0 +1,146 @@
+import io
+import json
+import subprocess
+import sys
+import tempfile
+from unittest import TestCase, mock
+from pathlib import Path
+
+from cortex.calls import Sample, SampleResult
+from cortex.cli import _read_manifest, _write_summary, main
+
+
+class TestManifest(TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.tmp_dir = Path(self._tmp_dir.name)
+
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+
+    def test_tsv_and_json_manifests_alike(self):
+        tsv = self.tmp_dir / "samples.tsv"
+        tsv.write_text(
+            "sample_name\treference_fasta\treads_files\toutput_vcf\n"
+            "s1\tref.fa\tr1.fq,r2.fq\ts1.vcf\n"
+        )
+        manifest = self.tmp_dir / "samples.json"
+        manifest.write_text(
+            json.dumps(
+                [
+                    {
+                        "sample_name": "s1",
+                        "reference_fasta": "ref.fa",
+                        "reads_files": ["r1.fq", "r2.fq"],
+                        "output_vcf": "s1.vcf",
+                    }
+                ]
+            )
+        )
+        expected = [
+            Sample(
+                str(self.tmp_dir / "ref.fa"),
+                [str(self.tmp_dir / "r1.fq"), str(self.tmp_dir / "r2.fq")],
+                str(self.tmp_dir / "s1.vcf"),
+                "s1",
+            )
+        ]
+        self.assertEqual(_read_manifest(tsv), expected)
+        self.assertEqual(_read_manifest(manifest), expected)
+
+    def test_incomplete_sample_rejected(self):
+        tsv = self.tmp_dir / "samples.tsv"
+        tsv.write_text("sample_name\treference_fasta\ns1\tref.fa\n")
+        with self.assertRaises(ValueError):
+            _read_manifest(tsv)
+
+
+class TestBatch(TestCase):
+    def test_summary_table(self):
+        ok = Sample("ref.fa", ["r1.fq"], "s1.vcf", "s1")
+        failed = Sample("ref.fa", ["r2.fq"], "s2.vcf", "s2")
+        report = {
+            "stages": [
+                {"wall_seconds": 1.0, "cpu_seconds": 0.5},
+                {"wall_seconds": 2.0, "cpu_seconds": 1.0},
+            ],
+            "parameters": {"mem_height": 20},
+        }
+        summary = io.StringIO()
+        _write_summary(
+            [
+                SampleResult(ok, report=report),
+                SampleResult(failed, RuntimeError("boom")),
+            ],
+            summary,
+        )
+        header, *rows = [line.split("\t") for line in summary.getvalue().splitlines()]
+        rows = [dict(zip(header, row)) for row in rows]
+        self.assertEqual(
+            [(row["sample_name"], row["outcome"]) for row in rows],
+            [("s1", "ok"), ("s2", "failed")],
+        )
+        self.assertEqual(rows[0]["wall_seconds"], "3.0")
+        self.assertEqual(rows[0]["mem_height"], "20")
+        self.assertIn("boom", rows[1]["error"])
+
+    def test_batch_exits_1_if_a_sample_failed(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            manifest = Path(tmp_dir) / "samples.tsv"
+            manifest.write_text(
+                "sample_name\treference_fasta\treads_files\toutput_vcf\n"
+                "s1\tref.fa\tr1.fq\ts1.vcf\n"
+            )
+            summary = Path(tmp_dir) / "summary.tsv"
+            with mock.patch(
+                "cortex.calls.run_many",
+                side_effect=lambda samples, *args, **kwargs: [
+                    SampleResult(sample, RuntimeError("boom")) for sample in samples
+                ],
+            ) as mock_run_many:
+                exit_code = main(
+                    ["batch", str(manifest), "--jobs", "2", "--summary", str(summary)]
+                )
+            self.assertEqual(exit_code, 1)
+            self.assertEqual(mock_run_many.call_args[0][2], 2)
+            self.assertIn("failed", summary.read_text())
+
+    def test_batch_with_result_cache_hits(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tmp_dir = Path(tmp_dir)
+            (tmp_dir / "ref.fa").write_text(">ref\nACGTACGT\n")
+            # Holds no kmer: calls need no cortex
+            (tmp_dir / "r1.fa").write_text(">read\nACGT\n")
+            manifest = tmp_dir / "samples.tsv"
+            manifest.write_text(
+                "sample_name\treference_fasta\treads_files\toutput_vcf\n"
+                "s1\tref.fa\tr1.fa\ts1.vcf\n"
+            )
+            summary = tmp_dir / "summary.tsv"
+            for _ in range(2):
+                exit_code = main(
+                    [
+                        "batch",
+                        str(manifest),
+                        "--summary",
+                        str(summary),
+                        "--result_cache",
+                        str(tmp_dir / "cache"),
+                    ]
+                )
+                self.assertEqual(exit_code, 0)
+            header, row = [
+                line.split("\t") for line in summary.read_text().splitlines()
+            ]
+            self.assertEqual(dict(zip(header, row))["outcome"], "ok")
+            self.assertTrue((tmp_dir / "s1.vcf").exists())
+
+    def test_cli_imports_lazily(self):
+        subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                "import sys, cortex.cli; assert 'cortex.calls' not in sys.modules",
+            ],
+            check=True,
+        )
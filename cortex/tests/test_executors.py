@@ -0,0 +1,77 @@
+import math
+import operator
+import tempfile
+from unittest import TestCase
+from pathlib import Path
+
+from cortex.calls import Sample, run_many
+from cortex.executors import CommandExecutor, job_states
+
+# Stands in for sbatch: runs the job in the background, printing a job id
+_FAKE_SUBMITTER = """#!/bin/sh
+log=$2
+shift 2
+sh -c "$1" > "$log" 2>&1 &
+echo 4242
+"""
+
+
+class TestCommandExecutor(TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.tmp_dir = Path(self._tmp_dir.name)
+        self.submitter = self.tmp_dir / "fake_sbatch"
+        self.submitter.write_text(_FAKE_SUBMITTER)
+        self.submitter.chmod(0o755)
+        self.shared = self.tmp_dir / "shared"
+
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+
+    def executor(self, submit_command=None, **kwargs) -> CommandExecutor:
+        if submit_command is None:
+            submit_command = f"{self.submitter} --output {{log}} {{command}}"
+        return CommandExecutor(self.shared, submit_command, poll_seconds=0.05, **kwargs)
+
+    def test_jobs_run_and_get_collected(self):
+        with self.executor() as executor:
+            added = executor.submit(operator.add, 2, 3)
+            failed = executor.submit(math.sqrt, -1)
+            self.assertEqual(added.result(timeout=30), 5)
+            self.assertIsInstance(failed.exception(timeout=30), ValueError)
+
+        states = job_states(self.shared)
+        self.assertEqual(
+            sorted(state["state"] for state in states.values()), ["done", "failed"]
+        )
+
+    def test_failed_submission_fails_its_job(self):
+        with self.executor("false") as executor:
+            future = executor.submit(operator.add, 2, 3)
+            self.assertIsNotNone(future.exception(timeout=30))
+        (state,) = job_states(self.shared).values()
+        self.assertEqual(state["state"], "failed")
+
+    def test_lost_job_times_out(self):
+        with self.executor("echo 4242", job_timeout=0.1) as executor:
+            future = executor.submit(operator.add, 2, 3)
+            self.assertIsInstance(future.exception(timeout=30), TimeoutError)
+        (state,) = job_states(self.shared).values()
+        self.assertEqual(state, {**state, "state": "submitted", "scheduler_id": "4242"})
+
+    def test_run_many_with_executor(self):
+        reference = self.tmp_dir / "ref.fa"
+        reference.write_text(">ref\nACGT\n")
+        reads = self.tmp_dir / "reads.fa"
+        reads.write_text(">read\nACGT\n")  # Holds no kmer: no need for cortex
+        samples = [
+            Sample(reference, [reads], self.tmp_dir / "out1.vcf", "s1"),
+            Sample(reference, [self.tmp_dir / "missing.fa"], self.tmp_dir / "out2.vcf"),
+        ]
+
+        with self.executor() as executor:
+            results = run_many(samples, executor=executor)
+
+        self.assertEqual([result.success for result in results], [True, False])
+        self.assertIsNotNone(results[0].report)
+        self.assertIn("#CHROM", (self.tmp_dir / "out1.vcf").read_text())
@@ -0,0 +1,89 @@
+import gzip
+import tempfile
+from unittest import TestCase, mock
+from pathlib import Path
+
+from cortex.bgzf import BgzfWriter
+from cortex.calls import _CortexCall
+from cortex.fifo import feeding
+
+_READS = b"".join(b"@read%d\nACGTACGTAC\n+\nIIIIIIIIII\n" % i for i in range(20000))
+
+
+class TestFeeding(TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.tmp_dir = Path(self._tmp_dir.name)
+
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+
+    def test_gzip_and_bgzf_files_get_fed_decompressed(self):
+        gzipped = self.tmp_dir / "reads.fq.gz"
+        # Two members, as concatenated gzip files are
+        gzipped.write_bytes(gzip.compress(_READS[:1000]) + gzip.compress(_READS[1000:]))
+        bgzipped = self.tmp_dir / "reads2.fq.gz"
+        with bgzipped.open("wb") as f:
+            writer = BgzfWriter(f)
+            writer.write(_READS)
+            writer.close()
+        fifos = {self.tmp_dir / "1.fq": gzipped, self.tmp_dir / "2.fq": bgzipped}
+
+        with feeding(fifos, inflate_workers=2):
+            for fifo_path in fifos:
+                self.assertEqual(fifo_path.read_bytes(), _READS)
+
+    def test_corrupt_file_fails(self):
+        corrupt = self.tmp_dir / "reads.fq.gz"
+        corrupt.write_bytes(gzip.compress(_READS)[:-100])
+        fifo_path = self.tmp_dir / "1.fq"
+
+        with self.assertRaises(RuntimeError):
+            with feeding({fifo_path: corrupt}):
+                fifo_path.read_bytes()
+
+    def test_unread_fifo_stops_feeding(self):
+        gzipped = self.tmp_dir / "reads.fq.gz"
+        gzipped.write_bytes(gzip.compress(_READS))
+        with feeding({self.tmp_dir / "1.fq": gzipped}):
+            pass
+
+
+class TestCortexCallDecompressReads(TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.tmp_dir = Path(self._tmp_dir.name)
+        self.reference = self.tmp_dir / "ref.fa"
+        self.reference.write_text(">ref\nACGT\n")
+        self.gzipped = self.tmp_dir / "reads1.fq.gz"
+        self.gzipped.write_bytes(gzip.compress(_READS))
+        self.plain = self.tmp_dir / "reads2.fq"
+        self.plain.write_bytes(_READS)
+
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+
+    def test_cortex_reads_gzipped_files_from_fifos(self):
+        caller = _CortexCall(self.tmp_dir / "run", 1, 10)
+        caller.make_input_files(
+            self.reference, [self.gzipped, self.plain], "sample", decompress_reads=True
+        )
+        listed = caller.reads_fofns[0].read_text().split()
+        self.assertNotEqual(listed[0], str(self.gzipped))
+        self.assertEqual(listed[1], str(self.plain))
+        self.assertIn(caller.reads_fifos, caller.input_files)
+
+        read = dict()
+
+        def fake_cortex(*args, **kwargs):
+            read.update((path, Path(path).read_bytes()) for path in listed)
+
+        with mock.patch("cortex.utils.syscall_streaming", side_effect=fake_cortex):
+            caller.execute_calls(4)
+        self.assertEqual(read, {path: _READS for path in listed})
+
+    def test_without_decompress_reads_files_are_listed(self):
+        caller = _CortexCall(self.tmp_dir / "run", 1, 10)
+        caller.make_input_files(self.reference, [self.gzipped], "sample")
+        self.assertEqual(caller.reads_fofns[0].read_text().split(), [str(self.gzipped)])
+        self.assertNotIn(caller.reads_fifos, caller.input_files)
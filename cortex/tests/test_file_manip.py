@@ -0,0 +1,64 @@
+import gzip
+import tempfile
+from unittest import TestCase
+from pathlib import Path
+
+from cortex.file_manip import iter_calls
+
+_VCF = (
+    "##fileformat=VCFv4.2\n"
+    "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tsample\n"
+    "ref1\t10\tvar1\tA\tG\t.\tPASS\tSVLEN=0\tGT:COV:GT_CONF\t1/1:0,12:40.5\n"
+    "ref1\t20\tvar2\tACGT\tA,AC\t30\tMAPQ\tSVLEN=-3\tGT:COV:GT_CONF\t0/0:9,0:3.1\n"
+    "ref2\t5\tvar3\tC\tT\t50.5\tPASS\tSVLEN=0\tGT:COV:GT_CONF\t1/1:0,7:20.0\n"
+)
+
+
+class TestIterCalls(TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.vcf = Path(self._tmp_dir.name) / "calls.vcf"
+        self.vcf.write_text(_VCF)
+
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+
+    def test_records_parsed(self):
+        calls = list(iter_calls(self.vcf))
+        self.assertEqual([call.id for call in calls], ["var1", "var2", "var3"])
+        call = calls[1]
+        self.assertEqual((call.chrom, call.pos, call.ref), ("ref1", 20, "ACGT"))
+        self.assertEqual(call.alt, ["A", "AC"])
+        self.assertEqual((call.qual, call.filter), (30.0, "MAPQ"))
+        self.assertEqual(call.genotype(), "0/0")
+        self.assertEqual(call.sample_values()["COV"], "9,0")
+        self.assertIsNone(calls[0].qual)
+
+    def test_gzipped_vcf_supported(self):
+        gzipped = self.vcf.with_suffix(".vcf.gz")
+        with gzip.open(gzipped, "wt") as f:
+            f.write(_VCF)
+        self.assertEqual(len(list(iter_calls(gzipped))), 3)
+
+    def test_filters_combine(self):
+        def ids(**kwargs):
+            return [call.id for call in iter_calls(self.vcf, **kwargs)]
+
+        self.assertEqual(ids(filter="PASS"), ["var1", "var3"])
+        self.assertEqual(ids(filter={"PASS", "MAPQ"}), ["var1", "var2", "var3"])
+        self.assertEqual(ids(min_qual=40), ["var3"])
+        self.assertEqual(
+            ids(predicate=lambda call: call.genotype() == "1/1"), ["var1", "var3"]
+        )
+        self.assertEqual(ids(filter="PASS", region="ref1"), ["var1"])
+
+    def test_region_overlap(self):
+        def ids(region):
+            return [call.id for call in iter_calls(self.vcf, region=region)]
+
+        self.assertEqual(ids("ref1:11-22"), ["var2"])
+        # var2's REF spans 20-23
+        self.assertEqual(ids("ref1:23"), ["var2"])
+        self.assertEqual(ids("ref1:1,000"), [])
+        self.assertEqual(ids(("ref2", 1, 5)), ["var3"])
+        self.assertEqual(ids("ref"), [])
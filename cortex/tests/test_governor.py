@@ -0,0 +1,154 @@
+import asyncio
+import json
+import subprocess
+import tempfile
+from unittest import TestCase, mock
+from pathlib import Path
+
+from cortex.calls import run as cortex_run, run_async
+from cortex.governor import GovernorTimeout, NodeGovernor
+from cortex.memory import hash_table_bytes
+
+
+class TestNodeGovernor(TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.tmp_dir = Path(self._tmp_dir.name)
+        self.directory = self.tmp_dir / "governor"
+
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+
+    def governor(self, **kwargs) -> NodeGovernor:
+        return NodeGovernor(self.directory, poll_seconds=0.01, **kwargs)
+
+    def test_reservations_wait_until_they_fit(self):
+        governor = self.governor(max_memory=100, timeout=0.05)
+        with governor.reserve(60):
+            self.assertEqual(len(governor.reservations()), 1)
+            with governor.reserve(40):
+                with self.assertRaises(GovernorTimeout):
+                    with governor.reserve(1):
+                        pass
+        self.assertEqual(governor.reservations(), [])
+        with governor.reserve(100):
+            pass
+
+    def test_reservation_over_max_memory_fails(self):
+        with self.assertRaises(ValueError):
+            with self.governor(max_memory=100).reserve(101):
+                pass
+
+    def test_max_jobs(self):
+        governor = self.governor(max_memory=100, max_jobs=1, timeout=0.05)
+        with governor.reserve(1):
+            with self.assertRaises(GovernorTimeout):
+                with governor.reserve(1):
+                    pass
+
+    def test_first_come_first_served(self):
+        governor = self.governor(max_memory=100)
+        with governor.reserve(60):
+            large = governor._enqueue(60)
+            small = governor._enqueue(10)
+            # Would fit, but queues behind the large one
+            self.assertFalse(governor._try_admit(small))
+            self.assertFalse(governor._try_admit(large))
+        self.assertTrue(governor._try_admit(large))
+        self.assertTrue(governor._try_admit(small))
+
+    def test_reservations_of_dead_processes_get_reclaimed(self):
+        governor = self.governor(max_memory=100, timeout=0.05)
+        process = subprocess.Popen(["true"])
+        process.wait()
+        self.directory.mkdir()
+        (self.directory / "ledger.json").write_text(
+            json.dumps(
+                [
+                    {
+                        "ticket": "dead",
+                        "pid": process.pid,
+                        "start_time": None,
+                        "memory": 100,
+                        "admitted": True,
+                        "enqueued": 0,
+                    }
+                ]
+            )
+        )
+        with governor.reserve(100):
+            self.assertEqual(len(governor.reservations()), 1)
+
+    def test_reserve_async(self):
+        governor = self.governor(max_memory=100)
+
+        async def hold(memory_bytes: int, admitted: list):
+            async with governor.reserve_async(memory_bytes):
+                admitted.append(memory_bytes)
+                await asyncio.sleep(0.05)
+
+        async def main():
+            admitted = list()
+            await asyncio.gather(hold(60, admitted), hold(60, admitted))
+            return admitted
+
+        self.assertEqual(asyncio.run(main()), [60, 60])
+        self.assertEqual(governor.reservations(), [])
+
+
+class TestRunWithGovernor(TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.tmp_dir = Path(self._tmp_dir.name)
+        self.reference = self.tmp_dir / "ref.fa"
+        self.reference.write_text(">ref\nACGT\n")
+        self.reads = self.tmp_dir / "reads.fa"
+        self.reads.write_text(">read\n" + "ACGT" * 10 + "\n")
+        self.governor = NodeGovernor(self.tmp_dir / "governor")
+
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+
+    def check_reserved(self, *args):
+        (reservation,) = self.governor.reservations()
+        self.assertTrue(reservation["admitted"])
+        self.assertEqual(reservation["memory"], hash_table_bytes(12, 100))
+
+    def test_run_reserves_memory_for_calls(self):
+        with mock.patch("cortex.calls._CortexCall.make_index"), mock.patch(
+            "cortex.calls._CortexCall.execute_calls", side_effect=self.check_reserved
+        ) as mock_execute_calls:
+            report = cortex_run(
+                self.reference,
+                [self.reads],
+                self.tmp_dir / "out.vcf",
+                mem_height=10,
+                max_mem_height=12,
+                governor=self.governor,
+            )
+
+        mock_execute_calls.assert_called_once()
+        self.assertIn("admission", [stage.name for stage in report.stages])
+        self.assertEqual(self.governor.reservations(), [])
+
+    def test_run_async_reserves_memory_for_calls(self):
+        async def execute_calls_async(*args):
+            self.check_reserved()
+
+        with mock.patch("cortex.calls._CortexCall.make_index_async"), mock.patch(
+            "cortex.calls._CortexCall.execute_calls_async",
+            side_effect=execute_calls_async,
+        ) as mock_execute_calls:
+            asyncio.run(
+                run_async(
+                    self.reference,
+                    [self.reads],
+                    self.tmp_dir / "out.vcf",
+                    mem_height=10,
+                    max_mem_height=12,
+                    governor=self.governor,
+                )
+            )
+
+        mock_execute_calls.assert_called_once()
+        self.assertEqual(self.governor.reservations(), [])
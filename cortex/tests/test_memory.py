@@ -0,0 +1,132 @@
+import gzip
+import hashlib
+import random
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+from pathlib import Path
+
+from cortex.memory import (
+    MemHeightHistory,
+    _HyperLogLog,
+    _canonical_kmers,
+    estimate_distinct_kmers,
+    hash_table_bytes,
+    mem_height_for,
+)
+
+
+class TestHashTableBytes(TestCase):
+    def test_grows_with_height_and_width(self):
+        self.assertEqual(hash_table_bytes(3, 100), 2 * hash_table_bytes(2, 100))
+        self.assertEqual(hash_table_bytes(2, 100), 2 * hash_table_bytes(2, 50))
+
+
+def _hash(value: int) -> int:
+    digest = hashlib.blake2b(str(value).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+class TestHyperLogLog(TestCase):
+    def test_estimate_within_few_percent(self):
+        hll = _HyperLogLog()
+        for value in range(50000):
+            # Duplicates must not count
+            for _ in range(2):
+                hll.add(_hash(value))
+        self.assertAlmostEqual(hll.cardinality(), 50000, delta=2500)
+
+    def test_small_cardinality_close_to_exact(self):
+        hll = _HyperLogLog()
+        for value in range(10):
+            hll.add(_hash(value))
+        self.assertAlmostEqual(hll.cardinality(), 10, delta=1)
+
+
+class TestCanonicalKmers(TestCase):
+    def test_kmer_and_reverse_complement_are_the_same(self):
+        forward = list(_canonical_kmers(b"AACGTT", 3))
+        reverse = list(
+            _canonical_kmers(
+                b"AACGTT"[::-1].translate(bytes.maketrans(b"ACGT", b"TGCA")), 3
+            )
+        )
+        self.assertEqual(sorted(forward), sorted(reverse))
+        self.assertEqual(forward, [b"AAC", b"ACG", b"ACG", b"AAC"])
+
+    def test_non_acgt_breaks_kmers(self):
+        self.assertEqual(list(_canonical_kmers(b"AAANAAA", 3)), [b"AAA", b"AAA"])
+
+
+class TestEstimateDistinctKmers(TestCase):
+    def test_reads_and_reference_counted_together(self):
+        random.seed(1)
+        genome = "".join(random.choices("ACGT", k=2000))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            reference = Path(tmp_dir) / "ref.fa"
+            reference.write_text(f">ref\n{genome[:1000]}\n{genome[1000:]}\n")
+            reads = Path(tmp_dir) / "reads.fq.gz"
+            with gzip.open(reads, "wt") as f:
+                for start in range(0, 1900, 50):
+                    read = genome[start : start + 100]
+                    print("@read", read, "+", "I" * len(read), sep="\n", file=f)
+
+            estimate = estimate_distinct_kmers([reference, reads], 31)
+        self.assertAlmostEqual(estimate, 2000 - 30, delta=100)
+
+    def test_large_inputs_get_sampled(self):
+        random.seed(2)
+        genome = "".join(random.choices("ACGT", k=200_000))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            reference = Path(tmp_dir) / "ref.fa"
+            reference.write_text(f">ref\n{genome}\n")
+            reads = Path(tmp_dir) / "reads.fa"
+            with reads.open("w") as f:
+                for start in range(0, len(genome) - 100, 50):
+                    # Reads of either strand: sampling must pick both alike
+                    read = genome[start : start + 100]
+                    if start % 100:
+                        read = read[::-1].translate(str.maketrans("ACGT", "TGCA"))
+                    print(">read", read, sep="\n", file=f)
+
+            estimate = estimate_distinct_kmers(
+                [reference, reads], 31, max_hashed_kmers=20_000
+            )
+        self.assertAlmostEqual(estimate, len(genome) - 30, delta=len(genome) * 0.15)
+
+
+class TestMemHeightFor(TestCase):
+    def test_smallest_height_under_load_factor(self):
+        self.assertEqual(mem_height_for(100 * 0.5 * 2**10, 100, load_factor=0.5), 10)
+        self.assertEqual(mem_height_for(100 * 0.5 * 2**10 + 1, 100, 0.5), 11)
+        self.assertEqual(mem_height_for(0, 100), 1)
+
+
+class TestMemHeightHistory(TestCase):
+    def test_concurrent_records_all_kept(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tmp_dir = Path(tmp_dir)
+            references = list()
+            for index in range(8):
+                reference = tmp_dir / f"ref{index}.fa"
+                reference.write_text(f">ref\n{'ACGT' * (index + 1)}\n")
+                references.append(reference)
+            reads = tmp_dir / "reads.fa"
+            reads.write_text(">read\nACGT\n")
+            history = MemHeightHistory(tmp_dir / "mem_heights.json")
+
+            with ThreadPoolExecutor(8) as pool:
+                list(
+                    pool.map(
+                        lambda index: history.record(
+                            references[index], [reads], 10 + index
+                        ),
+                        range(8),
+                    )
+                )
+
+            self.assertEqual(
+                [history.get(reference, [reads]) for reference in references],
+                list(range(10, 18)),
+            )
+            self.assertEqual(list(tmp_dir.glob(".*.tmp")), [])
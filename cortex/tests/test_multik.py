@@ -0,0 +1,77 @@
+import tempfile
+from unittest import TestCase, mock
+from pathlib import Path
+
+from cortex.calls import run_multi_k
+from cortex.multik import check_kmer_sizes, merge_kmer_vcfs
+
+_HEADER = "##fileformat=VCFv4.2\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n"
+
+
+class TestCheckKmerSizes(TestCase):
+    def test_repeats_dropped(self):
+        self.assertEqual(check_kmer_sizes([31, 61, 31]), [31, 61])
+
+    def test_invalid_kmer_sizes_rejected(self):
+        for kmer_sizes in ([], [30], [65], [1]):
+            with self.assertRaises(ValueError):
+                check_kmer_sizes(kmer_sizes)
+
+
+class TestMergeKmerVcfs(TestCase):
+    def test_calls_merged_sorted_and_deduplicated(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tmp_dir = Path(tmp_dir)
+            k31, k61 = tmp_dir / "k31.vcf", tmp_dir / "k61.vcf"
+            k31.write_text(
+                _HEADER
+                + "chr2\t10\tvar_1\tA\tG\t.\tPASS\tK31\n"
+                + "chr1\t50\tvar_2\tC\tT\t.\tPASS\tK31\n"
+            )
+            k61.write_text(
+                _HEADER
+                + "chr1\t20\tvar_1\tG\tGA\t.\tPASS\tK61\n"
+                + "chr2\t10\tvar_2\tA\tG\t.\tPASS\tK61\n"
+            )
+            merged = tmp_dir / "merged.vcf"
+            merge_kmer_vcfs([(31, k31), (61, k61)], merged, "sample", ["chr1", "chr2"])
+
+            self.assertEqual(
+                merged.read_text(),
+                _HEADER
+                + "chr1\t20\tk61_var_1\tG\tGA\t.\tPASS\tK61\n"
+                + "chr1\t50\tk31_var_2\tC\tT\t.\tPASS\tK31\n"
+                + "chr2\t10\tk31_var_1\tA\tG\t.\tPASS\tK31\n",
+            )
+
+
+class TestRunMultiK(TestCase):
+    def test_kmer_sizes_called_and_merged(self):
+        def fake_calls(caller, *args, **kwargs):
+            vcf = caller.output_directory / "vcfs" / "sample_wk_FINAL_raw.vcf"
+            vcf.parent.mkdir(parents=True)
+            vcf.write_text(
+                _HEADER + f"ref\t{caller.kmer_size}\tvar_1\tA\tG\t.\tPASS\t.\n"
+            )
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tmp_dir = Path(tmp_dir)
+            reference, reads = tmp_dir / "ref.fa", tmp_dir / "reads.fa"
+            reference.write_text(">ref\n" + "ACGT" * 25 + "\n")
+            # Too short for k=61: only k=31 and k=39 get called
+            reads.write_text(">read\n" + "ACGT" * 10 + "\n")
+            output = tmp_dir / "out.vcf"
+            with mock.patch("cortex.calls._CortexCall.make_index"), mock.patch(
+                "cortex.calls._CortexCall.execute_calls",
+                autospec=True,
+                side_effect=fake_calls,
+            ) as mock_execute_calls:
+                run_multi_k(reference, [reads], output, kmer_sizes=[31, 39, 61])
+
+            self.assertEqual(mock_execute_calls.call_count, 2)
+            positions = [
+                line.split("\t")[1]
+                for line in output.read_text().splitlines()
+                if not line.startswith("#")
+            ]
+            self.assertEqual(positions, ["31", "39"])
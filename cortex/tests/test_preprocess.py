@@ -0,0 +1,62 @@
+import gzip
+import random
+import tempfile
+from unittest import TestCase
+from pathlib import Path
+
+from cortex.preprocess import (
+    ReadsPreprocessing,
+    output_paths,
+    preprocess_reads,
+)
+from cortex.reads import iter_records
+
+
+class TestPreprocessReads(TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.tmp_dir = Path(self._tmp_dir.name)
+
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+
+    def test_low_quality_ends_trimmed_and_short_reads_dropped(self):
+        reads = self.tmp_dir / "reads.fq"
+        reads.write_text(
+            "@trimmed\nAACCCCCCGG\n+\n%&IIIII#I&\n"
+            "@too_short\nACGTAC\n+\nI$IIII\n"
+            "@kept\nACGTACGT\n+\nIIIIIIII\n"
+        )
+        (output,) = output_paths([reads], self.tmp_dir / "out")
+        self.assertEqual(output.name, "reads_0.fq.gz")
+
+        stats = preprocess_reads(
+            [reads], [output], ReadsPreprocessing(), 7, 5, genome_size=100
+        )
+        records = list(iter_records(output))
+        self.assertEqual(
+            [(record.name, record.sequence, record.qualities) for record in records],
+            [(b"trimmed", b"CCCCCCG", b"IIIII#I"), (b"kept", b"ACGTACGT", b"IIIIIIII")],
+        )
+        self.assertEqual(stats.reads_in, 3)
+        self.assertEqual(stats.reads_out, 2)
+        self.assertEqual(stats.bases_removed, 24 - 15)
+
+    def test_subsampled_to_target_coverage(self):
+        rng = random.Random(0)
+        reads = self.tmp_dir / "reads.fa.gz"
+        with gzip.open(reads, "wt") as f:
+            for i in range(2000):
+                f.write(f">r{i}\n{''.join(rng.choice('ACGT') for _ in range(100))}\n")
+        (output,) = output_paths([reads], self.tmp_dir / "out")
+        self.assertEqual(output.name, "reads_0.fa.gz")
+
+        # 200,000 bases over a 1000 base genome: 200x down to 20x
+        stats = preprocess_reads(
+            [reads], [output], ReadsPreprocessing(target_coverage=20), 31, 5, 1000
+        )
+        self.assertAlmostEqual(stats.bases_out, 20000, delta=3000)
+        self.assertEqual(
+            sum(len(record.sequence) for record in iter_records(output)),
+            stats.bases_out,
+        )
@@ -0,0 +1,35 @@
+import gzip
+import tempfile
+from unittest import TestCase
+from pathlib import Path
+
+from cortex.reads import ReadsProfile, profile_reads_files
+
+
+class TestProfileReads(TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.tmp_dir = Path(self._tmp_dir.name)
+
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+
+    def test_reads_files_profiled_together(self):
+        fastq = self.tmp_dir / "reads.fq"
+        fastq.write_text("@r1\nACGTACGT\n+\nIIIIIIII\n@r2\nACGT\n+\nIIII\n")
+        fasta = self.tmp_dir / "reads.fa.gz"
+        with gzip.open(fasta, "wt") as f:
+            f.write(">r3\nACGTAC\nGTACGT\n")
+
+        profile = profile_reads_files([fastq, fasta])
+        self.assertEqual(profile, ReadsProfile(reads=3, bases=24, max_read_len=12))
+        self.assertEqual(profile.mean_read_len, 8)
+
+    def test_truncated_gzip_file_fails(self):
+        reads = self.tmp_dir / "reads.fq.gz"
+        with gzip.open(reads, "wt") as f:
+            f.write("@r1\nACGTACGT\n+\nIIIIIIII\n" * 1000)
+        reads.write_bytes(reads.read_bytes()[:-20])
+
+        with self.assertRaises(ValueError):
+            profile_reads_files([reads])
@@ -0,0 +1,51 @@
+import json
+import subprocess
+import tempfile
+from unittest import TestCase
+from pathlib import Path
+
+from cortex.report import RunReport
+
+
+class TestRunReport(TestCase):
+    def test_stages_recorded_in_order(self):
+        report = RunReport()
+        with report.stage("first"):
+            subprocess.run(["true"])
+        with self.assertRaises(ValueError):
+            with report.stage("failing"):
+                raise ValueError()
+
+        self.assertEqual([stage.name for stage in report.stages], ["first", "failing"])
+        self.assertTrue(all(stage.wall_seconds >= 0 for stage in report.stages))
+
+    def test_peak_tmp_directory_usage(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            report = RunReport()
+            report.watch_tmp_directory(Path(tmp_dir))
+            with report.stage("write"):
+                (Path(tmp_dir) / "big").write_bytes(b"x" * 1000)
+            with report.stage("delete"):
+                (Path(tmp_dir) / "big").unlink()
+            report.stop()
+        self.assertEqual(report.peak_tmp_directory_bytes, 1000)
+
+    def test_exports(self):
+        report = RunReport()
+        report.parameters["ploidy"] = 2
+        report.input_sizes["ref.fa"] = 10
+        with report.stage("index"):
+            pass
+
+        as_dict = json.loads(report.to_json())
+        self.assertEqual(as_dict["parameters"], {"ploidy": 2})
+        self.assertEqual(as_dict["stages"][0]["name"], "index")
+
+        prometheus = report.to_prometheus(labels={"sample": 's"1'})
+        self.assertIn(
+            'py_cortex_input_bytes{file="ref.fa",sample="s\\"1"} 10', prometheus
+        )
+        self.assertIn(
+            'py_cortex_stage_wall_seconds{sample="s\\"1",stage="index"}', prometheus
+        )
+        self.assertIn("# TYPE py_cortex_peak_tmp_directory_bytes gauge", prometheus)
@@ -0,0 +1,63 @@
+import json
+import os
+import subprocess
+import tempfile
+from unittest import TestCase
+from pathlib import Path
+
+from cortex.scratch import (
+    ScratchPolicy,
+    make_scratch_directory,
+    remove_in_background,
+    sweep_orphans,
+)
+
+
+class TestScratch(TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.tmp_dir = Path(self._tmp_dir.name)
+        self.fast = self.tmp_dir / "fast"
+        self.fast.mkdir()
+        self.disk = self.tmp_dir / "disk"
+        self.disk.mkdir()
+
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+
+    def test_preferred_directory_used_if_space_left(self):
+        policy = ScratchPolicy(
+            preferred_directories=[self.tmp_dir / "missing", self.fast],
+            fallback_directory=self.disk,
+        )
+        scratch = make_scratch_directory(policy, estimated_bytes=1)
+        self.assertEqual(scratch.parent, self.fast)
+
+        scratch = make_scratch_directory(policy, estimated_bytes=2**80)
+        self.assertEqual(scratch.parent, self.disk)
+
+    def test_background_removal(self):
+        scratch = make_scratch_directory(
+            ScratchPolicy(preferred_directories=[self.fast]), 0
+        )
+        (scratch / "output").write_text("calls")
+        thread = remove_in_background(scratch)
+        self.assertFalse(scratch.exists())
+        thread.join()
+        self.assertEqual(list(self.fast.iterdir()), [])
+
+    def test_sweep_removes_directories_of_dead_processes(self):
+        policy = ScratchPolicy(preferred_directories=[self.fast])
+        alive = make_scratch_directory(policy, 0)
+        dead = make_scratch_directory(policy, 0)
+        process = subprocess.Popen(["true"])
+        process.wait()
+        owner_file = dead / ".py-cortex-owner"
+        owner = json.loads(owner_file.read_text())
+        owner_file.write_text(json.dumps({**owner, "pid": process.pid}))
+        (self.fast / "not_ours").mkdir()
+
+        self.assertEqual(sweep_orphans([self.fast]), [dead])
+        self.assertEqual(
+            sorted(os.listdir(self.fast)), sorted([alive.name, "not_ours"])
+        )
@@ -0,0 +1,104 @@
+import asyncio
+import tempfile
+import threading
+import time
+from unittest import TestCase, mock
+from pathlib import Path
+
+from cortex.report import RunReport
+from cortex.server import Client, JobFailed, Server
+
+
+async def _fake_run_async(
+    reference_fasta, reads_files, output_vcf_file_path, on_progress=None, **kwargs
+):
+    if reference_fasta.endswith("bad.fa"):
+        raise RuntimeError("Error in system call. Cannot continue")
+    if reference_fasta.endswith("slow.fa"):
+        await asyncio.sleep(60)
+    on_progress("building", "Building graph")
+    Path(output_vcf_file_path).write_text("##fileformat=VCFv4.2\n")
+    return RunReport()
+
+
+class TestServer(TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.tmp_dir = Path(self._tmp_dir.name)
+        socket_path = self.tmp_dir / "cortex.sock"
+        self.patcher = mock.patch("cortex.calls.run_async", _fake_run_async)
+        self.patcher.start()
+        self.server = Server(socket_path, max_jobs=1)
+        self.thread = threading.Thread(target=asyncio.run, args=(self.server.serve(),))
+        self.thread.start()
+        while not socket_path.exists():
+            time.sleep(0.01)
+        self.client = Client(socket_path)
+
+    def tearDown(self):
+        self.client.shutdown()
+        self.thread.join()
+        self.patcher.stop()
+        self._tmp_dir.cleanup()
+
+    def _submit(self, reference: str) -> str:
+        return self.client.submit(
+            self.tmp_dir / reference,
+            [self.tmp_dir / "reads.fq"],
+            self.tmp_dir / "out.vcf",
+        )
+
+    def test_job_runs_and_streams_status(self):
+        job_id = self._submit("ref.fa")
+        events = list(self.client.watch(job_id))
+        self.assertEqual(
+            [(event["state"], event.get("stage")) for event in events],
+            [
+                ("queued", None),
+                ("running", None),
+                ("running", "building"),
+                ("done", None),
+            ],
+        )
+        self.assertEqual(self.client.wait(job_id)["state"], "done")
+        self.assertTrue((self.tmp_dir / "out.vcf").exists())
+
+    def test_failed_job_raises_on_wait(self):
+        job_id = self._submit("bad.fa")
+        with self.assertRaises(JobFailed):
+            self.client.wait(job_id)
+
+    def test_jobs_queue_beyond_limit_and_cancel(self):
+        slow_id = self._submit("slow.fa")
+        queued_id = self._submit("ref.fa")
+        states = {job["job_id"]: job["state"] for job in self.client.jobs()}
+        self.assertEqual(states[queued_id], "queued")
+
+        self.client.cancel(slow_id)
+        self.assertEqual(self.client.wait(queued_id)["state"], "done")
+        self.assertEqual(self.client.status(slow_id)["state"], "cancelled")
+
+    def test_finished_jobs_get_dropped(self):
+        self.server.max_finished_jobs = 1
+        first_id = self._submit("ref.fa")
+        self.client.wait(first_id)
+        second_id = self._submit("ref.fa")
+        self.client.wait(second_id)
+        self.assertEqual([job["job_id"] for job in self.client.jobs()], [second_id])
+        with self.assertRaises(ValueError):
+            self.client.status(first_id)
+
+        self.client.forget(second_id)
+        self.assertEqual(self.client.jobs(), [])
+
+    def test_unfinished_job_not_forgotten(self):
+        slow_id = self._submit("slow.fa")
+        with self.assertRaises(ValueError):
+            self.client.forget(slow_id)
+        self.client.cancel(slow_id)
+
+    def test_bad_request_rejected(self):
+        with self.assertRaises(ValueError):
+            self.client.submit("ref.fa", ["reads.fq"], "out.vcf", threads=4)
+        with self.assertRaises(ValueError):
+            self.client.status("404")
@@ -0,0 +1,224 @@
+import random
+import tempfile
+from unittest import TestCase, mock
+from pathlib import Path
+
+from cortex.calls import SampleResult, run_sharded
+from cortex.sharding import (
+    Shard,
+    make_shards,
+    merge_shard_vcfs,
+    write_shard_inputs,
+)
+from cortex.utils import FaiRecord
+
+_HEADER = (
+    b"##fileformat=VCFv4.2\n"
+    b"#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tsample\n"
+)
+
+
+def _call(chrom: str, pos: int, alt: str = "G") -> bytes:
+    return f"{chrom}\t{pos}\tvar\tA\t{alt}\t.\tPASS\t.\tGT\t1\n".encode()
+
+
+def _random_seq(length: int, rng: random.Random) -> str:
+    return "".join(rng.choice("ACGT") for _ in range(length))
+
+
+class TestMakeShards(TestCase):
+    def test_one_shard_per_sequence_by_default(self):
+        records = [FaiRecord("a", 100, 3, 60, 61), FaiRecord("b", 50, 110, 60, 61)]
+        self.assertEqual(
+            make_shards(records), [Shard("a", 0, 100, 0, 100), Shard("b", 0, 50, 0, 50)]
+        )
+
+    def test_windows_overlap_and_own_disjoint_ranges(self):
+        shards = make_shards([FaiRecord("a", 100, 3, 60, 61)], 40, 10)
+        self.assertEqual(
+            [(shard.start, shard.end) for shard in shards],
+            [(0, 40), (30, 70), (60, 100)],
+        )
+        self.assertEqual(
+            [(shard.own_start, shard.own_end) for shard in shards],
+            [(0, 35), (35, 65), (65, 100)],
+        )
+
+    def test_overlap_must_be_less_than_window(self):
+        with self.assertRaises(ValueError):
+            make_shards([FaiRecord("a", 100, 3, 60, 61)], 40, 40)
+
+
+class TestWriteShardInputs(TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.tmp_dir = Path(self._tmp_dir.name)
+
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+
+    def test_reads_routed_to_shards_sharing_kmers(self):
+        rng = random.Random(1)
+        seqs = {"a": _random_seq(2000, rng), "b": _random_seq(1000, rng)}
+        reference = self.tmp_dir / "ref.fa"
+        reference.write_text("".join(f">{name}\n{seq}\n" for name, seq in seqs.items()))
+        reads = self.tmp_dir / "reads.fq"
+        reads.write_text(
+            f"@from_a_start\n{seqs['a'][100:200]}\n+\n{'I' * 100}\n"
+            f"@from_a_overlap\n{seqs['a'][950:1050]}\n+\n{'I' * 100}\n"
+            f"@from_b\n{seqs['b'][500:600]}\n+\n{'I' * 100}\n"
+            f"@unrelated\n{_random_seq(100, rng)}\n+\n{'I' * 100}\n"
+        )
+
+        shards = make_shards(
+            [
+                FaiRecord("a", 2000, 3, 2000, 2001),
+                FaiRecord("b", 1000, 2007, 1000, 1001),
+            ],
+            window_size=1200,
+            overlap=400,
+        )
+        shard_inputs = write_shard_inputs(
+            reference, [reads], shards, self.tmp_dir / "shards", 31
+        )
+
+        self.assertEqual(
+            [
+                inputs.reference_fasta.read_text().replace("\n", "")
+                for inputs in shard_inputs
+            ],
+            [">a" + seqs["a"][:1200], ">a" + seqs["a"][800:], ">b" + seqs["b"]],
+        )
+        routed = [
+            [
+                line
+                for reads_file in inputs.reads_files
+                for line in reads_file.read_text().splitlines()
+                if line.startswith("@")
+            ]
+            for inputs in shard_inputs
+        ]
+        self.assertEqual(
+            routed,
+            [["@from_a_start", "@from_a_overlap"], ["@from_a_overlap"], ["@from_b"]],
+        )
+
+    def test_read_of_repeat_across_index_pieces_written_once(self):
+        rng = random.Random(3)
+        repeat = _random_seq(100, rng)
+        # The repeat's copies 2016 bases apart: the same kmers of both get indexed
+        sequence = repeat + _random_seq(1916, rng) + repeat
+        reference = self.tmp_dir / "ref.fa"
+        reference.write_text(f">a\n{sequence}\n")
+        reads = self.tmp_dir / "reads.fa"
+        reads.write_text(f">from_repeat\n{repeat}\n")
+
+        shards = make_shards([FaiRecord("a", len(sequence), 3, len(sequence), 0)])
+        with mock.patch("cortex.sharding._PIECE_KMERS", 10):
+            (inputs,) = write_shard_inputs(
+                reference, [reads], shards, self.tmp_dir / "shards", 31
+            )
+
+        self.assertEqual(
+            [reads_file.read_text() for reads_file in inputs.reads_files],
+            [f">from_repeat\n{repeat}\n"],
+        )
+
+    def test_reads_files_routed_in_parallel(self):
+        rng = random.Random(2)
+        seqs = {"a": _random_seq(1000, rng), "b": _random_seq(1000, rng)}
+        reference = self.tmp_dir / "ref.fa"
+        reference.write_text("".join(f">{name}\n{seq}\n" for name, seq in seqs.items()))
+        reads_files = [self.tmp_dir / "reads1.fa", self.tmp_dir / "reads2.fq"]
+        reads_files[0].write_text(f">from_b\n{seqs['b'][:100]}\n")
+        reads_files[1].write_text(f"@from_a\n{seqs['a'][:100]}\n+\n{'I' * 100}\n")
+
+        shards = make_shards(
+            [
+                FaiRecord("a", 1000, 3, 1000, 1001),
+                FaiRecord("b", 1000, 1007, 1000, 1001),
+            ]
+        )
+        shard_inputs = write_shard_inputs(
+            reference, reads_files, shards, self.tmp_dir / "shards", 31, max_workers=2
+        )
+
+        self.assertEqual(
+            [
+                [reads_file.name for reads_file in inputs.reads_files]
+                for inputs in shard_inputs
+            ],
+            [["reads_1.fq"], ["reads_0.fa"]],
+        )
+
+
+class TestMergeShardVcfs(TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.tmp_dir = Path(self._tmp_dir.name)
+
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+
+    def _write_vcf(self, name: str, calls) -> Path:
+        vcf = self.tmp_dir / name
+        vcf.write_bytes(_HEADER + b"".join(calls))
+        return vcf
+
+    def test_calls_merged_sorted_from_owning_shard(self):
+        shards = make_shards([FaiRecord("a", 100, 3, 60, 61)], 40, 10)
+        vcfs = [
+            # Positions within each window, 1-based; unsorted in the second window
+            self._write_vcf("0.vcf", [_call("a", 5), _call("a", 34), _call("a", 36)]),
+            self._write_vcf("1.vcf", [_call("a", 30), _call("a", 6), _call("a", 4)]),
+            self._write_vcf("2.vcf", [_call("a", 1), _call("a", 10), _call("a", 40)]),
+        ]
+        merged = self.tmp_dir / "merged.vcf"
+        merge_shard_vcfs(list(zip(shards, vcfs)), merged, "sample")
+
+        self.assertEqual(
+            merged.read_bytes(),
+            _HEADER + b"".join(_call("a", pos) for pos in (5, 34, 36, 60, 70, 100)),
+        )
+
+    def test_no_shards_makes_empty_vcf(self):
+        merged = self.tmp_dir / "merged.vcf"
+        merge_shard_vcfs([], merged, "sample")
+        self.assertTrue(merged.read_text().startswith("##fileformat=VCF"))
+
+
+class TestRunSharded(TestCase):
+    def test_shards_called_and_merged(self):
+        rng = random.Random(2)
+        seq = _random_seq(3000, rng)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tmp_dir = Path(tmp_dir)
+            reference = tmp_dir / "ref.fa"
+            reference.write_text(f">a\n{seq}\n")
+            reads = tmp_dir / "reads.fa"
+            reads.write_text(f">r1\n{seq[100:200]}\n>r2\n{seq[2800:2900]}\n")
+            output_vcf = tmp_dir / "out.vcf"
+
+            def fake_run_many(samples, *args, **kwargs):
+                # A call at position 100 of each window
+                for sample in samples:
+                    Path(sample.output_vcf_file_path).write_bytes(
+                        _HEADER + _call("a", 100)
+                    )
+                return [SampleResult(sample) for sample in samples]
+
+            with mock.patch("cortex.calls.run_many", side_effect=fake_run_many) as m:
+                run_sharded(
+                    reference,
+                    [reads],
+                    output_vcf,
+                    window_size=1000,
+                    overlap=100,
+                    tmp_directory=tmp_dir / "cortex",
+                )
+            # Windows at 0, 900, 1800 (no reads: skipped) and 2700
+            self.assertEqual(len(m.call_args[0][0]), 2)
+            self.assertEqual(
+                output_vcf.read_bytes(), _HEADER + _call("a", 100) + _call("a", 2800)
+            )
+            self.assertFalse((tmp_dir / "cortex").exists())
@@ -0,0 +1,109 @@
+import gzip
+import tempfile
+from unittest import TestCase, skipUnless
+from pathlib import Path
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+else:
+    from cortex.tests.simulate_stream import (
+        ErrorModel,
+        apply_variants,
+        random_snps,
+        simulate_genomes,
+        stream_reads,
+        write_fasta,
+    )
+
+from cortex.reads import iter_sequences
+from cortex.tests.simulate_seqs import Variant
+from cortex.utils import get_fai_records
+
+
+@skipUnless(np is not None, "requires numpy")
+class TestSimulateGenomes(TestCase):
+    def test_seeded_reproducible(self):
+        first = simulate_genomes(["r1", "r2"], [100, 50], np.random.default_rng(1))
+        second = simulate_genomes(["r1", "r2"], [100, 50], np.random.default_rng(1))
+        self.assertEqual(list(first), ["r1", "r2"])
+        self.assertEqual(first["r1"].tobytes(), second["r1"].tobytes())
+        self.assertEqual(len(first["r2"]), 50)
+        self.assertTrue(set(first["r1"].tobytes()) <= set(b"ACGT"))
+
+    def test_write_fasta(self):
+        genomes = simulate_genomes(["r1", "r2"], [125, 60], np.random.default_rng(1))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            fasta = Path(tmp_dir) / "ref.fa.gz"
+            write_fasta(genomes, fasta, line_width=60)
+            records = get_fai_records(fasta)
+            sequences = list(iter_sequences(fasta))
+        self.assertEqual(
+            [(rec.name, rec.length) for rec in records], [("r1", 125), ("r2", 60)]
+        )
+        self.assertEqual(sequences[0], genomes["r1"].tobytes())
+
+
+@skipUnless(np is not None, "requires numpy")
+class TestVariants(TestCase):
+    def test_apply_variants_in_one_pass(self):
+        genomes = {"r1": np.frombuffer(b"CCCCCAACCGCGGATACGCT", dtype=np.uint8)}
+        variants = [Variant("r1", (9, 10), "AAT"), Variant("r1", (0, 0), "G")]
+        applied = apply_variants(genomes, variants)
+        self.assertEqual(applied["r1"].tobytes(), b"GCCCCAACCAATGGATACGCT")
+
+    def test_overlapping_variants_fail(self):
+        genomes = {"r1": np.frombuffer(b"CCCCCAACCG", dtype=np.uint8)}
+        with self.assertRaises(ValueError):
+            apply_variants(
+                genomes, [Variant("r1", (2, 4), "A"), Variant("r1", (4, 4), "T")]
+            )
+
+    def test_random_snps_change_bases(self):
+        genomes = simulate_genomes(["r1"], [10000], np.random.default_rng(2))
+        snps = random_snps(genomes, 5, np.random.default_rng(2))
+        self.assertEqual(len(snps), 50)
+        for snp in snps:
+            self.assertNotEqual(snp.alt, chr(genomes["r1"][snp.pos[0]]))
+
+
+@skipUnless(np is not None, "requires numpy")
+class TestStreamReads(TestCase):
+    def test_reads_from_genome_at_coverage(self):
+        genomes = simulate_genomes(["r1", "r2"], [1000, 500], np.random.default_rng(3))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            reads_path = Path(tmp_dir) / "reads.fq.gz"
+            num_reads = stream_reads(
+                genomes, reads_path, 50, 10, np.random.default_rng(3), chunk_size=7
+            )
+            with gzip.open(reads_path, "rt") as f:
+                lines = f.read().splitlines()
+
+        self.assertEqual(num_reads, 300)
+        self.assertEqual(len(lines), 4 * num_reads)
+        complement = bytes.maketrans(b"ACGT", b"TGCA")
+        for header, seq in zip(lines[::4], lines[1::4]):
+            seq_id, start, strand = header[1:].split("_")
+            if strand == "-":
+                seq = seq.translate(complement)[::-1]
+            start = int(start)
+            self.assertEqual(
+                seq.encode(), genomes[seq_id][start : start + 50].tobytes()
+            )
+
+    def test_error_model_lowers_qualities(self):
+        genomes = simulate_genomes(["r1"], [1000], np.random.default_rng(4))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            reads_path = Path(tmp_dir) / "reads.fq"
+            stream_reads(
+                genomes,
+                reads_path,
+                100,
+                20,
+                np.random.default_rng(4),
+                error_model=ErrorModel(substitution_rate=0.1, error_quality=2),
+            )
+            quals = reads_path.read_text().splitlines()[3::4]
+        num_errors = sum(qual.count(chr(33 + 2)) for qual in quals)
+        self.assertAlmostEqual(num_errors / (len(quals) * 100), 0.1, delta=0.02)
@@ -1,10 +1,23 @@
+import asyncio
+import os
 import tempfile
 import gzip
-from unittest import TestCase
+import threading
+import time
+from unittest import TestCase, mock
 from pathlib import Path
 
 import cortex.settings as settings
-from cortex.utils import get_sequence_length
+from cortex.utils import (
+    FaiRecord,
+    SyscallCancelled,
+    SyscallTimeout,
+    _scan_fasta,
+    get_fai_records,
+    get_sequence_length,
+    syscall_async,
+    syscall_streaming,
+)
 
 
 class TestResources(TestCase):
@@ -30,3 +43,130 @@ class TestGetSeqLength(TestCase):
 
             seqlen = get_sequence_length(out)
             self.assertEqual(seqlen, 6)
+
+    def test_all_records_counted(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmpfile = Path(tmpdir) / "tmpout.fasta"
+            tmpfile.write_text(">ref1 desc\nAAAC\nAC\n>ref2\nGGG\n>ref3\n")
+            self.assertEqual(get_sequence_length(tmpfile), 9)
+
+
+class TestGetFaiRecords(TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.fasta = Path(self._tmp_dir.name) / "ref.fa"
+        self.fasta.write_text(">ref1 desc\nAAAC\nAC\n>ref2\nGGGGG\nGG\n")
+        self.expected = [
+            FaiRecord("ref1", 6, 11, 4, 5),
+            FaiRecord("ref2", 7, 25, 5, 6),
+        ]
+
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+
+    def test_samtools_compatible_records(self):
+        self.assertEqual(get_fai_records(self.fasta), self.expected)
+        fai = self.fasta.with_name("ref.fa.fai")
+        self.assertEqual(fai.read_text(), "ref1\t6\t11\t4\t5\nref2\t7\t25\t5\t6\n")
+
+    def test_records_split_across_chunks(self):
+        with mock.patch("cortex.utils._SCAN_CHUNK_SIZE", 3):
+            self.assertEqual(get_fai_records(self.fasta), self.expected)
+
+    def test_header_ending_file_is_an_empty_record(self):
+        self.fasta.write_text(">a\nACGT\n>b")
+        for chunk_size in (3, 1 << 20):
+            with mock.patch("cortex.utils._SCAN_CHUNK_SIZE", chunk_size):
+                self.assertEqual(
+                    _scan_fasta(self.fasta),
+                    [FaiRecord("a", 4, 3, 4, 5), FaiRecord("b", 0, 10, 0, 0)],
+                )
+        self.assertEqual(get_sequence_length(self.fasta), 4)
+
+    def test_sidecar_reused_until_fasta_changes(self):
+        get_fai_records(self.fasta)
+        with mock.patch("cortex.utils._scan_fasta") as mock_scan:
+            self.assertEqual(get_fai_records(self.fasta), self.expected)
+            mock_scan.assert_not_called()
+
+        self.fasta.write_text(">ref1\nAC\n")
+        stat = self.fasta.stat()
+        os.utime(self.fasta, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        self.assertEqual(get_fai_records(self.fasta), [FaiRecord("ref1", 2, 6, 2, 3)])
+
+
+class TestSyscallStreaming(TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.log_file = Path(self._tmp_dir.name) / "out.log"
+
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+
+    def test_output_teed_and_stages_reported(self):
+        progress = []
+        syscall_streaming(
+            [
+                "sh",
+                "-c",
+                "echo Building binary; echo loading; echo cleaning; echo done",
+            ],
+            self.log_file,
+            on_progress=lambda stage, line: progress.append((stage, line)),
+        )
+        self.assertEqual(
+            self.log_file.read_text(), "Building binary\nloading\ncleaning\ndone\n"
+        )
+        self.assertEqual(
+            progress, [("building", "Building binary"), ("cleaning", "cleaning")]
+        )
+
+    def test_failing_command_raises(self):
+        with self.assertRaises(RuntimeError):
+            syscall_streaming(["sh", "-c", "echo oops; exit 3"], self.log_file)
+        self.assertEqual(self.log_file.read_text(), "oops\n")
+
+    def test_timeout_kills_process_group(self):
+        start = time.monotonic()
+        with self.assertRaises(SyscallTimeout):
+            syscall_streaming(
+                ["sh", "-c", "sleep 30 & wait"], self.log_file, timeout=0.2
+            )
+        self.assertLess(time.monotonic() - start, 10)
+
+    def test_cancel(self):
+        cancel = threading.Event()
+        threading.Timer(0.2, cancel.set).start()
+        with self.assertRaises(SyscallCancelled):
+            syscall_streaming(["sleep", "30"], self.log_file, cancel=cancel)
+
+
+class TestSyscallAsync(TestCase):
+    def test_output_logged_and_failure_raised(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            log_file = Path(tmp_dir) / "out.log"
+            asyncio.run(syscall_async(["echo", "cleaning"], log_file))
+            self.assertEqual(log_file.read_text(), "cleaning\n")
+
+            with self.assertRaises(RuntimeError):
+                asyncio.run(syscall_async(["sh", "-c", "exit 1"]))
+
+    def test_long_lines_cut(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            log_file = Path(tmp_dir) / "out.log"
+            command = ["sh", "-c", "printf '%05000d\\n' 0; echo cleaning"]
+            with mock.patch("cortex.utils._MAX_LINE_BYTES", 1000):
+                asyncio.run(syscall_async(command, log_file))
+            self.assertEqual(log_file.read_text(), "0" * 1000 + "\ncleaning\n")
+
+    def test_cancellation_kills_process_group(self):
+        async def cancel_soon():
+            task = asyncio.ensure_future(syscall_async(["sh", "-c", "sleep 30 & wait"]))
+            await asyncio.sleep(0.2)
+            task.cancel()
+            await task
+
+        start = time.monotonic()
+        with self.assertRaises(asyncio.CancelledError):
+            asyncio.run(cancel_soon())
+        self.assertLess(time.monotonic() - start, 10)
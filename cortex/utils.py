@@ -1,18 +1,224 @@
+import asyncio
+import contextlib
+import os
+import re
+import signal
 import sys
 import subprocess
 import gzip
+import threading
+import time
+from collections import deque
 from pathlib import Path
+from typing import (
+    Callable,
+    IO,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Pattern,
+    Sequence,
+    Tuple,
+)
 
-from Bio import SeqIO
+_SCAN_CHUNK_SIZE = 1 << 22
 
+# Output lines marking the stages of cortex_var and run_calls.pl, tried in order
+PROGRESS_MARKERS: Sequence[Tuple[str, Pattern]] = (
+    ("cleaning", re.compile(r"\bclean", re.IGNORECASE)),
+    ("bubble calling", re.compile(r"\bbubble", re.IGNORECASE)),
+    ("path divergence calling", re.compile(r"path.?divergence", re.IGNORECASE)),
+    ("vcf generation", re.compile(r"\bvcf", re.IGNORECASE)),
+    ("building", re.compile(r"\b(build|load|dump)", re.IGNORECASE)),
+)
+ProgressCallback = Callable[[str, str], None]
+
+_ERROR_TAIL_LINES = 200
+_KILL_GRACE_SECONDS = 5
+_MAX_LINE_BYTES = 1 << 20
+
+# While set, commands record their process group (they run in their own session) in
+# this directory, for `kill_recorded_process_groups`
+process_group_directory: Optional[Path] = None
+
+
+class SyscallTimeout(RuntimeError):
+    pass
+
+
+class SyscallCancelled(RuntimeError):
+    pass
+
+
+class FaiRecord(NamedTuple):
+    """One line of a samtools faidx (.fai) index"""
+
+    name: str
+    length: int
+    offset: int
+    line_bases: int
+    line_width: int
+
+
+def _scan_fasta(fasta_file_path: Path) -> List[FaiRecord]:
+    """
+    Counts each record's bases in chunks of bytes, without building sequences.
+    Offsets of gzipped files are in uncompressed bytes, as in samtools faidx.
+    """
+    records: List[FaiRecord] = list()
+    name: Optional[str] = None
+    header = bytearray()
+    first_line = bytearray()
+    length = offset = line_bases = line_width = 0
+    in_header = first_line_pending = False
+    at_line_start = True
+    chunk_offset = 0
+
+    def close_record():
+        if name is not None:
+            records.append(FaiRecord(name, length, offset, line_bases, line_width))
 
-def get_sequence_length(fasta_file_path: Path) -> int:
     if fasta_file_path.suffix == ".gz":
-        with gzip.open(fasta_file_path, "rt") as fhandle:
-            record = next(SeqIO.parse(fhandle, "fasta"))
+        fhandle = gzip.open(fasta_file_path, "rb")
     else:
-        record = next(SeqIO.parse(fasta_file_path, "fasta"))
-    return len(record.seq)
+        fhandle = fasta_file_path.open("rb")
+    with fhandle:
+        for chunk in iter(lambda: fhandle.read(_SCAN_CHUNK_SIZE), b""):
+            i = 0
+            while i < len(chunk):
+                if in_header:
+                    newline = chunk.find(b"\n", i)
+                    if newline == -1:
+                        header += chunk[i:]
+                        break
+                    header += chunk[i:newline]
+                    name = header.decode().split()[0] if header.strip() else ""
+                    length = line_bases = line_width = 0
+                    offset = chunk_offset + newline + 1
+                    first_line = bytearray()
+                    in_header, first_line_pending, at_line_start = False, True, True
+                    i = newline + 1
+                elif at_line_start and chunk[i] == ord(">"):
+                    close_record()
+                    header = bytearray()
+                    in_header = True
+                    i += 1
+                else:
+                    next_header = chunk.find(b"\n>", i)
+                    end = len(chunk) if next_header == -1 else next_header + 1
+                    segment = chunk[i:end]
+                    length += (
+                        len(segment)
+                        - segment.count(b"\n")
+                        - segment.count(b"\r")
+                        - segment.count(b" ")
+                    )
+                    if first_line_pending:
+                        newline = segment.find(b"\n")
+                        if newline == -1:
+                            first_line += segment
+                        else:
+                            first_line += segment[:newline]
+                            line_width = len(first_line) + 1
+                            line_bases = len(first_line.rstrip(b"\r"))
+                            first_line_pending = False
+                    at_line_start = segment.endswith(b"\n")
+                    i = end
+            chunk_offset += len(chunk)
+
+    if in_header:
+        # Header ending the file, without a newline: an empty record
+        name = header.decode().split()[0] if header.strip() else ""
+        length = line_bases = line_width = 0
+        offset = chunk_offset
+    elif first_line_pending and name is not None:
+        # Record without a trailing newline
+        line_bases = line_width = len(first_line)
+    close_record()
+    return records
+
+
+def _fai_paths(fasta_file_path: Path):
+    fai = fasta_file_path.with_name(fasta_file_path.name + ".fai")
+    return fai, fai.with_name(fai.name + ".stamp")
+
+
+def _stamp(fasta_file_path: Path) -> str:
+    stat = fasta_file_path.stat()
+    return f"{stat.st_size}\t{stat.st_mtime_ns}"
+
+
+def _read_fai(fai: Path) -> List[FaiRecord]:
+    records = list()
+    with fai.open() as f:
+        for line in f:
+            name, *numbers = line.rstrip("\n").split("\t")[:5]
+            records.append(FaiRecord(name, *map(int, numbers)))
+    return records
+
+
+def _write_fai(fasta_file_path: Path, records: List[FaiRecord]):
+    fai, stamp = _fai_paths(fasta_file_path)
+    tmp_fai = fai.with_name(f".{fai.name}.{os.getpid()}.tmp")
+    try:
+        with tmp_fai.open("w") as f:
+            for record in records:
+                print(*record, sep="\t", file=f)
+        os.replace(tmp_fai, fai)
+        stamp.write_text(_stamp(fasta_file_path))
+    except OSError:
+        # E.g. reference in a read-only directory: just don't keep the index
+        if tmp_fai.exists():
+            tmp_fai.unlink()
+
+
+def get_fai_records(fasta_file_path: Path) -> List[FaiRecord]:
+    """
+    Per-record lengths of a fasta[.gz] file, from a .fai sidecar next to it when
+    that is still valid, otherwise from scanning the file (and writing the sidecar).
+
+    The sidecar is valid if its .stamp still matches the fasta's size and mtime,
+    or failing a stamp (e.g. made by samtools), if it is newer than the fasta.
+    """
+    fasta_file_path = Path(fasta_file_path)
+    fai, stamp = _fai_paths(fasta_file_path)
+    try:
+        if stamp.exists():
+            valid = stamp.read_text() == _stamp(fasta_file_path)
+        else:
+            valid = fai.stat().st_mtime_ns >= fasta_file_path.stat().st_mtime_ns
+        if valid:
+            return _read_fai(fai)
+    except (OSError, ValueError, TypeError):
+        pass
+
+    records = _scan_fasta(fasta_file_path)
+    _write_fai(fasta_file_path, records)
+    return records
+
+
+def get_sequence_length(fasta_file_path: Path) -> int:
+    """Number of bases across all records of a fasta[.gz] file"""
+    return sum(record.length for record in get_fai_records(fasta_file_path))
+
+
+def disk_usage(directory: Path) -> int:
+    """Bytes in the files under `directory`, tolerating concurrent deletions"""
+    total = 0
+    for dirpath, _, filenames in os.walk(str(directory)):
+        for filename in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, filename)).st_size
+            except FileNotFoundError:
+                continue
+    return total
+
+
+def _print_command_failure(command, returncode: int, output: str):
+    print("Error running this command:", command, file=sys.stderr)
+    print("Return code:", returncode, file=sys.stderr)
+    print("Output from stdout and stderr:", output, sep="\n", file=sys.stderr)
 
 
 def syscall(command):
@@ -26,12 +232,225 @@ def syscall(command):
     if completed_process.returncode == 0:
         return completed_process
 
-    print("Error running this command:", command, file=sys.stderr)
-    print("Return code:", completed_process.returncode, file=sys.stderr)
-    print(
-        "Output from stdout and stderr:",
-        completed_process.stdout,
-        sep="\n",
-        file=sys.stderr,
+    _print_command_failure(
+        command, completed_process.returncode, completed_process.stdout
     )
     raise RuntimeError("Error in system call. Cannot continue")
+
+
+@contextlib.contextmanager
+def _recording_process_group(pgid: int) -> Iterator[None]:
+    """Records the command's process group while in the context, if recording"""
+    if process_group_directory is None:
+        yield
+        return
+    record = process_group_directory / str(pgid)
+    record.touch()
+    try:
+        yield
+    finally:
+        record.unlink(missing_ok=True)
+
+
+def kill_recorded_process_groups(directory: Path):
+    """
+    Kills the process groups recorded in `directory`: those of commands whose
+    process died (e.g. killed) without killing them
+    """
+    for record in directory.iterdir():
+        try:
+            os.killpg(int(record.name), signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        record.unlink()
+
+
+def _kill_process_group(process: subprocess.Popen):
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        return
+    try:
+        process.wait(_KILL_GRACE_SECONDS)
+    except subprocess.TimeoutExpired:
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+
+class _OutputTee:
+    """
+    Writes command output lines to an (optional) log, keeping only the last lines
+    and reporting each new stage seen in them.
+    """
+
+    def __init__(
+        self,
+        log: Optional[IO[str]],
+        on_progress: Optional[ProgressCallback],
+        markers: Sequence[Tuple[str, Pattern]],
+    ):
+        self.log = log
+        self.on_progress = on_progress
+        self.markers = markers
+        self.tail: deque = deque(maxlen=_ERROR_TAIL_LINES)
+        self.stage: Optional[str] = None
+
+    def write(self, line: str):
+        if self.log is not None:
+            self.log.write(line)
+        self.tail.append(line)
+        if self.on_progress is None:
+            return
+        for stage, pattern in self.markers:
+            if pattern.search(line):
+                if stage != self.stage:
+                    self.stage = stage
+                    self.on_progress(stage, line.rstrip("\n"))
+                return
+
+
+def _open_log(log_file: Optional[Path]):
+    if log_file is None:
+        return contextlib.nullcontext()
+    return open(str(log_file), "a")
+
+
+def syscall_streaming(
+    command,
+    log_file: Path,
+    on_progress: Optional[ProgressCallback] = None,
+    timeout: Optional[float] = None,
+    cancel: Optional[threading.Event] = None,
+    markers: Sequence[Tuple[str, Pattern]] = PROGRESS_MARKERS,
+) -> None:
+    """
+    Like `syscall`, but tees output line by line to `log_file` instead of holding it
+    all in memory (only the last lines are kept, to report errors).
+
+    `on_progress(stage, line)` gets called each time a line matches the marker of a
+    new stage. The command and all its descendants are killed if it runs for longer
+    than `timeout` seconds, or once `cancel` is set.
+    """
+    command = list(map(str, command))
+    stop_reasons: List[str] = list()
+    finished = threading.Event()
+
+    process = subprocess.Popen(
+        command,
+        stderr=subprocess.STDOUT,
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+        start_new_session=True,
+    )
+
+    def watch():
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not finished.wait(0.1):
+            if cancel is not None and cancel.is_set():
+                stop_reasons.append("cancelled")
+            elif deadline is not None and time.monotonic() > deadline:
+                stop_reasons.append(f"timed out after {timeout}s")
+            else:
+                continue
+            _kill_process_group(process)
+            return
+
+    with _recording_process_group(process.pid):
+        watcher = threading.Thread(target=watch, daemon=True)
+        watcher.start()
+        try:
+            with _open_log(log_file) as log:
+                tee = _OutputTee(log, on_progress, markers)
+                for line in process.stdout:
+                    tee.write(line)
+            returncode = process.wait()
+        except BaseException:
+            # E.g. KeyboardInterrupt, or a failing callback: don't leave orphans running
+            _kill_process_group(process)
+            raise
+        finally:
+            finished.set()
+            watcher.join()
+            process.stdout.close()
+
+    if stop_reasons:
+        error_class = (
+            SyscallCancelled if stop_reasons[0] == "cancelled" else SyscallTimeout
+        )
+        raise error_class(f"Command {stop_reasons[0]}: {command}")
+    if returncode != 0:
+        _print_command_failure(command, returncode, "".join(tee.tail))
+        raise RuntimeError("Error in system call. Cannot continue")
+
+
+async def _kill_process_group_async(process: asyncio.subprocess.Process):
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        return
+    try:
+        await asyncio.wait_for(process.wait(), _KILL_GRACE_SECONDS)
+    except asyncio.TimeoutError:
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        await process.wait()
+
+
+async def _read_line(stream: asyncio.StreamReader) -> bytes:
+    """
+    The stream's next line (b"" at its end), cut to `_MAX_LINE_BYTES`: longer lines
+    overrun the stream's limit, and get drained up to their newline
+    """
+    line = b""
+    while True:
+        try:
+            rest = await stream.readuntil(b"\n")
+        except asyncio.IncompleteReadError as error:
+            rest = error.partial  # The last line, without a newline
+        except asyncio.LimitOverrunError as error:
+            line += await stream.read(error.consumed)
+            line = line[:_MAX_LINE_BYTES]
+            continue
+        if len(line) + len(rest) > _MAX_LINE_BYTES:
+            return (line + rest)[:_MAX_LINE_BYTES] + b"\n"
+        return line + rest
+
+
+async def syscall_async(
+    command,
+    log_file: Optional[Path] = None,
+    on_progress: Optional[ProgressCallback] = None,
+    markers: Sequence[Tuple[str, Pattern]] = PROGRESS_MARKERS,
+) -> None:
+    """
+    `syscall_streaming` for asyncio. Cancelling it kills the command and all its
+    descendants; use `asyncio.wait_for` for a timeout.
+    """
+    command = list(map(str, command))
+    process = await asyncio.create_subprocess_exec(
+        *command,
+        stderr=subprocess.STDOUT,
+        stdout=subprocess.PIPE,
+        start_new_session=True,
+        limit=_MAX_LINE_BYTES,
+    )
+    try:
+        with _open_log(log_file) as log:
+            tee = _OutputTee(log, on_progress, markers)
+            while True:
+                line = await _read_line(process.stdout)
+                if not line:
+                    break
+                tee.write(line.decode(errors="replace"))
+        returncode = await process.wait()
+    except BaseException:
+        await _kill_process_group_async(process)
+        raise
+
+    if returncode != 0:
+        _print_command_failure(command, returncode, "".join(tee.tail))
+        raise RuntimeError("Error in system call. Cannot continue")
@@ -58,8 +58,10 @@ setuptools.setup(
     long_description=readme,
     long_description_content_type="text/markdown",
     install_requires=["biopython == 1.76"],
+    extras_require={"benchmark": ["numpy"]},
     packages=setuptools.find_packages("."),
     include_package_data=True,
     test_suite="cortex.tests",
+    entry_points={"console_scripts": ["py-cortex = cortex.cli:main"]},
     cmdclass=dict(build_py=_BuildCommand, develop=_DevelopCommand),
 )